@@ -7,6 +7,13 @@ from app.services.chucking.sentence_chunker import chunk_by_sentences
 from app.services.chucking.hierarchical_chunker import chunk_hierarchical
 from app.services.pdf_ingest import sha256_bytes, extract_pages
 from app.core.settings import settings
+from app.core.executors import run_index
+from app.core.global_state import resources
+from app.services.response_cache import response_cache
+from app.services.embedding_cache import peek_embedding_cache
+from app.services.milvus_store import get_writer, segment_stats
+from app.services.router import router_stats
+from app.services.chucking.tokenizers import loaded_tokenizers
 
 router = APIRouter()
 
@@ -32,7 +39,7 @@ async def debug_chunking(
     doc_id = sha256_bytes(pdf_bytes)
 
     # 2) Extract pages
-    pages = extract_pages(pdf_bytes)
+    pages = await run_index(extract_pages, pdf_bytes)
 
     # 3) Chunking theo strategy
     if strategy == "token":
@@ -94,4 +101,51 @@ async def debug_chunking(
             }
             for c in chunks
         ],
-    }
\ No newline at end of file
+    }
+
+@router.get("/debug/caches")
+def debug_caches():
+    """Thống kê các cache (hit / miss / eviction) để theo dõi hiệu quả. Model / cache chưa dùng tới -> None."""
+    embedder = resources.peek("embedder")
+    reranker = resources.peek("reranker")
+    pipeline = resources.peek("pipeline")
+    chunk_cache = peek_embedding_cache(embedder.model_name, embedder.dim) if embedder else None
+    return {
+        "query_embedding": embedder.query_cache.stats() if embedder else None,
+        "chunk_embedding": chunk_cache.stats() if chunk_cache else None,
+        "rerank_scores": reranker.score_cache.stats() if reranker else None,
+        "query_expansion": pipeline.expansion_cache.stats() if pipeline else None,
+        "responses": response_cache.stats(),
+    }
+
+@router.get("/debug/router")
+def debug_router():
+    """Số request và thời gian xử lý của từng tầng Router (rules / embedding / llm)."""
+    return router_stats()
+
+@router.get("/debug/batching")
+def debug_batching():
+    """Histogram kích thước batch và thời gian chờ trong hàng đợi của micro-batcher encode / rerank."""
+    embedding_batcher = resources.peek("embedding_batcher")
+    rerank_scheduler = resources.peek("rerank_scheduler")
+    return {
+        "embedding": {"enabled": settings.embed_batch_enabled, **(embedding_batcher.stats() if embedding_batcher else {})},
+        "rerank": {"enabled": settings.rerank_batch_enabled, **(rerank_scheduler.stats() if rerank_scheduler else {})},
+    }
+
+@router.get("/debug/milvus")
+def debug_milvus():
+    """Thông lượng insert của writer (dòng/s, MB/s, số lần flush) + số segment theo trạng thái."""
+    collection = resources.peek("collection")
+    if collection is None:
+        return {"loaded": False}
+    try:
+        segments = segment_stats(collection)
+    except Exception as e:
+        segments = {"error": str(e)}
+    return {"writer": get_writer(collection).stats(), "segments": segments}
+
+@router.get("/debug/resources")
+def debug_resources():
+    """Model / tài nguyên dùng chung: đã load chưa, thời gian load, dung lượng tham số, RSS tăng thêm."""
+    return {**resources.stats(), "tokenizers_load_seconds": loaded_tokenizers()}
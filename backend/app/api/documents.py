@@ -1,89 +1,326 @@
-from typing import List
-from fastapi import APIRouter, UploadFile, File, HTTPException
+import asyncio
+import os
+import shutil
+import time
+import zipfile
+from typing import List, Optional
+from fastapi import APIRouter, UploadFile, File, HTTPException, Response
 from app.core.settings import settings
-from app.schemas.document import IngestResponse
-from app.services.pdf_ingest import sha256_bytes, extract_pages
-from app.services.chucking.hierarchical_chunker import chunk_hierarchical
-from app.services.embedding import LocalEmbedder
-from app.services.milvus_store import ensure_collection, insert_chunks
+from app.schemas.document import BulkIngestJobResponse, IngestJobResponse
+from app.services.pdf_ingest import sha256_bytes, sha256_zip_member, archive_pdf_members
+from app.services.ingest_pipeline import IngestProgress, IngestSource, stream_ingest, stream_ingest_many
+from app.services.ingest_jobs import ingest_jobs, read_spool
+from app.services.bm25_index import BM25Accumulator
+from app.services.document_registry import document_registry
+from app.services.milvus_store import delete_document
 from app.services.minio_store import upload_pdf_to_minio, get_file_stream
 from app.services.minio_store import list_files_in_minio
 from fastapi.responses import StreamingResponse
+from app.core.executors import run_index
+from app.services.response_cache import response_cache
 
-from app.core.global_state import global_rag_pipeline, collection 
-from app.services.milvus_store import get_all_documents
+from app.core.global_state import aget_pipeline
 
 router = APIRouter(prefix="/documents", tags=["documents"])
 
-# init once
-embedder = LocalEmbedder(settings.embed_model)
-collection = ensure_collection(dim=embedder.dim)
+async def _process_ingest_job(job: dict, progress: IngestProgress) -> dict:
+    """Handler của worker ingest: chạy ingest rồi ghi kết quả vào document registry."""
+    try:
+        result = await _ingest_document(job, progress)
+    except Exception:
+        # Lần upload sau của cùng nội dung sẽ được ingest lại
+        document_registry.mark_failed(job["document_id"])
+        raise
+    document_registry.mark_indexed(job["document_id"], pages=progress.total_pages, chunks=result["chunks_inserted"])
+    return result
 
-@router.post("/ingest", response_model=IngestResponse)
-async def ingest_pdf(file: UploadFile = File(...)):
-    pdf_bytes = await file.read()
-    doc_hash = sha256_bytes(pdf_bytes)
-    document_id = doc_hash[:12]
+async def _ingest_document(job: dict, progress: IngestProgress) -> dict:
+    """MinIO -> pipeline theo luồng -> BM25 / cache."""
+    document_id = job["document_id"]
+    filename = job["filename"]
+    pdf_bytes = await asyncio.to_thread(read_spool, job)
+    # Model / collection dùng chung với query (không tạo bản riêng cho upload)
+    pipeline = await aget_pipeline()
 
     # --- [SỬA 1] LƯU MINIO BẰNG TÊN FILE GỐC ---
     # Để khi Frontend gọi /view/ten_file.pdf thì MinIO mới tìm thấy.
     # (Code cũ dùng document_id.pdf khiến frontend bị lỗi 404 khi bấm xem)
-    minio_filename = file.filename 
-
+    progress.stage = "upload"
     try:
-        upload_pdf_to_minio(
-            file_bytes=pdf_bytes, 
-            file_name=minio_filename
-        )
-        print(f"✅ Đã lưu file vào MinIO: {minio_filename}")
-        
+        await run_index(upload_pdf_to_minio, file_bytes=pdf_bytes, file_name=filename)
+        print(f"✅ Đã lưu file vào MinIO: {filename}")
     except Exception as e:
         print(f"❌ Lỗi MinIO: {e}")
 
-    # Xử lý Chunking
-    pages = extract_pages(pdf_bytes)
-    chunks = chunk_hierarchical(
-        pages=pages,
-        tokenizer_model=settings.embed_model,
-        coarse_target_tokens=512,
-        coarse_overlap_tokens=200,
-        chunk_size=128,
-        overlap_sentences=2,
-        return_level="both", 
+    # Job chạy lại sau restart, hoặc tiếp quản bản ghi của lần ingest trước (vd: lần trước lỗi):
+    # dọn phần chunk đã insert dở còn trong Milvus
+    if job["attempts"] > 1 or document_registry.reclaimed(document_id):
+        await run_index(delete_document, pipeline.collection, document_id)
+
+    # Extract -> chunk -> embed -> insert chạy theo luồng, từng batch một
+    # (batch vừa insert được tokenize luôn cho BM25, không giữ lại dòng)
+    bm25 = BM25Accumulator()
+    inserted = await stream_ingest(
+        pdf_bytes,
+        document_id=document_id,
+        filename=filename,
+        embedder=pipeline.embedder,
+        collection=pipeline.collection,
+        progress=progress,
+        bm25=bm25,
     )
 
-    texts = [c["text"] for c in chunks]
-    vecs = embedder.encode(texts)
-
-    rows = []
-    for c, v in zip(chunks, vecs):
-        rows.append({
-            "document_id": document_id,
-            "chunk_id": c["chunk_id"],
-            "page_start": c["page_start"],
-            "page_end": c["page_end"],
-            "text": c["text"],
-            "embedding": v,
-            "level": c.get("level", "standard"),
-            "parent_id": c.get("parent_id") or "",
-            
-            # --- [SỬA 2] THÊM METADATA ---
-            # Đây là phần quan trọng để Frontend hiển thị được tên file
-            "metadata": {
-                "source": file.filename,  # <--- Tên file hiển thị
-                "page": c["page_start"],  # Số trang
-                "total_pages": len(pages)
-            }
-        })
-
-    insert_chunks(collection, rows)
-    
-    # Reload lại BM25 Search
+    # Cập nhật BM25 tăng dần (chỉ chunk của tài liệu này, không kéo lại toàn bộ corpus)
+    progress.stage = "bm25"
     print("⚡ Triggering BM25 Update...")
-    current_docs = get_all_documents(collection)
-    global_rag_pipeline.reload_bm25(current_docs)
-    
-    return IngestResponse(document_id=document_id, chunks_inserted=len(rows), filename=file.filename)
+    await run_index(pipeline.commit_bm25, bm25)
+    # Corpus đổi -> câu trả lời đã cache có thể lỗi thời
+    response_cache.bump_corpus_version()
+
+    return {"document_id": document_id, "chunks_inserted": inserted, "filename": filename}
+
+def _store_alias(data: bytes, name: Optional[str], existing: dict):
+    """
+    Nội dung đã có / đang ingest nhưng upload dưới tên file mới (registry đã ghi thêm tên này):
+    lưu object MinIO dưới tên mới để tải được file theo mọi tên mà registry liệt kê.
+    """
+    if not name or name == existing["filename"]:
+        return
+    try:
+        upload_pdf_to_minio(file_bytes=data, file_name=name)
+    except Exception as e:
+        print(f"❌ Lỗi MinIO ({name}): {e}")
+
+def _skipped(document_id: str, name: str, reason: str) -> dict:
+    return {"document_id": document_id, "filename": name, "status": "skipped", "pages": 0, "chunks_inserted": 0, "error": reason}
+
+def _scan_archive(zf: zipfile.ZipFile, job_id: str) -> tuple:
+    """
+    Liệt kê PDF trong zip + document_id (sha256[:12]) của từng file.
+    PDF trùng nội dung (trong cùng lô, hoặc đã có / đang ingest theo document registry)
+    không ingest lại, báo "skipped".
+    """
+    members, skipped, seen = [], [], {}
+    for info in archive_pdf_members(zf):
+        name = os.path.basename(info.filename)
+        try:
+            digest = sha256_zip_member(zf, info)
+        except Exception as e:
+            skipped.append({**_skipped("", name, f"{type(e).__name__}: {e}"), "status": "failed"})
+            continue
+        document_id = digest[:12]
+        if document_id in seen:
+            skipped.append(_skipped(document_id, name, f"Trùng nội dung với '{seen[document_id]}'"))
+            continue
+        seen[document_id] = name
+        existing = document_registry.claim(document_id, digest, name, job_id)
+        if existing is not None:
+            _store_alias(zf.read(info), name, existing)
+            reason = "Đã có trong index" if existing["status"] == "indexed" else f"Đang được ingest bởi job {existing['job_id']}"
+            skipped.append(_skipped(document_id, name, reason))
+            continue
+        members.append((info, name, document_id))
+    return members, skipped
+
+def _archive_source(zf: zipfile.ZipFile, info: zipfile.ZipInfo, name: str, document_id: str) -> IngestSource:
+    def read() -> bytes:
+        # Gọi trong thread chunking, lúc tới lượt file này -> upload MinIO chạy chồng với embed file trước
+        data = zf.read(info)
+        try:
+            upload_pdf_to_minio(file_bytes=data, file_name=name)
+        except Exception as e:
+            print(f"❌ Lỗi MinIO ({name}): {e}")
+        return data
+    return IngestSource(document_id, name, read)
+
+async def _process_bulk_job(job: dict, progress: IngestProgress) -> dict:
+    """
+    Handler job bulk: mọi PDF trong zip đi chung 1 pipeline (batch embed / insert gộp nhiều
+    tài liệu, flush 1 lần), BM25 + cache cập nhật 1 lần cho cả lô.
+    """
+    pipeline = await aget_pipeline()
+    zf = zipfile.ZipFile(job["spool_path"])
+    sources: List[IngestSource] = []
+    bm25 = BM25Accumulator()
+    try:
+        progress.stage = "scan"
+        members, skipped = await run_index(_scan_archive, zf, job["id"])
+        sources = [_archive_source(zf, info, name, document_id) for info, name, document_id in members]
+
+        # Job chạy lại sau restart, hoặc tài liệu từng được ingest (lần trước lỗi...):
+        # dọn phần chunk đã insert dở còn trong Milvus
+        for src in sources:
+            if job["attempts"] > 1 or document_registry.reclaimed(src.document_id):
+                await run_index(delete_document, pipeline.collection, src.document_id)
+
+        await stream_ingest_many(
+            sources,
+            embedder=pipeline.embedder,
+            collection=pipeline.collection,
+            progress=progress,
+            insert_batch_size=settings.ingest_bulk_insert_batch_size,
+            barrier=True,
+            bm25=bm25,
+        )
+    except Exception:
+        for src in sources:
+            document_registry.mark_failed(src.document_id)
+        raise
+    finally:
+        zf.close()
+
+    for src in sources:
+        if src.error is None:
+            document_registry.mark_indexed(src.document_id, pages=src.total_pages, chunks=src.inserted)
+        else:
+            document_registry.mark_failed(src.document_id)
+
+    # BM25: 1 snapshot mới cho cả lô thay vì 1 lần / tài liệu (tài liệu lỗi đã bị bỏ khỏi accumulator)
+    progress.stage = "bm25"
+    if bm25.document_ids():
+        await run_index(pipeline.commit_bm25, bm25)
+        response_cache.bump_corpus_version()
+
+    files = [src.result() for src in sources] + skipped
+    done = [f for f in files if f["status"] == "done"]
+    pages = sum(f["pages"] for f in done)
+    chunks = sum(f["chunks_inserted"] for f in done)
+    elapsed = time.time() - progress.started_at
+    return {
+        "files": files,
+        "documents_ingested": len(done),
+        "documents_failed": sum(f["status"] == "failed" for f in files),
+        "documents_skipped": sum(f["status"] == "skipped" for f in files),
+        "pages": pages,
+        "chunks_inserted": chunks,
+        "elapsed_seconds": round(elapsed, 3),
+        "pages_per_sec": round(pages / elapsed, 2) if elapsed else 0.0,
+        "chunks_per_sec": round(chunks / elapsed, 2) if elapsed else 0.0,
+    }
+
+ingest_jobs.set_handler(_process_ingest_job)
+ingest_jobs.set_handler(_process_bulk_job, kind="bulk")
+
+@router.post("/ingest", response_model=IngestJobResponse, status_code=202)
+async def ingest_pdf(response: Response, file: UploadFile = File(...)):
+    """
+    Nhận file và trả job id ngay; xử lý chạy nền, theo dõi qua GET /documents/jobs/{job_id}.
+    Nội dung đã index (cùng sha256) -> trả 200 ngay, không tạo job (tên file mới được ghi vào registry + MinIO).
+    Nội dung đang được ingest -> trả lại job đang chạy.
+    """
+    pdf_bytes = await file.read()
+    doc_hash = await asyncio.to_thread(sha256_bytes, pdf_bytes)
+    document_id = doc_hash[:12]
+
+    job_id = ingest_jobs.new_job_id()
+    existing = document_registry.claim(document_id, doc_hash, file.filename, job_id)
+    if existing is not None:
+        await run_index(_store_alias, pdf_bytes, file.filename, existing)
+        if existing["status"] == "indexed":
+            response.status_code = 200
+            return IngestJobResponse(
+                job_id=None,
+                status="duplicate",
+                document_id=document_id,
+                filename=file.filename,
+                duplicate_of=existing["filename"],
+                chunks=existing["chunks"],
+            )
+        job = ingest_jobs.get(existing["job_id"])
+        return IngestJobResponse(
+            job_id=existing["job_id"],
+            status=job["status"] if job else "queued",
+            document_id=document_id,
+            filename=file.filename,
+            duplicate_of=existing["filename"],
+        )
+
+    try:
+        job = await ingest_jobs.submit(pdf_bytes, filename=file.filename, document_id=document_id, job_id=job_id)
+    except Exception:
+        document_registry.mark_failed(document_id)
+        raise
+    return IngestJobResponse(job_id=job["job_id"], status=job["status"], document_id=document_id, filename=file.filename)
+
+def _copy_upload(src, path: str):
+    with open(path, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1 << 20)
+
+def _zip_uploads(items: List[tuple], path: str):
+    """
+    Đóng gói nhiều PDF upload thành 1 zip spool (ZIP_STORED: PDF vốn đã nén) để chạy thành 1 job.
+    Copy từng khối từ file tạm của upload sang zip trên đĩa, không đọc cả file vào RAM.
+    """
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED) as zf:
+        for i, (name, src) in enumerate(items):
+            src.seek(0, os.SEEK_END)
+            # Tiền tố thứ tự: 2 file cùng tên vẫn là 2 entry riêng
+            info = zipfile.ZipInfo(f"{i:05d}/{name}")
+            # Biết trước kích thước -> zipfile tự bật zip64 cho file lớn
+            info.file_size = src.tell()
+            src.seek(0)
+            with zf.open(info, "w") as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+
+def _count_archive_pdfs(path: str) -> int:
+    with zipfile.ZipFile(path) as zf:
+        return len(archive_pdf_members(zf))
+
+@router.post("/ingest/bulk", response_model=BulkIngestJobResponse, status_code=202)
+async def ingest_bulk(files: List[UploadFile] = File(...)):
+    """
+    Ingest nhiều PDF (nhiều file, hoặc 1 file .zip chứa PDF) trong 1 job nền.
+    Upload được ghi thẳng ra file spool của job (không giữ trong RAM).
+    Kết quả từng file + tốc độ tổng (trang/s, chunk/s) xem qua GET /documents/jobs/{job_id}.
+    """
+    names = [f.filename or "" for f in files]
+    single_zip = len(files) == 1 and names[0].lower().endswith(".zip")
+    if not single_zip and not all(n.lower().endswith(".pdf") for n in names):
+        raise HTTPException(status_code=400, detail="Chỉ nhận file .pdf hoặc 1 file .zip")
+
+    job_id = ingest_jobs.new_job_id()
+    spool_path = ingest_jobs.spool_path(job_id, kind="bulk")
+    try:
+        if single_zip:
+            await asyncio.to_thread(_copy_upload, files[0].file, spool_path)
+            label = names[0]
+        else:
+            items = [(os.path.basename(n), f.file) for n, f in zip(names, files)]
+            await asyncio.to_thread(_zip_uploads, items, spool_path)
+            label = f"{len(files)} files"
+
+        try:
+            n_pdfs = await asyncio.to_thread(_count_archive_pdfs, spool_path)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail="File zip không hợp lệ")
+        if n_pdfs == 0:
+            raise HTTPException(status_code=400, detail="Không có file PDF nào")
+        if n_pdfs > settings.ingest_bulk_max_files:
+            raise HTTPException(status_code=400, detail=f"Tối đa {settings.ingest_bulk_max_files} PDF mỗi lần")
+
+        job = await ingest_jobs.submit_spooled(job_id, filename=label, document_id=None, kind="bulk")
+    except Exception:
+        # Không tạo được job -> không để lại file spool mồ côi
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+        raise
+    return BulkIngestJobResponse(job_id=job["job_id"], status=job["status"], files=n_pdfs, filename=label)
+
+@router.get("/registry/{document_id}")
+def get_registered_document(document_id: str):
+    """Bản ghi registry của 1 tài liệu: trạng thái, các tên file đã upload, số trang / chunk."""
+    doc = document_registry.get(document_id)
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy tài liệu")
+    return doc
+
+@router.get("/jobs/{job_id}")
+def get_ingest_job(job_id: str):
+    """Trạng thái job ingest: stage, tiến độ, tốc độ (trang/s, chunk/s), lỗi nếu có."""
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy job")
+    return job
 
 @router.get("", response_model=List[dict])
 async def get_documents():
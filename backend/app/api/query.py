@@ -1,21 +1,52 @@
+import asyncio
 import json
+import time
 from fastapi import APIRouter
 from fastapi.responses import StreamingResponse
 from app.schemas.query import AskRequest, Message
-# Import Pipeline toàn cục (để dùng chung RAM với bên upload)
-from app.core.global_state import global_rag_pipeline
+# Pipeline dùng chung (1 bản model cho cả query và upload), load lười lần đầu
+from app.core.global_state import aget_pipeline
 from app.services.llm_client import call_llm, call_llm_general
 # Import service Chat History (MongoDB)
 from app.services.chat_history import get_chat_history, add_message_to_history
 import uuid
 
 from app.services.router import route_query
+from app.services.response_cache import response_cache
+from app.core.settings import settings
 
 
 router = APIRouter(prefix="", tags=["query"])
 
 # --- LƯU Ý: ĐÃ XÓA ĐOẠN KHỞI TẠO LOCAL MODEL ĐỂ TIẾT KIỆM RAM ---
-# Chúng ta dùng global_rag_pipeline được import ở trên.
+# Chúng ta dùng pipeline chung lấy qua aget_pipeline().
+
+def _cancel(task: asyncio.Task):
+    """Hủy task chạy suy đoán (speculative) và nuốt exception để không bị log 'never retrieved'."""
+    task.cancel()
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+def _ndjson(event: dict) -> str:
+    return json.dumps(event, ensure_ascii=False) + "\n"
+
+async def _replay_cached(entry: dict, session_id: str, question: str):
+    """Phát lại câu trả lời đã cache theo đúng thứ tự event như lần stream gốc."""
+    started = time.perf_counter()
+    full_answer = ""
+    for event in entry["events"]:
+        if event["type"] == "meta_info":
+            event = {**event, "session_id": session_id}
+            yield _ndjson(event)
+            await add_message_to_history(session_id, "user", question)
+            continue
+        if event["type"] == "answer":
+            full_answer += event["payload"]
+        yield _ndjson(event)
+        await asyncio.sleep(0)  # nhường event loop giữa các event
+
+    if full_answer:
+        await add_message_to_history(session_id, "assistant", full_answer)
+    response_cache.record_replay(entry, time.perf_counter() - started)
 
 @router.post("/ask")
 async def ask(req: AskRequest):
@@ -27,29 +58,68 @@ async def ask(req: AskRequest):
     4. Lưu lại hội thoại mới vào MongoDB
     """
     session_id = req.session_id if req.session_id else str(uuid.uuid4())
-    # --- BƯỚC 1: CHUẨN BỊ DỮ LIỆU (Lấy History từ DB) ---
+    started = time.perf_counter()
+    pipeline = await aget_pipeline()
+    corpus_version = response_cache.corpus_version
+
+    # --- BƯỚC 1: CHẠY SONG SONG CÁC BƯỚC ĐỘC LẬP ---
+    # History (MongoDB), Router (LLM) và Retrieval (Expansion + Search câu gốc)
+    # không phụ thuộc nhau -> khởi động cùng lúc thay vì 3 round trip nối tiếp.
+    # Retrieval là suy đoán: nếu Router nói GENERAL thì hủy.
     # Thay vì tin vào req.history (client gửi), ta lấy từ Database cho chuẩn
-    db_history_dicts = await get_chat_history(session_id)
+    history_task = asyncio.create_task(get_chat_history(session_id))
+    route_task = asyncio.create_task(route_query(req.question, embed_queries=pipeline.embed_queries))
+    retrieval_task = asyncio.create_task(
+        pipeline.retrieve(req.question, topk=req.topk)
+    )
+
+    try:
+        db_history_dicts = await history_task
+
+        # Cache câu trả lời (tùy chọn): trúng cache thì hủy router/retrieval và phát lại
+        cache_key = None
+        if settings.response_cache_enabled:
+            cache_key = response_cache.make_key(req.question, db_history_dicts)
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                print("⚡ Response cache hit")
+                _cancel(route_task)
+                _cancel(retrieval_task)
+                return StreamingResponse(
+                    _replay_cached(cached, session_id, req.question),
+                    media_type="application/x-ndjson",
+                )
+
+        initial_mode = await route_task
+        print(f"🎯 Router Initial: {initial_mode}")
+        if initial_mode != "RAG":
+            _cancel(retrieval_task)
+    except BaseException:
+        for t in (history_task, route_task, retrieval_task):
+            _cancel(t)
+        raise
 
     # Convert từ dict của Mongo sang object Message để call_llm hiểu
     # (Nếu db trả về rỗng thì list này rỗng, không sao cả)
     history_objs = [Message(**msg) for msg in db_history_dicts]
-
-    initial_mode = await route_query(req.question)
-    print(f"🎯 Router Initial: {initial_mode}")
     
 
     async def response_generator():
         final_mode = initial_mode
         unique_hits = []
+        # Ghi lại các event đã stream để đưa vào response cache
+        events = []
+
+        def emit(event: dict) -> str:
+            events.append(event)
+            return _ndjson(event)
         
         # --- BƯỚC QUAN TRỌNG: RAG FALLBACK LOGIC ---
         if initial_mode == "RAG":
-            # A. Thử tìm kiếm trong Vector DB
-            unique_hits = await global_rag_pipeline.run(
-                original_question=req.question,
-                topk=req.topk,
-                rerank_topn=req.rerank_topn
+            # A. Lấy kết quả tìm kiếm đã chạy song song ở trên rồi Rerank
+            _, candidates = await retrieval_task
+            unique_hits = await pipeline.rerank(
+                req.question, candidates, rerank_topn=req.rerank_topn
             )
 
             # B. Kiểm tra chất lượng kết quả (Fallback)
@@ -72,11 +142,12 @@ async def ask(req: AskRequest):
                 unique_hits = [] # Xóa kết quả rác để không làm nhiễu LLM
 
         # 3. Gửi thông tin Mode về cho Client (để hiện màu Badge)
-        yield json.dumps({
+        events.append({"type": "meta_info", "mode": final_mode})
+        yield _ndjson({
             "type": "meta_info", 
             "session_id": session_id,
             "mode": final_mode # Client sẽ hiển thị General (Tím) hoặc RAG (Xanh) dựa vào cái này
-        }, ensure_ascii=False) + "\n"
+        })
 
         # 4. Lưu câu hỏi User
         await add_message_to_history(session_id, "user", req.question)
@@ -94,13 +165,13 @@ async def ask(req: AskRequest):
                     "rerank_score": h.get("rerank_score", 0), "metadata": h.get("metadata")
                 } for h in unique_hits
             ]
-            yield json.dumps({"type": "context", "payload": context_data}, ensure_ascii=False) + "\n"
+            yield emit({"type": "context", "payload": context_data})
             
             # Gọi LLM trả lời dựa trên tài liệu
             async for token in call_llm(req.question, unique_hits, history_objs):
                 if token:
                     full_answer += token
-                    yield json.dumps({"type": "answer", "payload": token}, ensure_ascii=False) + "\n"
+                    yield emit({"type": "answer", "payload": token})
 
         # TRƯỜNG HỢP 2: GENERAL (Hoặc RAG bị Fail chuyển sang)
         else:
@@ -109,18 +180,24 @@ async def ask(req: AskRequest):
                 # Nếu ban đầu định tìm kiếm mà không thấy, báo nhẹ 1 câu (tùy chọn)
                 msg = "*(Không tìm thấy thông tin trong tài liệu, tôi sẽ trả lời bằng kiến thức tổng quát...)*\n\n"
                 full_answer += msg
-                yield json.dumps({"type": "answer", "payload": msg}, ensure_ascii=False) + "\n"
+                yield emit({"type": "answer", "payload": msg})
 
             # Gọi LLM chém gió (Sử dụng kiến thức training của nó)
             async for token in call_llm_general(req.question, history_objs):
                 if token:
                     full_answer += token
-                    yield json.dumps({"type": "answer", "payload": token}, ensure_ascii=False) + "\n"
+                    yield emit({"type": "answer", "payload": token})
 
         # 5. Lưu câu trả lời
         if full_answer:
             await add_message_to_history(session_id, "assistant", full_answer)
 
+        # 6. Đưa vào cache (bỏ qua câu trả lời lỗi từ LLM)
+        if cache_key and full_answer and "[Lỗi" not in full_answer:
+            response_cache.put(
+                cache_key, events, latency=time.perf_counter() - started, corpus_version=corpus_version
+            )
+
     return StreamingResponse(response_generator(), media_type="application/x-ndjson")
 
 @router.post("/debug-retrieval")
@@ -129,16 +206,14 @@ async def debug_retrieval(req: AskRequest):
     API debug xem Pipeline đang tìm kiếm như thế nào (không gọi LLM)
     """
     print(f"🛠️ Debug Query: {req.question}")
+    pipeline = await aget_pipeline()
     
-    # 1. Test sinh Query phụ (Query Expansion)
-    # Lưu ý: Hàm _query_processing là private, chỉ dùng để debug
-    sub_queries = await global_rag_pipeline._query_processing(req.question)
+    # 1. Sinh Query phụ (Query Expansion) + tìm kiếm thật
+    sub_queries, candidates = await pipeline.retrieve(req.question, topk=req.topk)
     
-    # 2. Chạy tìm kiếm thật
-    unique_hits = await global_rag_pipeline.run(
-        original_question=req.question,
-        topk=req.topk,
-        rerank_topn=req.rerank_topn
+    # 2. Rerank
+    unique_hits = await pipeline.rerank(
+        req.question, candidates, rerank_topn=req.rerank_topn
     )
     
     return {
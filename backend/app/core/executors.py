@@ -0,0 +1,77 @@
+# app/core/executors.py
+"""
+Thread pool riêng cho các tác vụ nặng CPU / blocking để không chặn event loop:
+- inference: encode (bge-m3), rerank (bge-reranker)
+- index: Milvus search/insert (pymilvus đồng bộ), chấm điểm BM25
+
+Mỗi pool có số worker cố định và giới hạn số tác vụ đang chờ (semaphore),
+để một loạt request lớn không dồn hàng nghìn job vào queue của pool.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from app.core.settings import settings
+
+
+class BoundedExecutor:
+    def __init__(self, name: str, max_workers: int, max_pending: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max(max_pending, max_workers)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-worker")
+        self._sem: asyncio.Semaphore | None = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._completed = 0
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # Tạo lười trong event loop đang chạy (uvicorn chỉ có 1 loop)
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_pending)
+        return self._sem
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """await hàm đồng bộ fn(*args, **kwargs) trên pool này."""
+        async with self._semaphore():
+            with self._lock:
+                self._pending += 1
+            try:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._pool, functools.partial(fn, *args, **kwargs))
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                    self._completed += 1
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": self._pending,
+            "completed": self._completed,
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+inference_executor = BoundedExecutor("inference", settings.inference_workers, settings.inference_max_pending)
+index_executor = BoundedExecutor("index", settings.index_workers, settings.index_max_pending)
+
+
+async def run_inference(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    return await inference_executor.run(fn, *args, **kwargs)
+
+
+async def run_index(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    return await index_executor.run(fn, *args, **kwargs)
+
+
+def executor_stats() -> dict:
+    return {
+        "inference": inference_executor.stats(),
+        "index": index_executor.stats(),
+    }
@@ -1,26 +1,116 @@
 # app/core/global_state.py
+"""
+Tài nguyên dùng chung của app, đăng ký vào registry (app.core.resources):
+embedder, reranker, collection, embedding_batcher, rerank_scheduler, pipeline.
+Không tạo gì lúc import: lần đầu được lấy mới load, hoặc load hết lúc khởi động
+nếu bật eager_load_models. Mọi router (query, documents, debug) dùng chung 1 bản.
+"""
+from typing import Optional
 
+from app.core.resources import resources
 from app.core.settings import settings
 from app.services.embedding import LocalEmbedder
+from app.services.embedding_batcher import EmbeddingBatcher
 from app.services.rerank import LocalReranker
-from app.services.milvus_store import ensure_collection, get_all_documents
+from app.services.rerank_scheduler import RerankScheduler
+from app.services.milvus_store import ensure_collection, iter_documents
 from app.services.rag_pipeline import RAGPipeline
+from app.services.document_registry import document_registry
+from app.services.ingest_jobs import ingest_jobs
 
-print("🚀 Đang khởi tạo Global RAG Pipeline...")
 
-# 1. Khởi tạo các Model & DB
-embedder = LocalEmbedder(settings.embed_model)
-reranker = LocalReranker(settings.rerank_model)
-collection = ensure_collection(dim=embedder.dim)
+# 1. Các Model & DB
+def _embedder() -> LocalEmbedder:
+    return LocalEmbedder(
+        settings.embed_model,
+        query_cache_size=settings.query_embed_cache_size,
+        query_cache_ttl=settings.query_embed_cache_ttl,
+    )
 
-# 2. Load dữ liệu lần đầu (Nếu DB rỗng thì nó trả về [])
-initial_docs = get_all_documents(collection)
+def _reranker() -> LocalReranker:
+    budget = settings.rerank_mode == "budget"
+    return LocalReranker(
+        settings.rerank_model,
+        score_cache_size=settings.rerank_cache_size,
+        max_passage_tokens=settings.rerank_max_passage_tokens if budget else None,
+        bucket_size=settings.rerank_bucket_size if budget else None,
+    )
 
-# 3. Khởi tạo Pipeline TOÀN CỤC
-# Biến này sẽ được import bởi cả query.py và documents.py
-global_rag_pipeline = RAGPipeline(
-    collection=collection, 
-    embedder=embedder, 
-    reranker=reranker, 
-    all_docs_for_bm25=initial_docs
-)
\ No newline at end of file
+def _collection():
+    return ensure_collection(dim=get_embedder().dim)
+
+def _embedding_batcher() -> Optional[EmbeddingBatcher]:
+    # Gom encode câu hỏi của các request /ask đồng thời thành 1 batch
+    if not settings.embed_batch_enabled:
+        return None
+    return EmbeddingBatcher(
+        get_embedder(),
+        max_batch=settings.embed_batch_max_size,
+        max_wait_ms=settings.embed_batch_max_wait_ms,
+    )
+
+def _rerank_scheduler() -> Optional[RerankScheduler]:
+    # Gom cặp (câu hỏi, chunk) của nhiều request vào chung batch cross-encoder
+    if not settings.rerank_batch_enabled:
+        return None
+    return RerankScheduler(
+        get_reranker(),
+        max_batch=settings.rerank_batch_max_size,
+        max_wait_ms=settings.rerank_batch_max_wait_ms,
+        quantum=settings.rerank_batch_quantum,
+        max_queue_delay_ms=settings.rerank_max_queue_delay_ms,
+    )
+
+# 2. Pipeline dùng chung cho query.py và documents.py
+def _pipeline() -> RAGPipeline:
+    print("🚀 Đang khởi tạo Global RAG Pipeline...")
+    pipeline = RAGPipeline(
+        collection=get_collection(),
+        embedder=get_embedder(),
+        reranker=get_reranker(),
+        embedding_batcher=resources.get("embedding_batcher"),
+        rerank_scheduler=resources.get("rerank_scheduler"),
+    )
+
+    # 3. Load dữ liệu lần đầu: stream theo batch từ Milvus vào BM25
+    # (không giới hạn 16k dòng, không giữ toàn bộ kết quả query trong RAM)
+    pipeline.load_bm25_batches(
+        iter_documents(pipeline.collection, batch_size=settings.bm25_load_batch_size)
+    )
+
+    # 4. Tài liệu đã có trong index nhưng chưa có trong registry (ingest trước khi có dedup)
+    indexed = pipeline.bm25_index.documents()
+    backfilled = document_registry.backfill(indexed)
+    if backfilled:
+        print(f"🗂️ Document registry: đăng ký {backfilled} tài liệu có sẵn.")
+    # Bản ghi indexed không còn trong index / indexing không còn job -> failed (upload lại được)
+    fixed = document_registry.reconcile(indexed, ingest_jobs.active_job_ids())
+    if any(fixed.values()):
+        print(f"🗂️ Document registry: {fixed['missing']} tài liệu mất khỏi index, {fixed['orphaned']} tài liệu mất job ingest -> failed.")
+    return pipeline
+
+
+# Thứ tự đăng ký = thứ tự load khi eager (phụ thuộc trước)
+resources.register("embedder", _embedder)
+resources.register("reranker", _reranker)
+resources.register("collection", _collection)
+resources.register("embedding_batcher", _embedding_batcher)
+resources.register("rerank_scheduler", _rerank_scheduler)
+resources.register("pipeline", _pipeline)
+
+
+def get_embedder() -> LocalEmbedder:
+    return resources.get("embedder")
+
+def get_reranker() -> LocalReranker:
+    return resources.get("reranker")
+
+def get_collection():
+    return resources.get("collection")
+
+def get_pipeline() -> RAGPipeline:
+    return resources.get("pipeline")
+
+async def aget_pipeline() -> RAGPipeline:
+    """Dùng trong handler async: lần đầu load model trong thread, không chặn event loop."""
+    return await resources.aget("pipeline")
@@ -0,0 +1,108 @@
+# app/core/resources.py
+"""
+Registry tài nguyên dùng chung (model, collection Milvus, pipeline...):
+- Mỗi tài nguyên đăng ký 1 factory, được tạo đúng 1 lần cho cả process: lần đầu có nơi cần (lazy),
+  hoặc lúc khởi động nếu bật eager_load_models.
+- Router lấy tài nguyên qua registry thay vì tự tạo model / kết nối riêng.
+- Ghi lại thời gian load và bộ nhớ: dung lượng tham số model (torch) + RSS tăng thêm khi load.
+"""
+import asyncio
+import os
+import threading
+import time
+from itertools import chain
+from typing import Any, Callable, Dict, Optional
+
+
+class ResourceRegistry:
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._instances: Dict[str, Any] = {}
+        self._info: Dict[str, Dict] = {}
+
+    def register(self, name: str, factory: Callable[[], Any]):
+        self._factories[name] = factory
+        self._locks[name] = threading.Lock()
+
+    def loaded(self, name: str) -> bool:
+        return name in self._instances
+
+    def peek(self, name: str) -> Any:
+        """Tài nguyên nếu đã load, None nếu chưa (không kích hoạt load, dùng cho endpoint thống kê)."""
+        return self._instances.get(name)
+
+    def get(self, name: str) -> Any:
+        """Lấy tài nguyên, load nếu chưa có (blocking). Nhiều thread gọi cùng lúc thì chỉ 1 thread load."""
+        if name in self._instances:
+            return self._instances[name]
+        with self._locks[name]:
+            if name not in self._instances:
+                self._instances[name] = self._load(name)
+        return self._instances[name]
+
+    async def aget(self, name: str) -> Any:
+        """Như get() nhưng load trong thread riêng -> request đầu tiên không chặn event loop."""
+        if name in self._instances:
+            return self._instances[name]
+        return await asyncio.to_thread(self.get, name)
+
+    def load_all(self):
+        """Load eager mọi tài nguyên theo thứ tự đăng ký (phụ thuộc đăng ký trước)."""
+        for name in self._factories:
+            self.get(name)
+
+    def _load(self, name: str) -> Any:
+        rss_before = _rss_bytes()
+        started = time.perf_counter()
+        obj = self._factories[name]()
+        elapsed = time.perf_counter() - started
+        rss_after = _rss_bytes()
+        params = _model_bytes(obj)
+        self._info[name] = {
+            "load_seconds": round(elapsed, 2),
+            "loaded_at": time.time(),
+            # Gồm cả tài nguyên phụ thuộc được load lần đầu bên trong factory
+            "rss_delta_mb": round((rss_after - rss_before) / 1e6, 1) if rss_before and rss_after else None,
+            "param_mb": round(params / 1e6, 1) if params is not None else None,
+        }
+        extra = f", {self._info[name]['param_mb']} MB tham số" if params is not None else ""
+        print(f"📦 Đã load '{name}' ({elapsed:.1f}s{extra})")
+        return obj
+
+    def stats(self) -> Dict:
+        rss = _rss_bytes()
+        return {
+            "rss_mb": round(rss / 1e6, 1) if rss else None,
+            "resources": {
+                name: {"loaded": name in self._instances, **self._info.get(name, {})}
+                for name in self._factories
+            },
+        }
+
+
+def _rss_bytes() -> Optional[int]:
+    """RSS hiện tại của process (Linux /proc); None nếu không đọc được."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _model_bytes(obj: Any) -> Optional[int]:
+    """
+    Tổng byte tham số + buffer của torch module bên trong obj
+    (LocalEmbedder.model = FlagModel, LocalReranker.reranker = FlagReranker, .model = model HF).
+    None nếu không phải model.
+    """
+    for _ in range(3):
+        if obj is None:
+            return None
+        if callable(getattr(obj, "parameters", None)) and callable(getattr(obj, "buffers", None)):
+            return sum(t.numel() * t.element_size() for t in chain(obj.parameters(), obj.buffers()))
+        obj = getattr(obj, "model", None) or getattr(obj, "reranker", None)
+    return None
+
+
+resources = ResourceRegistry()
@@ -5,6 +5,8 @@ class Settings(BaseSettings):
     milvus_host: str = "localhost"
     milvus_port: int = 19530
     milvus_collection: str = "war_chunks"
+    # Số dòng mỗi batch khi stream corpus từ Milvus vào BM25 lúc khởi động
+    bm25_load_batch_size: int = 2000
 
     # ===== LLM (Groq - OpenAI compatible) =====
     llm_base_url: str = "https://api.groq.com/openai/v1"
@@ -16,9 +18,89 @@ class Settings(BaseSettings):
     AGENT_API_KEY: str
     llm_agent_model: str = "Llama-3.3-Swallow-70B-Instruct-v0.4"
 
+    # ===== Router (tầng local trước khi gọi LLM) =====
+    router_local_enabled: bool = True
+    router_embed_threshold: float = 0.75   # cosine tối thiểu với câu mẫu gần nhất
+    router_embed_margin: float = 0.08      # chênh lệch tối thiểu giữa 2 nhãn
+
     # ===== Local models =====
     embed_model: str = "BAAI/bge-m3"
     rerank_model: str = "BAAI/bge-reranker-v2-m3"
+    # False: model / collection / pipeline load lần đầu được dùng; True: load hết lúc khởi động
+    eager_load_models: bool = False
+
+    # ===== Cache =====
+    query_embed_cache_size: int = 2048      # số câu hỏi giữ vector
+    query_embed_cache_ttl: float = 3600     # giây
+    rerank_cache_size: int = 50000          # số cặp (câu hỏi, chunk) giữ điểm rerank
+    expansion_cache_size: int = 2048        # Query Expansion (LLM) theo câu hỏi
+    expansion_cache_ttl: float = 3600
+    response_cache_enabled: bool = False    # cache cả câu trả lời /ask (traffic dạng FAQ)
+    response_cache_size: int = 1000
+    response_cache_ttl: float = 86400
+    response_cache_history_turns: int = 2   # số tin nhắn gần nhất đưa vào cache key
+
+    # ===== Executors (chạy model / index ngoài event loop) =====
+    inference_workers: int = 1       # encode + rerank (model CPU nặng, 1 luồng thường là tối ưu)
+    inference_max_pending: int = 64
+    index_workers: int = 4           # Milvus search/insert + BM25
+    index_max_pending: int = 256
+
+    # ===== Micro-batching encode câu hỏi (gom request đồng thời) =====
+    embed_batch_enabled: bool = True
+    embed_batch_max_size: int = 32       # số câu tối đa trong 1 lần encode
+    embed_batch_max_wait_ms: float = 5   # chờ tối đa để gom thêm request
+
+    # ===== Rerank scheduler (gom cặp query-passage của nhiều request) =====
+    rerank_batch_enabled: bool = True
+    rerank_batch_max_size: int = 64          # số cặp tối đa trong 1 lần compute_score
+    rerank_batch_max_wait_ms: float = 5
+    rerank_batch_quantum: int = 16           # số cặp tối đa lấy từ mỗi request trong 1 vòng round-robin
+    rerank_max_queue_delay_ms: float = 200   # request chờ quá ngưỡng này được ưu tiên
+
+    # ===== Rerank mode =====
+    # "full": chấm mọi candidate, passage nguyên vẹn
+    # "budget": lọc theo prescore (RRF) + cắt passage theo token + chia bucket theo độ dài
+    rerank_mode: str = "full"
+    rerank_max_candidates: int = 40
+    rerank_max_passage_tokens: int = 256
+    rerank_bucket_size: int = 16
+
+    # ===== Ingest PDF =====
+    pdf_extract_workers: int = 0          # process song song trích text (0 = số CPU, 1 = tuần tự)
+    pdf_parallel_min_pages: int = 64      # PDF ít trang hơn -> trích tuần tự (tránh chi phí process)
+    pdf_pages_per_shard: int = 32         # số trang mỗi worker trích trong 1 lần
+    ingest_coarse_target_tokens: int = 512
+    ingest_coarse_overlap_tokens: int = 200
+    ingest_chunk_size: int = 128
+    ingest_overlap_sentences: int = 2
+    ingest_embed_batch_size: int = 64     # số chunk mỗi lần encode khi ingest
+    ingest_chunk_queue_size: int = 256    # chunk chờ embed (backpressure cho extract/chunk)
+    ingest_insert_queue_size: int = 2     # batch đã embed chờ insert
+    ingest_bulk_insert_batch_size: int = 1024   # bulk ingest: số dòng mỗi lần insert Milvus (gộp nhiều tài liệu)
+    ingest_bulk_max_files: int = 5000     # số PDF tối đa trong 1 lần bulk ingest
+
+    # ===== Ingest job queue (chạy nền, lưu SQLite) =====
+    ingest_job_workers: int = 1           # số job ingest chạy song song
+    ingest_job_db: str = "./data/ingest_jobs.sqlite3"
+    ingest_job_spool_dir: str = "./data/ingest_spool"   # PDF chờ xử lý
+    ingest_max_attempts: int = 3          # job bị gián đoạn (restart / crash) đủ N lần -> failed, không chạy lại
+
+    # ===== Document registry (dedup theo hash nội dung) =====
+    document_registry_db: str = "./data/documents.sqlite3"
+
+    # ===== Milvus writer (insert theo batch, flush theo barrier / timer) =====
+    milvus_insert_max_rows: int = 1000    # số dòng tối đa mỗi message insert
+    milvus_insert_max_mb: float = 16      # dung lượng ước lượng tối đa mỗi message (gRPC mặc định 64MB)
+    milvus_flush_interval_s: float = 60   # dữ liệu chưa flush lâu hơn -> timer flush (0 = chỉ flush qua barrier)
+
+    # ===== Embedding cache (vector chunk tài liệu, lưu trên đĩa) =====
+    embed_cache_enabled: bool = True
+    embed_cache_dir: str = "./data/embedding_cache"
+    embed_cache_max_mb: float = 1024      # dung lượng tối đa (vector fp16 + key + tick)
+    embed_cache_evict_fraction: float = 0.1   # đầy thì đuổi 10% slot cũ nhất 1 lượt
+    embed_cache_flush_interval_s: float = 30  # msync memmap xuống đĩa tối đa 1 lần / N giây (0 = sau mỗi lần ghi)
+
     # ===== MinIO =====
 
     MINIO_ENDPOINT: str = "http://localhost:9000"
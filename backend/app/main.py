@@ -3,6 +3,8 @@
 # from app.api.query import router as query_router
 # from app.core.settings import settings
 # from app.api.debug import router as debug_router
+from app.core.executors import executor_stats
+from app.core.settings import settings
 
 
 # app = FastAPI(title="AI PDF RAG", version="0.1.0")
@@ -50,6 +52,7 @@ OpenAIInstrumentor().instrument()
 # ...
 
 # ... Code FastAPI của bạn ở dưới ...
+import asyncio
 from fastapi import FastAPI, Request
 from fastapi.templating import Jinja2Templates 
 from fastapi.responses import HTMLResponse
@@ -58,6 +61,11 @@ from fastapi.staticfiles import StaticFiles
 from app.api.documents import router as documents_router
 from app.api.query import router as query_router
 from app.api.debug import router as debug_router
+from app.services.ingest_jobs import ingest_jobs
+from app.services.milvus_store import close_writers
+from app.services.embedding_cache import close_embedding_caches
+from app.services.pdf_ingest import start_extract_pool, shutdown_extract_pool
+from app.core.global_state import resources
 
 
 
@@ -74,6 +82,33 @@ app.include_router(documents_router)
 app.include_router(query_router)
 app.include_router(debug_router)
 
+@app.on_event("startup")
+async def load_models():
+    # Mặc định model load lười ở request đầu tiên; eager_load_models=True -> load xong mới nhận request
+    if settings.eager_load_models:
+        await asyncio.to_thread(resources.load_all)
+
+@app.on_event("startup")
+async def start_ingest_workers():
+    # Process pool trích PDF (spawn) tạo trước khi nhận job ingest đầu tiên
+    await asyncio.to_thread(start_extract_pool)
+    # Chạy worker ingest nền + khôi phục job chưa xong từ lần chạy trước
+    ingest_jobs.start()
+
+@app.on_event("shutdown")
+async def stop_ingest_workers():
+    await ingest_jobs.stop()
+    # Flush phần đã insert nhưng chưa flush (writer chỉ flush theo barrier / timer)
+    await asyncio.to_thread(close_writers)
+    # Embedding cache chỉ msync theo timer -> ghi nốt phần còn lại
+    await asyncio.to_thread(close_embedding_caches)
+    await asyncio.to_thread(shutdown_extract_pool)
+
+@app.get("/health")
+def health():
+    # Endpoint nhẹ, không đụng model -> vẫn trả lời ngay cả khi retrieval đang chạy
+    return {"status": "ok", "collection": settings.milvus_collection, "executors": executor_stats()}
+
 # 4. Tạo Route trang chủ (Root /)
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
@@ -4,3 +4,17 @@ class IngestResponse(BaseModel):
     document_id: str
     chunks_inserted: int
     filename: str | None = None
+
+class IngestJobResponse(BaseModel):
+    job_id: str | None = None           # None khi nội dung đã có trong index (status="duplicate")
+    status: str
+    document_id: str
+    filename: str | None = None
+    duplicate_of: str | None = None     # tên file đã ingest trước đó với cùng nội dung
+    chunks: int | None = None
+
+class BulkIngestJobResponse(BaseModel):
+    job_id: str
+    status: str
+    files: int
+    filename: str | None = None
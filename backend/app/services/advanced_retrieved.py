@@ -2,8 +2,10 @@ import asyncio
 from typing import List, Dict
 from app.services.embedding import LocalEmbedder
 from app.services.rerank import LocalReranker
-from app.services.milvus_store import search
+from app.services.milvus_store import search_many
 from app.core.settings import settings
+from app.core.executors import run_inference, run_index
+from app.utils.cache import AsyncSingleFlightCache, normalize_query
 # Import client LLM để dùng cho việc sinh câu hỏi phụ
 from openai import AsyncOpenAI 
 
@@ -19,29 +21,39 @@ class AdvancedRetriever:
             base_url=settings.llm_base_url,
         )
 
-    async def _generate_multi_queries(self, question: str, n=3) -> List[str]:
-        """
-        Kỹ thuật Query Expansion: Dùng LLM sinh ra n biến thể của câu hỏi gốc
-        để tìm kiếm bao quát hơn.
-        """
+        # Cache kết quả Query Expansion
+        self.expansion_cache = AsyncSingleFlightCache(
+            maxsize=settings.expansion_cache_size, ttl=settings.expansion_cache_ttl
+        )
+
+    async def _call_expansion_llm(self, question: str, n: int) -> List[str]:
         system_prompt = """Bạn là một chuyên gia tìm kiếm tin học. 
         Nhiệm vụ: Hãy tạo ra 3 câu hỏi tìm kiếm khác nhau dựa trên câu hỏi gốc của người dùng để tìm kiếm tài liệu kỹ thuật tốt hơn.
         Chỉ trả về các câu hỏi, mỗi câu một dòng. Không giải thích gì thêm."""
         
+        response = await self.llm_client.chat.completions.create(
+            model=settings.llm_model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": question}
+            ],
+            temperature=0.7,
+            max_tokens=150
+        )
+        content = response.choices[0].message.content.strip()
+        # Tách các dòng thành list
+        queries = [line.strip("- ").strip() for line in content.split("\n") if line.strip()]
+        return queries[:n] # Chỉ lấy n câu
+
+    async def _generate_multi_queries(self, question: str, n=3) -> List[str]:
+        """
+        Kỹ thuật Query Expansion: Dùng LLM sinh ra n biến thể của câu hỏi gốc
+        để tìm kiếm bao quát hơn. Kết quả được cache (TTL) và request trùng dùng chung 1 lần gọi.
+        """
         try:
-            response = await self.llm_client.chat.completions.create(
-                model=settings.llm_model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": question}
-                ],
-                temperature=0.7,
-                max_tokens=150
+            return await self.expansion_cache.get_or_compute(
+                (normalize_query(question), n), lambda: self._call_expansion_llm(question, n)
             )
-            content = response.choices[0].message.content.strip()
-            # Tách các dòng thành list
-            queries = [line.strip("- ").strip() for line in content.split("\n") if line.strip()]
-            return queries[:n] # Chỉ lấy n câu
         except Exception as e:
             print(f"⚠️ Lỗi sinh query phụ: {e}")
             return []
@@ -66,13 +78,11 @@ class AdvancedRetriever:
 
         # 2. Vector Search (Song song)
         # Mã hóa tất cả câu hỏi thành vector
-        query_vectors = self.embedder.encode(search_queries)
+        query_vectors = await run_inference(self.embedder.encode_queries, search_queries)
         
-        # Tìm kiếm trong Milvus cho từng vector
+        # Tìm kiếm trong Milvus cho tất cả vector trong 1 lần gọi
         all_hits = []
-        for vec in query_vectors:
-            # Tìm topk cho mỗi câu hỏi (có thể giảm k cho query phụ nếu muốn nhanh)
-            hits = search(self.collection, vec, topk=topk)
+        for hits in await run_index(search_many, self.collection, query_vectors, topk=topk):
             all_hits.extend(hits)
 
         # 3. Deduplication (Khử trùng lặp thủ công dựa trên chunk_id)
@@ -94,7 +104,7 @@ class AdvancedRetriever:
         passages = [h["text"] for h in candidates]
         
         # Rerank dựa trên câu hỏi GỐC (question) để đảm bảo sát nghĩa nhất
-        rr_scores = self.reranker.rerank(question, passages)
+        rr_scores = await run_inference(self.reranker.rerank, question, passages)
 
         # Gán điểm và sort
         for h, s in zip(candidates, rr_scores):
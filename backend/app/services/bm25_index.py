@@ -0,0 +1,402 @@
+# app/services/bm25_index.py
+"""
+BM25 (công thức Okapi giống rank_bm25) cập nhật tăng dần theo document_id, dùng cho RAGPipeline.
+Tách khỏi rag_pipeline để dùng / test mà không kéo theo model, Milvus, LLM client.
+
+Index = các segment bất biến + thống kê toàn corpus:
+- Segment: payload chunk + ma trận TF thô (CSC: cột = term, lấy posting của term rất nhanh)
+  + độ dài từng chunk + mask "còn sống". Mỗi lần ingest thêm đúng 1 segment cho chunk mới.
+- Xóa / ghi đè chunk: chỉ tắt mask ở các segment có tài liệu đó (không copy cả corpus).
+- df, số chunk còn sống, tổng độ dài: cộng phần thêm / trừ phần xóa; mỗi lần ghi chỉ
+  tính lại vector idf (O(vocab)), không tính lại trọng số của từng chunk.
+- Trọng số BM25 tính lúc query, chỉ trên posting của các term có trong câu hỏi.
+- Segment cỡ tương đương được gộp dần (như LSM) -> số segment ~ log2(số chunk);
+  lúc gộp / nén thì bỏ luôn các hàng đã xóa.
+Mỗi lần ghi tạo snapshot mới rồi gán 1 phát (atomic), request /ask đang chạy
+vẫn đọc snapshot cũ nên không bao giờ thấy index dở dang.
+"""
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from scipy import sparse
+
+from app.services.bm25_sparse import bm25_idf, build_term_matrix
+
+# Gộp segment cuối vào segment trước khi segment trước không lớn hơn _MERGE_RATIO lần
+_MERGE_RATIO = 2
+# Segment còn sống ít hơn tỉ lệ này -> nén lại (bỏ hàng đã xóa)
+_MIN_ALIVE_FRACTION = 0.5
+
+
+def _tokenize(text: str) -> List[str]:
+    # Giữ nguyên cách tách từ cũ để điểm BM25 không đổi
+    return (text or "").lower().split(" ")
+
+
+def _widen(tf: sparse.spmatrix, n_terms: int) -> sparse.csr_matrix:
+    """Mở rộng số cột theo vocab hiện tại (term thêm sau khi tokenize block này)."""
+    tf = tf.tocsr()
+    return sparse.csr_matrix((tf.data, tf.indices, tf.indptr), shape=(tf.shape[0], n_terms))
+
+
+class _Segment:
+    """Nhóm chunk bất biến. Chỉ mask alive đổi được, và đổi bằng cách tạo segment mới (with_alive)."""
+
+    __slots__ = ("rows", "row_doc", "tf", "doc_len", "ords", "alive", "n_alive")
+
+    def __init__(self, rows: List[Dict], row_doc: np.ndarray, tf: sparse.spmatrix):
+        # rows[i] = payload của chunk ở hàng i; row_doc[i] = ordinal của document_id sở hữu hàng i
+        self.rows = rows
+        self.row_doc = row_doc
+        self.tf = sparse.csc_matrix(tf, dtype=np.float32)
+        self.doc_len = np.asarray(self.tf.sum(axis=1), dtype=np.float32).ravel()
+        # Tài liệu có hàng trong segment (để bỏ qua segment không liên quan khi xóa)
+        self.ords = frozenset(np.unique(row_doc).tolist())
+        self.alive = np.ones(len(rows), dtype=bool)
+        self.n_alive = len(rows)
+
+    def with_alive(self, alive: np.ndarray) -> "_Segment":
+        seg = object.__new__(_Segment)
+        seg.rows, seg.row_doc, seg.tf, seg.doc_len, seg.ords = self.rows, self.row_doc, self.tf, self.doc_len, self.ords
+        seg.alive = alive
+        seg.n_alive = int(alive.sum())
+        return seg
+
+    def term_counts(self, mask: np.ndarray, vocab: Dict[str, int], n_terms: int) -> np.ndarray:
+        """
+        Số hàng trong mask chứa từng term (= phần df của các hàng đó).
+        Tokenize lại text của đúng các hàng đó (term đã có trong vocab) thay vì quét cả ma trận.
+        """
+        ids = [vocab[t] for i in np.flatnonzero(mask).tolist() for t in set(_tokenize(self.rows[i]["text"]))]
+        return np.bincount(np.asarray(ids, dtype=np.int64), minlength=n_terms)
+
+
+def _merge(segments: List[_Segment], n_terms: int) -> Optional[_Segment]:
+    """Gộp các segment thành 1, chỉ giữ hàng còn sống. None nếu không còn hàng nào."""
+    rows: List[Dict] = []
+    row_doc, blocks = [], []
+    for seg in segments:
+        idx = np.flatnonzero(seg.alive)
+        rows.extend(seg.rows[i] for i in idx.tolist())
+        row_doc.append(seg.row_doc[idx])
+        blocks.append(_widen(seg.tf[idx], n_terms))
+    if not rows:
+        return None
+    return _Segment(rows, np.concatenate(row_doc), sparse.vstack(blocks, format="csr"))
+
+
+def _compact_tail(segments: List[_Segment], n_terms: int) -> List[_Segment]:
+    """Segment mới cỡ tương đương segment trước -> gộp (như cộng nhị phân), mỗi chunk bị gộp ~log N lần."""
+    while len(segments) >= 2 and segments[-2].n_alive <= _MERGE_RATIO * segments[-1].n_alive:
+        merged = _merge(segments[-2:], n_terms)
+        segments[-2:] = [merged] if merged is not None else []
+    return segments
+
+
+class _BM25Snapshot:
+    """
+    Trạng thái BM25 bất biến (immutable) sau khi publish.
+    Reader chỉ đọc, writer luôn tạo snapshot mới rồi swap.
+    """
+    __slots__ = ("segments", "vocab", "doc_ords", "df", "n_alive", "total_len", "idf")
+
+    def __init__(self, segments=None, vocab=None, doc_ords=None, df=None, n_alive=0, total_len=0.0, idf=None):
+        self.segments: List[_Segment] = segments if segments is not None else []
+        # vocab của lúc build (rebuild thay vocab mới, snapshot cũ vẫn dùng vocab của nó)
+        self.vocab: Dict[str, int] = vocab if vocab is not None else {}
+        self.doc_ords: Dict[str, int] = doc_ords if doc_ords is not None else {}
+        # Thống kê trên các chunk còn sống: df[term], số chunk, tổng độ dài
+        self.df: np.ndarray = df if df is not None else np.zeros(0, dtype=np.int64)
+        self.n_alive = n_alive
+        self.total_len = total_len
+        self.idf: np.ndarray = idf if idf is not None else np.zeros(0, dtype=np.float32)
+
+
+class IncrementalBM25:
+    """
+    BM25 cập nhật tăng dần theo document_id (xem docstring module).
+    - add / remove / replace chỉ tokenize chunk của tài liệu đó và chỉ đụng tới các segment
+      chứa tài liệu đó; df và avgdl cập nhật tăng dần, idf tính lại 1 lần / lần ghi.
+    - Mỗi lần ghi tạo snapshot mới rồi gán 1 phát (atomic).
+    """
+
+    def __init__(self, docs: Iterable[Dict] = None, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self._write_lock = threading.Lock()
+        # Vocab dùng chung giữa các snapshot, chỉ thêm (append-only) dưới write lock
+        self._vocab: Dict[str, int] = {}
+        self._snapshot = _BM25Snapshot(vocab=self._vocab)
+        if docs:
+            self.rebuild(docs)
+
+    def __len__(self) -> int:
+        return self._snapshot.n_alive
+
+    def documents(self) -> Dict[str, Dict]:
+        """document_id -> {filename, chunks} của các tài liệu đang có trong index."""
+        snap = self._snapshot
+        names = {ordinal: document_id for document_id, ordinal in snap.doc_ords.items()}
+        out: Dict[str, Dict] = {}
+        for seg in snap.segments:
+            idx = np.flatnonzero(seg.alive)
+            ords, first, counts = np.unique(seg.row_doc[idx], return_index=True, return_counts=True)
+            for ordinal, i, n in zip(ords.tolist(), first.tolist(), counts.tolist()):
+                doc = out.get(names[ordinal])
+                if doc is None:
+                    meta = seg.rows[idx[i]].get("metadata") or {}
+                    out[names[ordinal]] = {"filename": meta.get("source"), "chunks": n}
+                else:
+                    doc["chunks"] += n
+        return out
+
+    @staticmethod
+    def _payload(document_id: str, d: Dict) -> Dict:
+        # Chỉ giữ các trường cần cho hit keyword (bỏ embedding...)
+        return {
+            "chunk_id": d["chunk_id"],
+            "document_id": document_id,
+            "text": d.get("text", ""),
+            "metadata": d.get("metadata") or {},
+        }
+
+    # --- API ghi ---
+    def add_documents(self, document_id: str, docs: List[Dict]):
+        """Thêm chunk của 1 tài liệu (chunk trùng chunk_id sẽ bị ghi đè)."""
+        self._apply(remove_ids=(), adds=[(document_id, docs)])
+
+    def remove_document(self, document_id: str):
+        self._apply(remove_ids=(document_id,), adds=[])
+
+    def replace_document(self, document_id: str, docs: List[Dict]):
+        """Xóa toàn bộ chunk cũ của tài liệu rồi thêm bản mới (re-ingest)."""
+        self._apply(remove_ids=(document_id,), adds=[(document_id, docs)])
+
+    def replace_documents(self, docs_by_id: Dict[str, List[Dict]]):
+        """Như replace_document cho nhiều tài liệu, nhưng chỉ build 1 snapshot (bulk ingest)."""
+        self._apply(remove_ids=tuple(docs_by_id), adds=list(docs_by_id.items()))
+
+    def commit(self, batch: "BM25Accumulator"):
+        """Thay chunk của mọi tài liệu trong batch (đã tokenize sẵn) bằng 1 snapshot mới."""
+        with self._write_lock:
+            self._snapshot = self._build(self._snapshot, batch.document_ids(), batch.blocks(self._vocab))
+
+    def rebuild(self, docs: Iterable[Dict]):
+        """Build lại từ đầu từ 1 list docs. Vẫn swap atomic."""
+        self.rebuild_from_batches([list(docs)])
+
+    def rebuild_from_batches(self, batches: Iterable[List[Dict]]) -> int:
+        """
+        Build lại từ đầu bằng cách tiêu thụ từng batch (vd: milvus_store.iter_documents).
+        Mỗi batch chỉ được tokenize thành 1 block CSR rồi bỏ đi, nên không cần giữ
+        toàn bộ kết quả Milvus trong RAM. Snapshot mới chỉ được swap khi đã build xong.
+        """
+        with self._write_lock:
+            vocab: Dict[str, int] = {}
+            doc_ords: Dict[str, int] = {}
+            rows: List[Dict] = []
+            row_doc: List[int] = []
+            blocks: List[sparse.csr_matrix] = []
+
+            for batch in batches:
+                for d in batch:
+                    document_id = d.get("document_id") or ""
+                    row_doc.append(doc_ords.setdefault(document_id, len(doc_ords)))
+                    rows.append(self._payload(document_id, d))
+                blocks.append(build_term_matrix((_tokenize(d.get("text", "")) for d in batch), vocab))
+
+            n_terms = len(vocab)
+            segments: List[_Segment] = []
+            df = np.zeros(n_terms, dtype=np.int64)
+            total_len = 0.0
+            if rows:
+                tf = sparse.vstack([_widen(b, n_terms) for b in blocks], format="csr")
+                df += np.bincount(tf.indices, minlength=n_terms)
+                seg = _Segment(rows, np.asarray(row_doc, dtype=np.int32), tf)
+                total_len = float(seg.doc_len.sum(dtype=np.float64))
+                segments.append(seg)
+
+            self._vocab = vocab
+            self._snapshot = self._publish(segments, vocab, doc_ords, df, len(rows), total_len)
+            return len(rows)
+
+    def _apply(self, remove_ids: Iterable[str], adds: List[tuple]):
+        with self._write_lock:
+            blocks = []
+            for document_id, docs in adds:
+                payloads = [self._payload(document_id, d) for d in docs]
+                blocks.append((document_id, payloads, build_term_matrix((_tokenize(p["text"]) for p in payloads), self._vocab)))
+            self._snapshot = self._build(self._snapshot, remove_ids, blocks)
+
+    def _build(self, old: _BM25Snapshot, remove_ids: Iterable[str], adds: List[tuple]) -> _BM25Snapshot:
+        """adds: [(document_id, payloads, tf)], tf đã tokenize theo self._vocab (số cột <= len(vocab))."""
+        n_terms = len(self._vocab)
+        # Ordinal chỉ cấp thêm, không thu hồi (tránh trùng với hàng của tài liệu khác)
+        doc_ords = dict(old.doc_ords)
+        df = np.zeros(n_terms, dtype=np.int64)
+        df[: len(old.df)] = old.df
+        n_alive, total_len = old.n_alive, old.total_len
+
+        # 1) Tắt hàng của tài liệu bị xóa / chunk bị ghi đè, chỉ ở segment có tài liệu đó
+        remove_ids = set(remove_ids)
+        drop = {doc_ords[d] for d in remove_ids if d in doc_ords}
+        overwrite = {
+            doc_ords[document_id]: {p["chunk_id"] for p in payloads}
+            for document_id, payloads, _ in adds
+            if document_id in doc_ords and document_id not in remove_ids and payloads
+        }
+        touched = drop | overwrite.keys()
+        segments: List[_Segment] = []
+        for seg in old.segments:
+            if touched.isdisjoint(seg.ords):
+                segments.append(seg)
+                continue
+            kill = np.isin(seg.row_doc, list(drop)) if drop else np.zeros(len(seg.rows), dtype=bool)
+            for ordinal, chunk_ids in overwrite.items():
+                if ordinal in seg.ords:
+                    for i in np.flatnonzero(seg.row_doc == ordinal).tolist():
+                        if seg.rows[i]["chunk_id"] in chunk_ids:
+                            kill[i] = True
+            kill &= seg.alive
+            if not kill.any():
+                segments.append(seg)
+                continue
+            df -= seg.term_counts(kill, self._vocab, n_terms)
+            n_alive -= int(kill.sum())
+            total_len -= float(seg.doc_len[kill].sum(dtype=np.float64))
+            seg = seg.with_alive(seg.alive & ~kill)
+            if seg.n_alive < len(seg.rows) * _MIN_ALIVE_FRACTION:
+                seg = _merge([seg], n_terms)
+            if seg is not None:
+                segments.append(seg)
+
+        # 2) Chunk mới: 1 segment mới (đã tokenize sẵn), cộng vào df / độ dài
+        rows: List[Dict] = []
+        row_doc, blocks = [], []
+        for document_id, payloads, block in adds:
+            ordinal = doc_ords.setdefault(document_id, len(doc_ords))
+            if not payloads:
+                continue
+            rows.extend(payloads)
+            row_doc.append(np.full(len(payloads), ordinal, dtype=np.int32))
+            blocks.append(_widen(block, n_terms))
+        if rows:
+            tf = sparse.vstack(blocks, format="csr")
+            df += np.bincount(tf.indices, minlength=n_terms)
+            seg = _Segment(rows, np.concatenate(row_doc), tf)
+            n_alive += len(rows)
+            total_len += float(seg.doc_len.sum(dtype=np.float64))
+            segments.append(seg)
+            segments = _compact_tail(segments, n_terms)
+
+        return self._publish(segments, self._vocab, doc_ords, df, n_alive, total_len)
+
+    def _publish(self, segments, vocab, doc_ords, df, n_alive, total_len) -> _BM25Snapshot:
+        # Chỉ phần này phụ thuộc cả corpus: O(vocab), không đụng tới từng chunk
+        idf = bm25_idf(df, n_alive, self.epsilon) if n_alive else np.zeros(len(df), dtype=np.float32)
+        return _BM25Snapshot(segments, vocab, doc_ords, df, n_alive, total_len, idf)
+
+    # --- API đọc ---
+    def search(self, query: str, topk: int) -> List[tuple]:
+        """Trả về [(doc, score)] giảm dần, chỉ những doc có score > 0."""
+        snap = self._snapshot  # đọc 1 lần, toàn bộ phép tính dùng snapshot này
+        if not snap.n_alive or topk <= 0:
+            return []
+        q_ids, q_cnt = [], []
+        for term, cnt in Counter(_tokenize(query)).items():
+            tid = snap.vocab.get(term)
+            if tid is not None and tid < len(snap.idf):
+                q_ids.append(tid)
+                q_cnt.append(cnt)
+        if not q_ids:
+            return []
+        q_w = snap.idf[q_ids] * np.asarray(q_cnt, dtype=np.float32) * np.float32(self.k1 + 1)
+        # norm(dl) = k1 * (1 - b + b * dl / avgdl) = c0 + c1 * dl, avgdl theo snapshot
+        c0 = np.float32(self.k1 * (1 - self.b))
+        c1 = np.float32(self.k1 * self.b * snap.n_alive / snap.total_len)
+
+        parts = []
+        for seg in snap.segments:
+            scores = np.zeros(len(seg.rows), dtype=np.float32)
+            indptr, indices, data = seg.tf.indptr, seg.tf.indices, seg.tf.data
+            for tid, w in zip(q_ids, q_w):
+                if tid >= seg.tf.shape[1] or indptr[tid] == indptr[tid + 1]:
+                    continue
+                # Posting của term (mỗi hàng xuất hiện 1 lần / cột -> cộng bằng fancy index được)
+                r = indices[indptr[tid]:indptr[tid + 1]]
+                tf = data[indptr[tid]:indptr[tid + 1]]
+                # w * tf / (tf + c0 + c1 * dl), tính tại chỗ để đỡ mảng tạm
+                part = np.take(seg.doc_len, r)
+                part *= c1
+                part += c0
+                part += tf
+                np.divide(tf, part, out=part)
+                part *= w
+                scores[r] += part
+            if seg.n_alive < len(seg.rows):
+                scores[~seg.alive] = 0.0
+            parts.append(scores)
+        scores = np.concatenate(parts)
+
+        if topk < scores.size:
+            top = np.argpartition(scores, -topk)[-topk:]
+        else:
+            top = np.arange(scores.size)
+        top = top[np.argsort(-scores[top], kind="stable")]
+        top = top[scores[top] > 0]
+
+        offsets = np.cumsum([0] + [len(seg.rows) for seg in snap.segments])
+        seg_idx = np.searchsorted(offsets, top, side="right") - 1
+        return [
+            (snap.segments[s].rows[i - offsets[s]], float(scores[i]))
+            for i, s in zip(top.tolist(), seg_idx.tolist())
+        ]
+
+
+class BM25Accumulator:
+    """
+    Gom chunk vừa insert của 1 lần ingest (1 hoặc nhiều tài liệu) cho 1 lần IncrementalBM25.commit.
+    Mỗi lần add tokenize ngay thành block CSR (vocab riêng) + payload gọn (chunk_id, text, metadata),
+    nên không phải giữ dòng gốc đến cuối lô rồi mới tokenize cả lô 1 lượt.
+    Text vẫn được giữ vì hit BM25 trả về text chunk.
+    """
+
+    def __init__(self):
+        self._vocab: Dict[str, int] = {}
+        self._docs: Dict[str, List[tuple]] = {}  # document_id -> [(payloads, block)]
+        self.chunks = 0
+
+    def __len__(self) -> int:
+        return self.chunks
+
+    def add(self, document_id: str, docs: List[Dict]):
+        payloads = [IncrementalBM25._payload(document_id, d) for d in docs]
+        block = build_term_matrix((_tokenize(p["text"]) for p in payloads), self._vocab)
+        self._docs.setdefault(document_id, []).append((payloads, block))
+        self.chunks += len(payloads)
+
+    def discard(self, document_id: str):
+        """Bỏ tài liệu lỗi giữa chừng (chunk của nó đã bị xóa khỏi Milvus)."""
+        for payloads, _ in self._docs.pop(document_id, []):
+            self.chunks -= len(payloads)
+
+    def document_ids(self) -> List[str]:
+        return list(self._docs)
+
+    def blocks(self, vocab: Dict[str, int]) -> List[tuple]:
+        """[(document_id, payloads, tf)] với cột tf đổi sang vocab của index (vocab được thêm term mới tại chỗ)."""
+        mapping = np.empty(len(self._vocab), dtype=np.int32)
+        for term, local_id in self._vocab.items():
+            mapping[local_id] = vocab.setdefault(term, len(vocab))
+        out = []
+        for document_id, parts in self._docs.items():
+            payloads = [p for ps, _ in parts for p in ps]
+            tf = sparse.vstack(
+                [sparse.csr_matrix((b.data, mapping[b.indices], b.indptr), shape=(b.shape[0], len(vocab))) for _, b in parts],
+                format="csr",
+            )
+            out.append((document_id, payloads, tf))
+        return out
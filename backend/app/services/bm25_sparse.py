@@ -0,0 +1,133 @@
+# app/services/bm25_sparse.py
+"""
+BM25 dạng ma trận thưa (scipy.sparse):
+- Corpus lưu thành ma trận (docs x vocab) với trọng số BM25 đã tính sẵn
+  (idf * tf*(k1+1) / (tf + k1*(1-b+b*dl/avgdl))), vocab là dict term -> int.
+- Chấm điểm 1 câu hỏi = 1 phép nhân ma trận thưa với vector query.
+- Chọn top-k bằng np.argpartition (O(N)) thay vì sorted() toàn bộ trong Python.
+Công thức giống BM25Okapi của rank_bm25 (kể cả epsilon-floor cho idf âm).
+"""
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+from scipy import sparse
+
+
+def build_term_matrix(tokenized_corpus: Iterable[List[str]], vocab: Dict[str, int]) -> sparse.csr_matrix:
+    """
+    Đổi list token của từng doc thành ma trận TF thưa (CSR).
+    vocab được cập nhật tại chỗ (term mới -> id mới).
+    """
+    indptr = [0]
+    indices: List[int] = []
+    data: List[int] = []
+    for tokens in tokenized_corpus:
+        counts: Dict[int, int] = {}
+        for t in tokens:
+            tid = vocab.get(t)
+            if tid is None:
+                tid = vocab[t] = len(vocab)
+            counts[tid] = counts.get(tid, 0) + 1
+        indices.extend(counts.keys())
+        data.extend(counts.values())
+        indptr.append(len(indices))
+
+    return sparse.csr_matrix(
+        (np.asarray(data, dtype=np.float32), np.asarray(indices, dtype=np.int32), np.asarray(indptr, dtype=np.int64)),
+        shape=(len(indptr) - 1, len(vocab)),
+    )
+
+
+def bm25_idf(df: np.ndarray, n_docs: int, epsilon: float) -> np.ndarray:
+    """
+    idf theo BM25Okapi: log((N - df + 0.5) / (df + 0.5)), idf âm -> epsilon * avg idf.
+    Term có df = 0 (không còn trong corpus) không tính vào avg idf và có idf = 0.
+    """
+    present = df > 0
+    idf = np.log(n_docs - df + 0.5) - np.log(df + 0.5)
+    avg_idf = idf[present].mean() if present.any() else 0.0
+    idf = np.where(idf < 0, epsilon * avg_idf, idf)
+    idf[~present] = 0.0
+    return idf.astype(np.float32)
+
+
+class SparseBM25:
+    def __init__(self, tf: sparse.csr_matrix, vocab: Dict[str, int], k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        """
+        tf: ma trận TF thô (docs x vocab). vocab có thể dài hơn số cột của tf
+        (term được thêm sau khi build) -> những term đó coi như không có trong corpus.
+        """
+        self.vocab = vocab
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.n_docs, self.n_terms = tf.shape
+        self.weights = self._compute_weights(tf)
+
+    @classmethod
+    def from_corpus(cls, tokenized_corpus: Iterable[List[str]], **kwargs) -> "SparseBM25":
+        vocab: Dict[str, int] = {}
+        tf = build_term_matrix(tokenized_corpus, vocab)
+        return cls(tf, vocab, **kwargs)
+
+    def _compute_weights(self, tf: sparse.csr_matrix) -> sparse.csc_matrix:
+        n = self.n_docs
+        if n == 0 or tf.nnz == 0:
+            self.idf = np.zeros(self.n_terms, dtype=np.float32)
+            return sparse.csc_matrix(tf.shape, dtype=np.float32)
+
+        tf = tf.tocsr()
+        doc_len = np.asarray(tf.sum(axis=1)).ravel()
+        avgdl = doc_len.mean()
+
+        self.idf = bm25_idf(np.bincount(tf.indices, minlength=self.n_terms), n, self.epsilon)
+
+        # Trọng số phía doc, vector hóa trên toàn bộ phần tử khác 0
+        rows = np.repeat(np.arange(n), np.diff(tf.indptr))
+        tf_data = tf.data.astype(np.float32)
+        norm = self.k1 * (1 - self.b + self.b * doc_len[rows] / avgdl)
+        data = self.idf[tf.indices] * tf_data * (self.k1 + 1) / (tf_data + norm)
+
+        w = sparse.csr_matrix((data.astype(np.float32), tf.indices, tf.indptr), shape=tf.shape)
+        # CSC để cắt nhanh theo cột (term) lúc query
+        return w.tocsc()
+
+    def _query_vector(self, query_tokens: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        counts: Dict[int, int] = {}
+        for t in query_tokens:
+            tid = self.vocab.get(t)
+            if tid is not None and tid < self.n_terms:
+                counts[tid] = counts.get(tid, 0) + 1
+        ids = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        cnt = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        return ids, cnt
+
+    def get_scores(self, query_tokens: List[str]) -> np.ndarray:
+        """Điểm BM25 cho toàn bộ corpus (tương thích BM25Okapi.get_scores)."""
+        ids, cnt = self._query_vector(query_tokens)
+        if ids.size == 0:
+            return np.zeros(self.n_docs, dtype=np.float32)
+        return self.weights[:, ids] @ cnt
+
+    def get_top_k(self, query_tokens: List[str], k: int, positive_only: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Trả về (doc_indices, scores) giảm dần; điểm bằng nhau -> doc index nhỏ trước
+        (giống sorted(..., reverse=True)[:k] trên get_scores của rank_bm25).
+        positive_only=True: chỉ gồm doc có score > 0; False: luôn đủ k doc (nếu corpus đủ),
+        kể cả doc điểm 0 như rank_bm25.
+        """
+        if k <= 0 or self.n_docs == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        scores = self.get_scores(query_tokens)
+        if k < scores.size:
+            # Điểm thứ k; doc bằng điểm đó lấy theo index tăng dần cho đủ k
+            kth = np.partition(scores, -k)[-k]
+            above = np.flatnonzero(scores > kth)
+            top = np.concatenate([above, np.flatnonzero(scores == kth)[: k - above.size]])
+        else:
+            top = np.arange(scores.size)
+        top = top[np.lexsort((top, -scores[top]))]
+        if positive_only:
+            top = top[scores[top] > 0]
+        return top, scores[top]
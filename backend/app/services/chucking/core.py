@@ -0,0 +1,140 @@
+# app/services/chucking/core.py
+"""
+Lõi chunking "tokenize 1 lần":
+- Mỗi trang / đoạn text được tokenize đúng 1 lần (theo batch) kèm offset_mapping.
+- Số token của câu / đoạn văn = số token có vị trí bắt đầu nằm trong span ký tự của nó
+  (bisect trên offset), không encode lại.
+- Ranh giới chunk tính bằng token, text của chunk cắt thẳng từ chuỗi gốc
+  (không tokenizer.decode).
+"""
+import bisect
+import re
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+Span = Tuple[int, int]
+
+
+class TokenizedText:
+    """Text gốc + vị trí (start, end) ký tự của từng token."""
+
+    __slots__ = ("text", "starts", "ends")
+
+    def __init__(self, text: str, offsets: Sequence[Sequence[int]]):
+        self.text = text
+        self.starts = [s for s, _ in offsets]
+        self.ends = [e for _, e in offsets]
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def token_at(self, char_pos: int) -> int:
+        """Chỉ số token đầu tiên bắt đầu tại hoặc sau char_pos."""
+        return bisect.bisect_left(self.starts, char_pos)
+
+    def count(self, start: int, end: int) -> int:
+        """Số token bắt đầu trong span ký tự [start, end)."""
+        return self.token_at(end) - self.token_at(start)
+
+    def char_span(self, tok_start: int, tok_end: int) -> Span:
+        """Span ký tự bao các token [tok_start, tok_end) (tok_end > tok_start)."""
+        return self.starts[tok_start], self.ends[tok_end - 1]
+
+    def char_end_after(self, start: int, max_tokens: int) -> int:
+        """Vị trí ký tự kết thúc của max_tokens token đầu tiên tính từ start (cắt theo token budget)."""
+        i = self.token_at(start)
+        j = min(i + max_tokens, len(self))
+        return self.ends[j - 1] if j > i else start
+
+    def windows(self, size: int, overlap: int) -> List[Span]:
+        """Cửa sổ trượt theo token: list (tok_start, tok_end)."""
+        n = len(self)
+        out = []
+        start = 0
+        while start < n:
+            end = min(start + size, n)
+            out.append((start, end))
+            if end == n:
+                break
+            start = max(start + 1, end - overlap)
+        return out
+
+
+def tokenize_texts(tokenizer, texts: List[str]) -> List[TokenizedText]:
+    """Tokenize cả list text trong 1 lần gọi (fast tokenizer chạy batch song song)."""
+    if not texts:
+        return []
+    enc = tokenizer(texts, add_special_tokens=False, return_offsets_mapping=True)
+    return [TokenizedText(t, offs) for t, offs in zip(texts, enc["offset_mapping"])]
+
+
+def split_spans(text: str, separator: re.Pattern, start: int = 0, end: int = None) -> List[Span]:
+    """
+    Giống [s.strip() for s in separator.split(text[start:end]) if s.strip()]
+    nhưng trả về span (start, end) trong text gốc.
+    """
+    end = len(text) if end is None else end
+    spans = []
+    pos = start
+    for m in separator.finditer(text, start, end):
+        spans.append((pos, m.start()))
+        pos = m.end()
+    spans.append((pos, end))
+    return [s for s in (strip_span(text, a, b) for a, b in spans) if s[1] > s[0]]
+
+
+def strip_span(text: str, start: int, end: int) -> Span:
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def pack_sentences(
+    sentences: Iterable[Tuple[str, int, int]],
+    chunk_size: int,
+    overlap_sentences: int,
+) -> Iterator[Dict]:
+    """
+    Gom câu (text, n_tokens, page) thành chunk theo token budget, overlap N câu cuối.
+    Số token của chunk = tổng số token các câu (đã biết trước, không encode lại).
+    Yield dict: page_start, page_end, token_len, sentence_count, text (chưa có chunk_id).
+    """
+    buffer: List[str] = []
+    lens: List[int] = []
+    pages: List[int] = []
+    total = 0
+
+    def chunk() -> Dict:
+        return {
+            "page_start": min(pages) if pages else 0,
+            "page_end": max(pages) if pages else 0,
+            "token_len": total,
+            "sentence_count": len(buffer),
+            "text": " ".join(buffer).strip(),
+        }
+
+    for text, n, page in sentences:
+        # Thêm câu này mà vượt quá -> xuất chunk hiện tại, buffer mới bắt đầu từ phần overlap
+        if buffer and total + n > chunk_size:
+            yield chunk()
+            if overlap_sentences > 0 and len(buffer) > overlap_sentences:
+                del buffer[:-overlap_sentences]
+                del lens[:-overlap_sentences]
+                del pages[:-overlap_sentences]
+                total = sum(lens)
+            elif overlap_sentences <= 0:
+                # Không overlap -> buffer mới rỗng
+                # (còn buffer không dài hơn overlap thì giữ nguyên, như logic cũ)
+                buffer.clear()
+                lens.clear()
+                pages.clear()
+                total = 0
+
+        buffer.append(text)
+        lens.append(n)
+        pages.append(page)
+        total += n
+
+    if buffer:
+        yield chunk()
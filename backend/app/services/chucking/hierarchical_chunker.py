@@ -1,18 +1,19 @@
 from __future__ import annotations
 
 import re
-from typing import List, Dict, Optional
-from transformers import AutoTokenizer
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 from app.services.pdf_ingest import normalize_text
-# Đảm bảo bạn đang dùng bản sentence_chunker mới nhất tôi đã sửa ở bước trước
-from .sentence_chunker import chunk_by_sentences
+from .sentence_chunker import sentence_spans
+from .tokenizers import get_tokenizer
+from .core import pack_sentences, split_spans, tokenize_texts
 
 # --- FIX 1: Cải thiện Regex dọn dẹp ---
 # Bắt thêm khoảng trắng thừa quanh dấu gạch ngang: "process - \n ing"
 _RE_HYPHEN_LINEBREAK = re.compile(r"(\w)[ \t]*-[ \t]*\n[ \t]*(\w)", flags=re.UNICODE) 
 _RE_SINGLE_NL = re.compile(r"(?<!\n)\n(?!\n)")
 _RE_MULTI_NL = re.compile(r"\n{3,}")
+_RE_PARA_BREAK = re.compile(r"\n\n")
 
 def _clean_layout_text(t: str) -> str:
     """
@@ -32,165 +33,165 @@ def _clean_layout_text(t: str) -> str:
     t = re.sub(r"\n\n[ \t]+", "\n\n", t).strip()
     return t
 
-def _token_len(tokenizer: AutoTokenizer, text: str) -> int:
-    return len(tokenizer.encode(text, add_special_tokens=False))
+_TOKENIZE_BATCH_PAGES = 32
 
-def chunk_hierarchical(
-    pages: List[Dict],
-    tokenizer_model: str,
-    coarse_target_tokens: int = 1024, # Khuyến nghị: 1024 cho Parent
-    coarse_overlap_tokens: int = 200, 
-    chunk_size: int = 512,            # Khuyến nghị: 256-512 cho Child
-    overlap_sentences: int = 2,
-    return_level: str = "both",       # "fine" | "coarse" | "both" | "nested"
-) -> List[Dict]:
+def _iter_paragraphs(pages: Iterable[Dict], tokenizer) -> Iterator[Dict]:
     """
-    Hierarchical Chunking (Đã sửa lỗi Logic):
-    1. Pre-process: Biến pages thành danh sách các đoạn văn (Paragraphs) kèm metadata trang.
-    2. Coarse Split: Gom các paragraphs lại thành Parent Chunk theo token limit.
-    3. Fine Split: Cắt Parent Chunk thành các Child Chunks (câu).
+    Đoạn văn (paragraph) theo thứ tự, mỗi đoạn kèm các câu đã đếm token:
+    {'text', 'tokens', 'page', 'sentences': [(text, tokens, page)]}
+    Trang được đọc lười và tokenize theo lô -> dùng được với pages là generator.
     """
-    tokenizer = AutoTokenizer.from_pretrained(tokenizer_model, use_fast=True)
-    
-    # --- STEP 1: Xây dựng danh sách Paragraphs (Atomic Units) ---
-    # Thay vì xử lý string khổng lồ, ta xử lý list các đoạn văn nhỏ
-    # Structure: {'text': str, 'tokens': int, 'page': int}
-    
-    paragraphs = []
-    
+    batch: List[tuple] = []
+
+    def drain():
+        for (page_no, clean), tok in zip(batch, tokenize_texts(tokenizer, [c for _, c in batch])):
+            # Tách thành các đoạn nhỏ dựa trên \n\n
+            for a, b in split_spans(clean, _RE_PARA_BREAK):
+                yield {
+                    "text": clean[a:b],
+                    "tokens": tok.count(a, b),
+                    "page": page_no, # Lưu vết trang cho đoạn văn này
+                    "sentences": [(clean[sa:sb], tok.count(sa, sb), page_no) for sa, sb in sentence_spans(clean, a, b)],
+                }
+        batch.clear()
+
     for p in pages:
-        raw = normalize_text(p["text"]) or ""
-        clean = _clean_layout_text(raw)
+        clean = _clean_layout_text(normalize_text(p["text"]) or "")
         if not clean.strip():
             continue
-            
-        # Tách thành các đoạn nhỏ dựa trên \n\n
-        splits = clean.split("\n\n")
-        for s in splits:
-            s = s.strip()
-            if not s: 
-                continue
-            paragraphs.append({
-                "text": s,
-                "tokens": _token_len(tokenizer, s),
-                "page": p["page"] # Lưu vết trang cho đoạn văn này
-            })
-
-    if not paragraphs:
-        return []
-
-    # --- STEP 2: Tạo Coarse Chunks (Sliding Window chính xác) ---
-    coarse_chunks = []
-    
-    idx = 0
-    while idx < len(paragraphs):
-        current_chunk_paras = []
+        batch.append((p["page"], clean))
+        if len(batch) >= _TOKENIZE_BATCH_PAGES:
+            yield from drain()
+    yield from drain()
+
+def iter_hierarchical(
+    pages: Iterable[Dict],
+    tokenizer_model: str,
+    coarse_target_tokens: int = 1024,
+    coarse_overlap_tokens: int = 200,
+    chunk_size: int = 512,
+    overlap_sentences: int = 2,
+    with_children: bool = True,
+) -> Iterator[Tuple[Dict, List[Dict]]]:
+    """
+    1 lượt duyệt duy nhất: yield (parent, children) ngay khi mỗi parent hoàn tất.
+    - Parent: gom paragraph theo coarse_target_tokens, overlap lùi theo paragraph.
+    - Child: gom câu của chính parent đó (câu đã tokenize sẵn, không tách / encode lại),
+      page_start / page_end là trang thật của các câu trong child.
+    Chỉ giữ trong bộ nhớ các paragraph của parent đang xây -> tuyến tính, chạy được theo luồng.
+    """
+    tokenizer = get_tokenizer(tokenizer_model)
+    paragraphs = _iter_paragraphs(pages, tokenizer)
+
+    window: List[Dict] = []   # paragraph từ đầu parent hiện tại trở đi
+    n_parents = 0
+    n_children = 0
+    exhausted = False
+
+    while True:
+        # --- Gom paragraph cho đến khi đầy coarse_target_tokens ---
+        # Cho phép lố một chút để trọn vẹn paragraph (đoạn đầu tiên luôn được nhận)
+        i = 0
         current_tokens = 0
-        start_idx = idx
-        
-        # Gom paragraph cho đến khi đầy coarse_target_tokens
-        while idx < len(paragraphs):
-            para = paragraphs[idx]
-            # Nếu thêm đoạn này mà lố quá nhiều (ví dụ > 1.2 lần target) thì dừng
-            # Hoặc dừng đúng target tùy logic. Ở đây cho phép lố một chút để trọn vẹn paragraph.
+        while True:
+            if i >= len(window):
+                nxt = next(paragraphs, None)
+                if nxt is None:
+                    exhausted = True
+                    break
+                window.append(nxt)
+            para = window[i]
             if current_tokens + para["tokens"] > coarse_target_tokens and current_tokens > 0:
                 break
-            
-            current_chunk_paras.append(para)
             current_tokens += para["tokens"]
-            idx += 1
-            
-        # Tạo Coarse Chunk
-        full_text = "\n\n".join([p["text"] for p in current_chunk_paras])
-        page_start = current_chunk_paras[0]["page"]
-        page_end = current_chunk_paras[-1]["page"]
-        parent_id = f"parent_{len(coarse_chunks)}"
-        
-        coarse_chunk = {
-            "chunk_id": parent_id,
+            i += 1
+
+        if i == 0:
+            break
+
+        parent_paras = window[:i]
+        parent = {
+            "chunk_id": f"parent_{n_parents}",
             "level": "coarse",
-            "page_start": page_start,
-            "page_end": page_end,
+            "page_start": parent_paras[0]["page"],
+            "page_end": parent_paras[-1]["page"],
             "token_len": current_tokens,
-            "text": full_text
+            "text": "\n\n".join(p["text"] for p in parent_paras),
         }
-        coarse_chunks.append(coarse_chunk)
+        n_parents += 1
 
-        # --- Logic Overlap (Backtrack) ---
-        # Nếu đã hết bài thì thoát
-        if idx >= len(paragraphs):
+        children = []
+        if with_children:
+            sentences = (s for para in parent_paras for s in para["sentences"])
+            for ch in pack_sentences(sentences, chunk_size, overlap_sentences):
+                children.append({
+                    "chunk_id": f"child_{n_children}",
+                    "level": "both",
+                    "parent_id": parent["chunk_id"],
+                    **ch,
+                })
+                n_children += 1
+
+        yield parent, children
+
+        # Đã hết bài
+        if exhausted and i >= len(window):
             break
-            
-        # Nếu cần overlap, ta lùi index lại một đoạn
-        # Tính ngược từ cuối chunk hiện tại, lùi lại cho đến khi đủ overlap_tokens
+
+        # --- Logic Overlap (Backtrack) ---
+        # Lùi lại từ cuối parent cho đến khi đủ coarse_overlap_tokens
         overlap_accum = 0
         backtrack_steps = 0
-        
-        # Duyệt ngược từ đoạn văn cuối cùng vừa thêm vào
-        for i in range(idx - 1, start_idx - 1, -1):
-            overlap_accum += paragraphs[i]["tokens"]
+        for para in reversed(parent_paras):
+            overlap_accum += para["tokens"]
             backtrack_steps += 1
             if overlap_accum >= coarse_overlap_tokens:
                 break
-        
-        # Lùi idx lại để chunk sau bắt đầu từ vùng overlap
-        # Lưu ý: Nếu chunk quá ngắn (ngắn hơn overlap), ta lùi về start_idx + 1 để tránh kẹt vô tận
-        new_idx = idx - backtrack_steps
-        if new_idx <= start_idx: 
-             # Trường hợp 1 paragraph lớn hơn cả chunk size, buộc phải move next
-            idx = max(idx, start_idx + 1)
-        else:
-            idx = new_idx
-
-    # --- STEP 3: Tạo Fine Chunks (Children) ---
-    all_fine_chunks = []
-    
-    # Nếu chỉ cần Coarse thì return sớm
-    if return_level == "coarse":
-        return coarse_chunks
 
-    fine_global_idx = 0
-    
-    for parent in coarse_chunks:
-        # Gọi lại hàm sentence split cho nội dung của Parent
-        # Lưu ý: Ta giả lập input pages là 1 trang chứa nội dung parent
-        # (Chấp nhận việc Fine Chunk sẽ mang page range của Parent)
-        
-        pseudo_pages = [{
-            "text": parent["text"], 
-            "page": parent["page_start"] # Tạm lấy page start làm mốc
-        }]
-        
-        children = chunk_by_sentences(
-            pages=pseudo_pages,
-            tokenizer_model=tokenizer_model,
-            chunk_size=chunk_size,
-            overlap_sentences=overlap_sentences
-        )
-        
-        for ch in children:
-            # Gán Parent ID vào Child
-            ch["chunk_id"] = f"child_{fine_global_idx}"
-            ch["level"] = "both"
-            ch["parent_id"] = parent["chunk_id"]
-            # Fix lại page range theo Parent (vì child nằm trong parent)
-            ch["page_start"] = parent["page_start"]
-            ch["page_end"] = parent["page_end"]
-            
-            all_fine_chunks.append(ch)
-            fine_global_idx += 1
+        # Parent quá ngắn (ngắn hơn overlap) -> buộc phải tiến tới, tránh kẹt vô tận
+        new_start = i - backtrack_steps
+        if new_start <= 0:
+            new_start = i
+        del window[:new_start]
 
-    # --- Return Formatting ---
-    if return_level == "nested":
-        # Trả về Parent kèm list children bên trong (Dành cho DB NoSQL/JSON)
-        nested_chunks = []
-        for p in coarse_chunks:
-            p["child_chunks"] = [c for c in all_fine_chunks if c["parent_id"] == p["chunk_id"]]
-            nested_chunks.append(p)
-        return nested_chunks
+def chunk_hierarchical(
+    pages: List[Dict],
+    tokenizer_model: str,
+    coarse_target_tokens: int = 1024, # Khuyến nghị: 1024 cho Parent
+    coarse_overlap_tokens: int = 200, 
+    chunk_size: int = 512,            # Khuyến nghị: 256-512 cho Child
+    overlap_sentences: int = 2,
+    return_level: str = "both",       # "fine" | "coarse" | "both" | "nested"
+) -> List[Dict]:
+    """
+    Hierarchical Chunking 1 lượt (xem iter_hierarchical):
+    1. Pre-process: pages -> paragraphs -> câu, tokenize mỗi trang 1 lần.
+    2. Coarse Split: Gom các paragraphs lại thành Parent Chunk theo token limit.
+    3. Fine Split: Gom câu của từng Parent thành các Child Chunks.
+    """
+    coarse_chunks: List[Dict] = []
+    all_fine_chunks: List[Dict] = []
+
+    for parent, children in iter_hierarchical(
+        pages,
+        tokenizer_model,
+        coarse_target_tokens=coarse_target_tokens,
+        coarse_overlap_tokens=coarse_overlap_tokens,
+        chunk_size=chunk_size,
+        overlap_sentences=overlap_sentences,
+        # Nếu chỉ cần Coarse thì không tạo child
+        with_children=return_level != "coarse",
+    ):
+        if return_level == "nested":
+            # Trả về Parent kèm list children bên trong (Dành cho DB NoSQL/JSON)
+            parent["child_chunks"] = children
+        coarse_chunks.append(parent)
+        all_fine_chunks.extend(children)
 
+    # --- Return Formatting ---
+    if return_level in ("coarse", "nested"):
+        return coarse_chunks
     elif return_level == "both":
         return coarse_chunks + all_fine_chunks
-        
     else: # "fine"
-        return all_fine_chunks
\ No newline at end of file
+        return all_fine_chunks
@@ -1,5 +1,6 @@
 # app/services/chunking/token_chunker.py
-from transformers import AutoTokenizer
+from app.services.chucking.tokenizers import get_tokenizer
+from app.services.chucking.core import tokenize_texts
 from app.services.pdf_ingest import normalize_text
 
 def chunk_by_tokens_per_page(
@@ -8,36 +9,31 @@ def chunk_by_tokens_per_page(
     chunk_size: int = 500,
     overlap: int = 80,
 ):
-    tokenizer = AutoTokenizer.from_pretrained(tokenizer_model, use_fast=True)
+    tokenizer = get_tokenizer(tokenizer_model)
     chunks = []
     idx = 0
 
+    page_nos, texts = [], []
     for p in pages:
         text = normalize_text(p["text"])
-        if not text:
-            continue
+        if text:
+            page_nos.append(p["page"])
+            texts.append(text)
 
-        tokens = tokenizer.encode(text, add_special_tokens=False)
-        n = len(tokens)
-        start = 0
-
-        while start < n:
-            end = min(start + chunk_size, n)
-            chunk_tokens = tokens[start:end]
-            chunk_text = tokenizer.decode(chunk_tokens).strip()
+    # Tokenize tất cả trang 1 lần, text chunk cắt theo offset (không decode)
+    for page_no, tok in zip(page_nos, tokenize_texts(tokenizer, texts)):
+        for start, end in tok.windows(chunk_size, overlap):
+            char_start, char_end = tok.char_span(start, end)
+            chunk_text = tok.text[char_start:char_end].strip()
 
             if chunk_text:
                 chunks.append({
                     "chunk_id": f"tok_{idx}",
-                    "page_start": p["page"],
-                    "page_end": p["page"],
-                    "token_len": len(chunk_tokens),
+                    "page_start": page_no,
+                    "page_end": page_no,
+                    "token_len": end - start,
                     "text": chunk_text,
                 })
                 idx += 1
 
-            if end == n:
-                break
-            start = max(0, end - overlap)
-
     return chunks
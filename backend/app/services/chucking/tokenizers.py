@@ -0,0 +1,44 @@
+# app/services/chucking/tokenizers.py
+"""
+Registry tokenizer dùng chung cho toàn process:
+mỗi tokenizer_model chỉ load (AutoTokenizer.from_pretrained) đúng 1 lần,
+các chunker gọi get_tokenizer() thay vì tự load lại ở mỗi lần chunk.
+"""
+import threading
+import time
+from typing import Dict
+
+from transformers import AutoTokenizer, PreTrainedTokenizerBase
+
+_lock = threading.Lock()
+_tokenizers: Dict[str, PreTrainedTokenizerBase] = {}
+_load_seconds: Dict[str, float] = {}
+
+
+def get_tokenizer(tokenizer_model: str) -> PreTrainedTokenizerBase:
+    tok = _tokenizers.get(tokenizer_model)
+    if tok is not None:
+        return tok
+
+    with _lock:
+        # Kiểm tra lại: luồng khác có thể vừa load xong
+        tok = _tokenizers.get(tokenizer_model)
+        if tok is None:
+            started = time.perf_counter()
+            tok = AutoTokenizer.from_pretrained(tokenizer_model, use_fast=True)
+            _load_seconds[tokenizer_model] = time.perf_counter() - started
+            _tokenizers[tokenizer_model] = tok
+            print(f"🔤 Loaded tokenizer {tokenizer_model} ({_load_seconds[tokenizer_model]:.2f}s)")
+        return tok
+
+
+def loaded_tokenizers() -> Dict[str, float]:
+    """tokenizer_model -> thời gian load (giây)."""
+    with _lock:
+        return dict(_load_seconds)
+
+
+def clear_tokenizers():
+    with _lock:
+        _tokenizers.clear()
+        _load_seconds.clear()
@@ -1,5 +1,6 @@
 import re
-from transformers import AutoTokenizer
+from app.services.chucking.tokenizers import get_tokenizer
+from app.services.chucking.core import TokenizedText, split_spans, tokenize_texts
 from app.services.pdf_ingest import normalize_text
 
 
@@ -12,27 +13,6 @@ TOC_HEADING = re.compile(r"^\s*(mục lục|table of contents)\s*$", re.I)
 _SENT_SPLIT = re.compile(r"(?<=[\.\!\?。！？])\s+")
 _PARA_SPLIT = re.compile(r"\n{2,}")  # paragraph = blank lines
 
-def _split_paragraphs(text: str) -> list[str]:
-    text = text.strip()
-    if not text:
-        return []
-    paras = [p.strip() for p in _PARA_SPLIT.split(text) if p.strip()]
-    return paras
-
-def _split_sentences(text: str) -> list[str]:
-    text = text.strip()
-    if not text:
-        return []
-    sents = [s.strip() for s in _SENT_SPLIT.split(text) if s.strip()]
-    return sents
-
-def _tok_len(tokenizer, text: str) -> int:
-    return len(tokenizer.encode(text, add_special_tokens=False))
-
-def _truncate_to_tokens(tokenizer, text: str, max_tokens: int) -> str:
-    ids = tokenizer.encode(text, add_special_tokens=False)[:max_tokens]
-    return tokenizer.decode(ids).strip()
-
 def clean_pdf_artifacts(text: str) -> str:
     lines = []
     for ln in text.splitlines():
@@ -79,45 +59,50 @@ def chunk_by_tokens(
     - Đóng gói paragraphs vào chunk theo token budget.
     - Nếu paragraph quá dài -> tách câu, rồi đóng gói.
     - Overlap theo tokens (nhưng overlap bằng cách carry một phần text cuối).
+    Mỗi trang chỉ tokenize 1 lần; số token, điểm cắt và overlap đều tính từ offset.
     """
-    tokenizer = AutoTokenizer.from_pretrained(tokenizer_model, use_fast=True)
+    tokenizer = get_tokenizer(tokenizer_model)
 
-    # 1) Build "units": mỗi unit là 1 đoạn (paragraph) kèm page number
-    units: list[dict] = []
+    page_nos, texts = [], []
     for p in pages:
-        page_no = int(p.get("page", 1))
         t = normalize_text(p.get("text", ""))
-        if not t:
-            continue
+        if t:
+            page_nos.append(int(p.get("page", 1)))
+            texts.append(t)
 
-        for para in _split_paragraphs(t):
+    # 1) Build "units": mỗi unit là 1 đoạn (paragraph) kèm page number
+    # unit = (page, tokenized page, char_start, char_end, n_tokens)
+    units: list[tuple[int, TokenizedText, int, int, int]] = []
+    for page_no, tok in zip(page_nos, tokenize_texts(tokenizer, texts)):
+        for a, b in split_spans(tok.text, _PARA_SPLIT):
+            n = tok.count(a, b)
             # Nếu đoạn quá dài: tách câu
-            if _tok_len(tokenizer, para) > max_para_tokens:
-                sents = _split_sentences(para)
+            if n > max_para_tokens:
+                sents = split_spans(tok.text, _SENT_SPLIT, a, b)
                 # nếu vẫn không tách được (text kỳ), fallback truncate
                 if len(sents) <= 1:
-                    para = _truncate_to_tokens(tokenizer, para, max_para_tokens)
-                    units.append({"page": page_no, "text": para})
+                    end = tok.char_end_after(a, max_para_tokens)
+                    units.append((page_no, tok, a, end, tok.count(a, end)))
                 else:
-                    for s in sents:
-                        if s:
-                            units.append({"page": page_no, "text": s})
+                    for sa, sb in sents:
+                        units.append((page_no, tok, sa, sb, tok.count(sa, sb)))
             else:
-                units.append({"page": page_no, "text": para})
+                units.append((page_no, tok, a, b, n))
 
     # 2) Pack units into chunks by token budget
     chunks: list[dict] = []
     idx = 0
 
-    cur_texts: list[str] = []
+    # cur: (tokenized page, char_start, char_end, n_tokens) của từng phần trong chunk đang gom
+    cur: list[tuple[TokenizedText, int, int, int]] = []
     cur_pages: list[int] = []
     cur_tokens = 0
 
     def flush():
-        nonlocal idx, cur_texts, cur_pages, cur_tokens
-        if not cur_texts:
+        nonlocal idx
+        if not cur:
             return
-        text = "\n\n".join(cur_texts).strip()
+        text = "\n\n".join(tok.text[a:b] for tok, a, b, _ in cur).strip()
         if text:
             chunks.append({
                 "chunk_id": f"c{idx}",
@@ -126,40 +111,44 @@ def chunk_by_tokens(
                 "text": text,
             })
             idx += 1
-        cur_texts, cur_pages, cur_tokens = [], [], 0
 
-    # Overlap: giữ phần tail của chunk trước theo token budget
-    def make_overlap_text(text: str) -> str:
+    # Overlap: giữ phần tail của chunk trước theo token budget (cắt theo offset)
+    def overlap_tail() -> list[tuple[TokenizedText, int, int, int]]:
         if overlap_tokens <= 0:
-            return ""
-        ids = tokenizer.encode(text, add_special_tokens=False)
-        tail = ids[-min(overlap_tokens, len(ids)):]
-        return tokenizer.decode(tail).strip()
-
-    for u in units:
-        t = u["text"]
-        page_no = u["page"]
-        t_tokens = _tok_len(tokenizer, t)
-
+            return []
+        tail = []
+        remaining = overlap_tokens
+        for tok, a, b, n in reversed(cur):
+            if n <= remaining:
+                tail.append((tok, a, b, n))
+                remaining -= n
+            else:
+                cut = tok.starts[tok.token_at(a) + n - remaining]
+                tail.append((tok, cut, b, remaining))
+                remaining = 0
+            if remaining == 0:
+                break
+        return [t for t in reversed(tail) if t[2] > t[1]]
+
+    for page_no, tok, a, b, t_tokens in units:
         # Nếu 1 unit đã lớn hơn chunk_size: truncate để không vỡ
         if t_tokens > chunk_size:
-            t = _truncate_to_tokens(tokenizer, t, chunk_size)
-            t_tokens = _tok_len(tokenizer, t)
+            b = tok.char_end_after(a, chunk_size)
+            t_tokens = tok.count(a, b)
 
         # nếu thêm vào vượt quá budget -> flush chunk hiện tại
         if cur_tokens > 0 and (cur_tokens + t_tokens) > chunk_size:
-            prev_text = "\n\n".join(cur_texts)
+            tail = overlap_tail()
             flush()
 
             # tạo overlap chunk mới từ tail text trước
-            overlap_text = make_overlap_text(prev_text)
-            if overlap_text:
-                cur_texts = [overlap_text]
-                cur_pages = [page_no]  # provenance: overlap không chắc page, tạm gán page hiện tại
-                cur_tokens = _tok_len(tokenizer, overlap_text)
+            cur = tail
+            # provenance: overlap không chắc page, tạm gán page hiện tại
+            cur_pages = [page_no] if tail else []
+            cur_tokens = sum(n for *_, n in tail)
 
         # add unit
-        cur_texts.append(t)
+        cur.append((tok, a, b, t_tokens))
         cur_pages.append(page_no)
         cur_tokens += t_tokens
 
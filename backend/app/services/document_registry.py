@@ -0,0 +1,186 @@
+# app/services/document_registry.py
+"""
+Sổ đăng ký tài liệu theo hash nội dung (document_id = sha256[:12]):
+- Upload trùng nội dung với tài liệu đã index -> trả kết quả ngay, không embed / insert lại.
+- Cùng nội dung nhưng tên file mới -> chỉ ghi thêm tên file vào metadata.
+- Tài liệu đang được 1 job khác ingest -> trả lại job đó thay vì tạo job trùng.
+Lưu SQLite nên sống sót qua restart; lúc khởi động được đối chiếu với index (backfill + reconcile).
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from app.core.settings import settings
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    document_id TEXT PRIMARY KEY,
+    sha256 TEXT,
+    status TEXT NOT NULL,
+    filename TEXT,
+    filenames TEXT NOT NULL,
+    job_id TEXT,
+    pages INTEGER,
+    chunks INTEGER,
+    prior_status TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+# indexing: đang có job ingest; indexed: đã có trong Milvus + BM25; failed: lần ingest gần nhất lỗi
+_ACTIVE = ("indexing", "indexed")
+
+
+class DocumentRegistry:
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.row_factory = sqlite3.Row
+            self._db.execute(_SCHEMA)
+            # DB tạo từ phiên bản chưa có cột prior_status
+            columns = {r["name"] for r in self._db.execute("PRAGMA table_info(documents)")}
+            if "prior_status" not in columns:
+                self._db.execute("ALTER TABLE documents ADD COLUMN prior_status TEXT")
+            self._db.commit()
+        return self._db
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict:
+        d = dict(row)
+        d["filenames"] = json.loads(d["filenames"])
+        return d
+
+    def get(self, document_id: str) -> Optional[Dict]:
+        with self._db_lock:
+            row = self._conn().execute("SELECT * FROM documents WHERE document_id = ?", (document_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def claim(self, document_id: str, sha256: Optional[str], filename: Optional[str], job_id: str) -> Optional[Dict]:
+        """
+        Giữ chỗ ingest cho job_id.
+        - Trả None: job này được quyền ingest (chưa có, lần trước lỗi, hoặc chính job này chạy lại).
+          Trạng thái cũ của bản ghi được lưu vào prior_status (xem reclaimed).
+        - Trả bản ghi hiện có (indexed / indexing bởi job khác): không ingest lại,
+          chỉ ghi thêm filename nếu là tên mới.
+        """
+        now = time.time()
+        with self._db_lock:
+            conn = self._conn()
+            row = conn.execute("SELECT * FROM documents WHERE document_id = ?", (document_id,)).fetchone()
+            if row and row["status"] in _ACTIVE and row["job_id"] != job_id:
+                existing = self._to_dict(row)
+                if filename and filename not in existing["filenames"]:
+                    existing["filenames"].append(filename)
+                    existing["updated_at"] = now
+                    conn.execute(
+                        "UPDATE documents SET filenames = ?, updated_at = ? WHERE document_id = ?",
+                        (json.dumps(existing["filenames"], ensure_ascii=False), now, document_id),
+                    )
+                    conn.commit()
+                return existing
+
+            filenames = json.loads(row["filenames"]) if row else []
+            if filename and filename not in filenames:
+                filenames.append(filename)
+            conn.execute(
+                """INSERT INTO documents (document_id, sha256, status, filename, filenames, job_id, prior_status, created_at, updated_at)
+                   VALUES (?, ?, 'indexing', ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(document_id) DO UPDATE SET
+                       sha256 = excluded.sha256, status = 'indexing', filename = excluded.filename,
+                       filenames = excluded.filenames, job_id = excluded.job_id,
+                       prior_status = excluded.prior_status, updated_at = excluded.updated_at""",
+                (document_id, sha256, filename, json.dumps(filenames, ensure_ascii=False), job_id,
+                 row["status"] if row else None, now, now),
+            )
+            conn.commit()
+            return None
+
+    def reclaimed(self, document_id: str) -> bool:
+        """
+        Lần claim gần nhất tiếp quản 1 bản ghi đã có (lần ingest trước lỗi, job chạy lại...)
+        -> Milvus có thể còn chunk dở của lần trước, phải xóa trước khi ingest.
+        """
+        doc = self.get(document_id)
+        return doc is not None and doc.get("prior_status") is not None
+
+    def _set(self, document_id: str, **fields):
+        fields["updated_at"] = time.time()
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        with self._db_lock:
+            conn = self._conn()
+            conn.execute(f"UPDATE documents SET {cols} WHERE document_id = ?", (*fields.values(), document_id))
+            conn.commit()
+
+    def mark_indexed(self, document_id: str, pages: int, chunks: int):
+        self._set(document_id, status="indexed", pages=pages, chunks=chunks)
+
+    def mark_failed(self, document_id: str):
+        self._set(document_id, status="failed")
+
+    def release_job(self, job_id: str) -> int:
+        """Job bị hủy trước khi chạy xong: tài liệu nó đang giữ chỗ (indexing) -> failed."""
+        with self._db_lock:
+            conn = self._conn()
+            cur = conn.execute(
+                "UPDATE documents SET status = 'failed', updated_at = ? WHERE status = 'indexing' AND job_id = ?",
+                (time.time(), job_id),
+            )
+            conn.commit()
+            return cur.rowcount
+
+    def backfill(self, documents: Dict[str, Dict]) -> int:
+        """Đăng ký tài liệu đã có trong index (vd: ingest trước khi có registry). Không ghi đè bản ghi cũ."""
+        now = time.time()
+        with self._db_lock:
+            conn = self._conn()
+            before = conn.total_changes
+            conn.executemany(
+                """INSERT OR IGNORE INTO documents (document_id, status, filename, filenames, chunks, created_at, updated_at)
+                   VALUES (?, 'indexed', ?, ?, ?, ?, ?)""",
+                [
+                    (document_id, d.get("filename"), json.dumps([d["filename"]] if d.get("filename") else [], ensure_ascii=False), d.get("chunks"), now, now)
+                    for document_id, d in documents.items()
+                ],
+            )
+            conn.commit()
+            return conn.total_changes - before
+
+    def reconcile(self, indexed_ids: Iterable[str], active_job_ids: Iterable[str]) -> Dict[str, int]:
+        """
+        Sửa bản ghi lệch với thực tế (gọi lúc khởi động, sau backfill), đánh dấu failed để upload lại được:
+        - indexed nhưng không còn trong index (collection bị xóa / tạo lại...);
+        - indexing nhưng job giữ chỗ không còn queued / running (job đã bị xóa, DB job mất...).
+        """
+        indexed_ids, active_job_ids = set(indexed_ids), set(active_job_ids)
+        with self._db_lock:
+            conn = self._conn()
+            rows = conn.execute(
+                "SELECT document_id, status, job_id FROM documents WHERE status IN ('indexed', 'indexing')"
+            ).fetchall()
+            missing = [r["document_id"] for r in rows if r["status"] == "indexed" and r["document_id"] not in indexed_ids]
+            orphaned = [r["document_id"] for r in rows if r["status"] == "indexing" and r["job_id"] not in active_job_ids]
+            now = time.time()
+            conn.executemany(
+                "UPDATE documents SET status = 'failed', updated_at = ? WHERE document_id = ?",
+                [(now, document_id) for document_id in missing + orphaned],
+            )
+            conn.commit()
+        return {"missing": len(missing), "orphaned": len(orphaned)}
+
+    def stats(self) -> Dict:
+        with self._db_lock:
+            rows = self._conn().execute("SELECT status, COUNT(*) AS n FROM documents GROUP BY status").fetchall()
+        return {r["status"]: r["n"] for r in rows}
+
+
+document_registry = DocumentRegistry(settings.document_registry_db)
@@ -1,8 +1,11 @@
 from FlagEmbedding import FlagModel
 import numpy as np
+from app.utils.cache import TTLCache, normalize_query
+from app.services.embedding_cache import chunk_key, get_embedding_cache
 
 class LocalEmbedder:
-    def __init__(self, model_name: str):
+    def __init__(self, model_name: str, query_cache_size: int = 2048, query_cache_ttl: float = 3600):
+        self.model_name = model_name
         # FlagModel sẽ tự chọn device phù hợp (cpu/gpu) tuỳ torch
         self.model = FlagModel(
             model_name,
@@ -13,6 +16,10 @@ class LocalEmbedder:
         # cache dim một lần để khỏi encode khi import nhiều lần
         self._dim = None
 
+        # Cache vector của CÂU HỎI (LRU + TTL). Tách riêng khỏi đường encode tài liệu
+        # để ingest không đẩy các câu hỏi hay gặp ra khỏi cache.
+        self.query_cache = TTLCache(maxsize=query_cache_size, ttl=query_cache_ttl)
+
     @property
     def dim(self) -> int:
         if self._dim is None:
@@ -29,3 +36,53 @@ class LocalEmbedder:
         norms = np.linalg.norm(arr, axis=1, keepdims=True)
         arr = arr / np.clip(norms, 1e-12, None)
         return arr.tolist()
+
+    def encode_documents(self, texts: list[str]) -> list[list[float]]:
+        """
+        Encode chunk tài liệu (đường ingest) qua cache trên đĩa: chunk có text (đã chuẩn hóa)
+        từng encode rồi lấy lại vector, chỉ chunk mới / đã đổi mới chạy model.
+        """
+        cache = get_embedding_cache(self.model_name, self.dim)
+        if cache is None:
+            return self.encode(texts)
+
+        keys = [chunk_key(self.model_name, t) for t in texts]
+        out: list = cache.get_many(keys)
+
+        # key -> vị trí đầu tiên cần encode (chunk trùng text trong batch chỉ encode 1 lần)
+        missing: dict = {}
+        for i, (k, v) in enumerate(zip(keys, out)):
+            if v is None and k not in missing:
+                missing[k] = i
+
+        if missing:
+            vecs = self.encode([texts[i] for i in missing.values()])
+            cache.put_many(list(missing.keys()), vecs)
+            fresh = dict(zip(missing.keys(), vecs))
+            return [fresh[k] if v is None else v.tolist() for k, v in zip(keys, out)]
+        return [v.tolist() for v in out]
+
+    def _query_key(self, text: str) -> tuple:
+        return (self.model_name, normalize_query(text))
+
+    def encode_queries(self, texts: list[str]) -> list[list[float]]:
+        """
+        Encode câu hỏi có cache: chỉ những câu chưa có trong cache mới được
+        encode (gộp thành 1 batch), câu trùng nhau trong cùng 1 lần gọi chỉ encode 1 lần.
+        """
+        keys = [self._query_key(t) for t in texts]
+        out: list = [self.query_cache.get(k) for k in keys]
+
+        # key -> vị trí đầu tiên cần encode
+        missing: dict = {}
+        for i, (k, v) in enumerate(zip(keys, out)):
+            if v is None and k not in missing:
+                missing[k] = i
+
+        if missing:
+            vecs = self.encode([texts[i] for i in missing.values()])
+            for k, v in zip(missing.keys(), vecs):
+                self.query_cache.set(k, v)
+            fresh = dict(zip(missing.keys(), vecs))
+            out = [v if v is not None else fresh[k] for k, v in zip(keys, out)]
+        return out
@@ -0,0 +1,115 @@
+# app/services/embedding_batcher.py
+"""
+Micro-batching cho encode câu hỏi:
+Nhiều request /ask đồng thời mỗi cái chỉ encode 1-4 câu ngắn -> trên CPU rất phí.
+Batcher gom các yêu cầu trong vài mili-giây (hoặc tới khi đủ max_batch câu),
+chạy 1 forward pass rồi trả phần kết quả của từng request qua Future.
+"""
+import asyncio
+import time
+from typing import List, Optional
+
+from app.core.executors import run_inference
+from app.services.embedding import LocalEmbedder
+from app.utils.metrics import Histogram
+
+
+class _Pending:
+    __slots__ = ("texts", "future", "enqueued_at")
+
+    def __init__(self, texts: List[str], future: asyncio.Future):
+        self.texts = texts
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+class EmbeddingBatcher:
+    def __init__(self, embedder: LocalEmbedder, max_batch: int = 32, max_wait_ms: float = 5.0):
+        self.embedder = embedder
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+        self.batch_sizes = Histogram([1, 2, 4, 8, 16, 32, 64, 128])
+        self.queue_wait_ms = Histogram([0.5, 1, 2, 5, 10, 20, 50, 100])
+        self.cache_fast_path = 0
+
+    def _ensure_worker(self):
+        # Tạo queue + worker lười trong event loop đang chạy
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def encode_queries(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+
+        # Tất cả đã có trong cache -> trả ngay, không phải chờ gom batch
+        if all(self.embedder.query_cache.peek(self.embedder._query_key(t)) is not None for t in texts):
+            self.cache_fast_path += 1
+            return self.embedder.encode_queries(texts)
+
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_Pending(list(texts), future))
+        return await future
+
+    async def _collect(self) -> List[_Pending]:
+        first = await self._queue.get()
+        batch = [first]
+        n_texts = len(first.texts)
+        deadline = time.perf_counter() + self.max_wait
+
+        while n_texts < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(item)
+            n_texts += len(item.texts)
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            # Bỏ các request đã bị hủy (vd: retrieval speculative bị cancel)
+            batch = [p for p in batch if not p.future.done()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            for p in batch:
+                self.queue_wait_ms.observe((started - p.enqueued_at) * 1000)
+
+            texts = [t for p in batch for t in p.texts]
+            self.batch_sizes.observe(len(texts))
+            try:
+                # encode_queries vẫn dùng cache: chỉ câu chưa có mới vào model, trong 1 lần encode
+                vecs = await run_inference(self.embedder.encode_queries, texts)
+            except Exception as e:
+                for p in batch:
+                    if not p.future.done():
+                        p.future.set_exception(e)
+                continue
+
+            # Trả lại đúng phần của từng request
+            pos = 0
+            for p in batch:
+                part = vecs[pos:pos + len(p.texts)]
+                pos += len(p.texts)
+                if not p.future.done():
+                    p.future.set_result(part)
+
+    def stats(self) -> dict:
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "cache_fast_path": self.cache_fast_path,
+            "batch_size": self.batch_sizes.snapshot(),
+            "queue_wait_ms": self.queue_wait_ms.snapshot(),
+        }
@@ -0,0 +1,256 @@
+# app/services/embedding_cache.py
+"""
+Cache embedding của chunk tài liệu trên đĩa, key = (tên model, hash text chunk đã chuẩn hóa).
+Ingest lại PDF đã sửa / đổi tham số chunking: chunk nào text không đổi thì lấy vector từ cache,
+chỉ chunk mới / đã đổi mới phải chạy qua model.
+
+Bố cục (1 thư mục / model + dim), các file .npy mở bằng memmap, kích thước cố định:
+- vectors.npy : float16 [capacity, dim]   vector đã normalize L2 (fp16: nửa dung lượng, sai số ~1e-3)
+- keys.npy    : uint8   [capacity, 16]    blake2b-128 của key, toàn 0 = slot trống
+- ticks.npy   : uint64  [capacity]        lần dùng gần nhất (đuổi theo LRU xấp xỉ)
+capacity tính từ embed_cache_max_mb. Đầy thì đuổi 1 lượt embed_cache_evict_fraction slot
+cũ nhất (argpartition) chứ không đuổi từng slot. Index key -> slot chỉ nằm trong RAM,
+dựng lại từ keys.npy khi mở.
+
+Giới hạn:
+- Chỉ 1 process được mở 1 thư mục cache (index nằm trong RAM của process đó): giữ flock trên
+  file .lock. Chạy nhiều worker (uvicorn --workers N...) thì worker đầu dùng cache, các worker
+  sau thấy thư mục đang bị khóa -> tắt cache (embed bình thường, không lỗi).
+- Ghi vào memmap nằm ngay trong page cache của OS (process crash không mất); msync xuống đĩa
+  theo embed_cache_flush_interval_s và khi tắt server, không phải sau mỗi lần put.
+"""
+import fcntl
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.core.settings import settings
+
+_WS = re.compile(r"\s+")
+_KEY_BYTES = 16
+
+
+def normalize_chunk(text: str) -> str:
+    """NFC + gộp khoảng trắng (giữ hoa thường: model phân biệt)."""
+    return _WS.sub(" ", unicodedata.normalize("NFC", text or "")).strip()
+
+
+def chunk_key(model_name: str, text: str) -> bytes:
+    payload = f"{model_name}\x00{normalize_chunk(text)}".encode("utf-8")
+    return hashlib.blake2b(payload, digest_size=_KEY_BYTES).digest()
+
+
+class CacheLockedError(RuntimeError):
+    """Thư mục cache đang được process khác mở."""
+
+
+class EmbeddingDiskCache:
+    def __init__(self, path: str, dim: int, max_mb: float, evict_fraction: float = 0.1, flush_interval_s: float = 30):
+        self.path = path
+        self.dim = dim
+        slot_bytes = dim * 2 + _KEY_BYTES + 8
+        self.capacity = max(1, int(max_mb * 1024 * 1024) // slot_bytes)
+        self.evict_fraction = evict_fraction
+        self.flush_interval_s = flush_interval_s
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.flushes = 0
+        self._dirty = False
+        self._flushed_at = time.monotonic()
+
+        os.makedirs(path, exist_ok=True)
+        # Khóa thư mục trước khi mở memmap (flock tự nhả khi process chết)
+        self._lock_file = open(os.path.join(path, ".lock"), "a")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            raise CacheLockedError(f"{path} đang được process khác dùng")
+        shapes = {
+            "vectors": (np.float16, (self.capacity, dim)),
+            "keys": (np.uint8, (self.capacity, _KEY_BYTES)),
+            "ticks": (np.uint64, (self.capacity,)),
+        }
+        arrays = {name: _open_existing(self._file(name), dtype, shape) for name, (dtype, shape) in shapes.items()}
+        if any(a is None for a in arrays.values()):
+            # Lần đầu, hoặc đổi max_mb / dim -> tạo mới cả bộ (3 file phải khớp slot với nhau)
+            arrays = {
+                name: np.lib.format.open_memmap(self._file(name), mode="w+", dtype=dtype, shape=shape)
+                for name, (dtype, shape) in shapes.items()
+            }
+        self._vectors = arrays["vectors"]
+        self._keys = arrays["keys"]
+        self._ticks = arrays["ticks"]
+
+        used = np.flatnonzero(self._keys.any(axis=1))
+        self._index: Dict[bytes, int] = {self._keys[i].tobytes(): int(i) for i in used}
+        free = np.ones(self.capacity, dtype=bool)
+        free[used] = False
+        # pop() từ cuối -> cấp slot số nhỏ trước
+        self._free: List[int] = np.flatnonzero(free)[::-1].tolist()
+        self._tick = int(self._ticks[used].max()) + 1 if len(used) else 1
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, f"{name}.npy")
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get_many(self, keys: List[bytes]) -> List[Optional[np.ndarray]]:
+        """Vector float32 cho key có trong cache, None cho key chưa có."""
+        with self._lock:
+            slots = [self._index.get(k) for k in keys]
+            hit_pos = [i for i, s in enumerate(slots) if s is not None]
+            self.hits += len(hit_pos)
+            self.misses += len(keys) - len(hit_pos)
+            out: List[Optional[np.ndarray]] = [None] * len(keys)
+            if hit_pos:
+                hit_slots = np.asarray([slots[i] for i in hit_pos])
+                vecs = self._vectors[hit_slots].astype(np.float32)
+                self._ticks[hit_slots] = self._tick
+                self._tick += 1
+                for i, v in zip(hit_pos, vecs):
+                    out[i] = v
+            return out
+
+    def put_many(self, keys: List[bytes], vectors) -> None:
+        with self._lock:
+            new = [(k, v) for k, v in zip(keys, vectors) if k not in self._index]
+            # Batch lớn hơn cả cache: chỉ giữ phần cuối
+            new = new[-self.capacity:]
+            if not new:
+                return
+            if len(self._free) < len(new):
+                self._evict(len(new) - len(self._free))
+            slots = np.asarray([self._free.pop() for _ in new])
+            # Ghi vector trước, key sau: slot chỉ "có" khi key đã được ghi
+            self._vectors[slots] = np.asarray([v for _, v in new], dtype=np.float16)
+            self._keys[slots] = np.frombuffer(b"".join(k for k, _ in new), dtype=np.uint8).reshape(-1, _KEY_BYTES)
+            self._ticks[slots] = self._tick
+            self._tick += 1
+            for (k, _), s in zip(new, slots.tolist()):
+                self._index[k] = s
+            self.writes += len(new)
+            self._dirty = True
+            if time.monotonic() - self._flushed_at >= self.flush_interval_s:
+                self._flush()
+
+    def _flush(self):
+        for a in (self._vectors, self._keys, self._ticks):
+            a.flush()
+        self._dirty = False
+        self._flushed_at = time.monotonic()
+        self.flushes += 1
+
+    def close(self):
+        """Flush phần chưa ghi xuống đĩa rồi nhả khóa thư mục (gọi khi tắt server)."""
+        with self._lock:
+            if self._lock_file.closed:
+                return
+            # Tick của lần get gần nhất cũng được ghi (không đánh dấu dirty)
+            self._flush()
+            self._lock_file.close()
+
+    def _evict(self, need: int):
+        """Đuổi tối thiểu need slot, mỗi lượt ít nhất evict_fraction * capacity slot cũ nhất."""
+        used = np.fromiter(self._index.values(), dtype=np.int64, count=len(self._index))
+        n = min(len(used), max(need, int(self.capacity * self.evict_fraction)))
+        if n <= 0:
+            return
+        if n < len(used):
+            victims = used[np.argpartition(self._ticks[used], n - 1)[:n]]
+        else:
+            victims = used
+        for s in victims.tolist():
+            del self._index[self._keys[s].tobytes()]
+        self._keys[victims] = 0
+        self._free.extend(victims.tolist())
+        self.evictions += len(victims)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "path": self.path,
+            "size": len(self._index),
+            "capacity": self.capacity,
+            "dim": self.dim,
+            "disk_mb": round(sum(os.path.getsize(self._file(n)) for n in ("vectors", "keys", "ticks")) / 1e6, 1),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "flushes": self.flushes,
+            "unflushed": self._dirty,
+        }
+
+
+def _open_existing(path: str, dtype, shape) -> Optional[np.memmap]:
+    if not os.path.exists(path):
+        return None
+    try:
+        arr = np.lib.format.open_memmap(path, mode="r+")
+    except (ValueError, OSError):
+        return None
+    if arr.dtype != dtype or arr.shape != shape:
+        return None
+    return arr
+
+
+# 1 instance / thư mục: 2 instance cùng ghi 1 bộ file sẽ lệch index trong RAM.
+# None = thư mục bị process khác khóa -> cache tắt trong process này.
+_caches: Dict[str, Optional[EmbeddingDiskCache]] = {}
+_caches_lock = threading.Lock()
+
+
+def _cache_path(model_name: str, dim: int) -> str:
+    safe_name = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+    return os.path.join(settings.embed_cache_dir, f"{safe_name}-{dim}")
+
+
+def get_embedding_cache(model_name: str, dim: int) -> Optional[EmbeddingDiskCache]:
+    """
+    Cache đĩa dùng chung cho (model, dim), mở ở lần gọi đầu.
+    None nếu tắt (embed_cache_enabled=False) hoặc thư mục đang bị process khác giữ.
+    """
+    if not settings.embed_cache_enabled:
+        return None
+    path = _cache_path(model_name, dim)
+    with _caches_lock:
+        if path not in _caches:
+            try:
+                cache = EmbeddingDiskCache(
+                    path,
+                    dim=dim,
+                    max_mb=settings.embed_cache_max_mb,
+                    evict_fraction=settings.embed_cache_evict_fraction,
+                    flush_interval_s=settings.embed_cache_flush_interval_s,
+                )
+                print(f"💾 Embedding cache: {len(cache):,}/{cache.capacity:,} vector tại {path}")
+            except CacheLockedError as e:
+                cache = None
+                print(f"⚠️ Tắt embedding cache: {e}")
+            _caches[path] = cache
+        return _caches[path]
+
+
+def peek_embedding_cache(model_name: str, dim: int) -> Optional[EmbeddingDiskCache]:
+    """Cache đã mở của (model, dim), không mở / tạo file mới (None nếu chưa dùng tới)."""
+    with _caches_lock:
+        return _caches.get(_cache_path(model_name, dim))
+
+
+def close_embedding_caches():
+    with _caches_lock:
+        caches = [c for c in _caches.values() if c is not None]
+    for c in caches:
+        c.close()
@@ -0,0 +1,279 @@
+# app/services/ingest_jobs.py
+"""
+Hàng đợi job ingest chạy nền:
+- POST /documents/ingest chỉ lưu file PDF vào thư mục spool + ghi job vào SQLite rồi trả job id ngay.
+- N worker (ingest_job_workers) lấy job ra xử lý bằng handler do router đăng ký.
+- Job lưu trong SQLite nên sống sót qua restart: job đang chạy dở được đưa lại vào hàng đợi,
+  trừ khi đã bị gián đoạn đủ ingest_max_attempts lần (vd: PDF làm crash server) -> failed.
+- Tiến độ của job đang chạy đọc trực tiếp từ IngestProgress trong RAM; xong thì lưu xuống DB.
+- Mỗi job có kind ("pdf": 1 tài liệu, "bulk": file zip nhiều PDF), mỗi kind 1 handler.
+- File spool bị xóa khi job kết thúc, kể cả job lỗi: không có endpoint chạy lại job lỗi,
+  muốn thử lại thì upload lại (document registry đã đánh dấu failed nên sẽ được ingest lại).
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Optional
+
+from app.core.settings import settings
+from app.services.document_registry import document_registry
+from app.services.ingest_pipeline import IngestProgress
+
+# handler(job, progress) -> result (dict, lưu dạng JSON).
+# Handler tự đọc file spool (job["spool_path"]): job bulk đọc dần từng PDF trong zip, không nạp cả archive.
+JobHandler = Callable[[Dict, IngestProgress], Awaitable[Dict]]
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ingest_jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL DEFAULT 'pdf',
+    status TEXT NOT NULL,
+    document_id TEXT,
+    filename TEXT,
+    spool_path TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    progress TEXT,
+    result TEXT,
+    error TEXT
+)
+"""
+
+
+class IngestJobQueue:
+    def __init__(self, db_path: str, spool_dir: str, workers: int = 1, max_attempts: int = 3):
+        self.db_path = db_path
+        self.spool_dir = spool_dir
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self._handlers: Dict[str, JobHandler] = {}
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: list = []
+        self._live: Dict[str, IngestProgress] = {}
+
+    # --- SQLite ---
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.row_factory = sqlite3.Row
+            self._db.execute(_SCHEMA)
+            # DB tạo từ phiên bản chưa có cột kind
+            columns = {r["name"] for r in self._db.execute("PRAGMA table_info(ingest_jobs)")}
+            if "kind" not in columns:
+                self._db.execute("ALTER TABLE ingest_jobs ADD COLUMN kind TEXT NOT NULL DEFAULT 'pdf'")
+            self._db.commit()
+        return self._db
+
+    def _execute(self, sql: str, params: tuple = ()) -> list:
+        with self._db_lock:
+            conn = self._conn()
+            rows = conn.execute(sql, params).fetchall()
+            conn.commit()
+            return rows
+
+    def _update(self, job_id: str, **fields):
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        self._execute(f"UPDATE ingest_jobs SET {cols} WHERE id = ?", (*fields.values(), job_id))
+
+    # --- Vòng đời ---
+    def set_handler(self, handler: JobHandler, kind: str = "pdf"):
+        self._handlers[kind] = handler
+
+    def start(self):
+        """Gọi khi app khởi động (trong event loop): khôi phục job dở dang rồi chạy worker."""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        # Job đã chạy đủ số lần cho phép mà lần nào cũng bị gián đoạn -> bỏ, không chạy lại mãi
+        exhausted = self._execute(
+            "SELECT id, attempts FROM ingest_jobs WHERE status IN ('queued', 'running') AND attempts >= ?",
+            (self.max_attempts,),
+        )
+        for row in exhausted:
+            self._update(
+                row["id"],
+                status="failed",
+                finished_at=time.time(),
+                error=f"Job bị gián đoạn {row['attempts']} lần (ingest_max_attempts = {self.max_attempts})",
+            )
+            document_registry.release_job(row["id"])
+        if exhausted:
+            logger.warning(f"Bỏ {len(exhausted)} job ingest đã chạy quá {self.max_attempts} lần")
+        # Job đang chạy lúc tắt server -> chạy lại từ đầu
+        self._execute("UPDATE ingest_jobs SET status = 'queued' WHERE status = 'running'")
+        pending = self._execute("SELECT id FROM ingest_jobs WHERE status = 'queued' ORDER BY created_at")
+        for row in pending:
+            self._queue.put_nowait(row["id"])
+        if pending:
+            logger.info(f"Khôi phục {len(pending)} job ingest chưa xong")
+        # File spool của job đã kết thúc còn sót lại (vd: tắt server giữa lúc ghi kết quả và xóa file)
+        finished = self._execute("SELECT spool_path FROM ingest_jobs WHERE status IN ('done', 'failed')")
+        for row in finished:
+            _remove_file(row["spool_path"])
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # --- API ---
+    @staticmethod
+    def new_job_id() -> str:
+        return uuid.uuid4().hex
+
+    def spool_path(self, job_id: str, kind: str = "pdf") -> str:
+        os.makedirs(self.spool_dir, exist_ok=True)
+        return os.path.join(self.spool_dir, f"{job_id}.{'zip' if kind == 'bulk' else 'pdf'}")
+
+    async def submit(
+        self,
+        data: bytes,
+        filename: Optional[str],
+        document_id: Optional[str],
+        kind: str = "pdf",
+        job_id: Optional[str] = None,
+    ) -> Dict:
+        """job_id: cấp trước (new_job_id) khi cần ghi nhận job trước lúc submit, vd: giữ chỗ trong document registry."""
+        if kind not in self._handlers:
+            raise ValueError(f"Không có handler cho job kind '{kind}'")
+        job_id = job_id or self.new_job_id()
+        await asyncio.to_thread(_write_file, self.spool_path(job_id, kind), data)
+        return await self.submit_spooled(job_id, filename, document_id, kind)
+
+    async def submit_spooled(self, job_id: str, filename: Optional[str], document_id: Optional[str], kind: str = "pdf") -> Dict:
+        """Như submit nhưng file spool đã được ghi sẵn ở spool_path(job_id, kind) (upload lớn ghi thẳng ra đĩa)."""
+        if kind not in self._handlers:
+            raise ValueError(f"Không có handler cho job kind '{kind}'")
+        self.start()
+        self._execute(
+            "INSERT INTO ingest_jobs (id, kind, status, document_id, filename, spool_path, created_at) VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+            (job_id, kind, document_id, filename, self.spool_path(job_id, kind), time.time()),
+        )
+        await self._queue.put(job_id)
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        rows = self._execute("SELECT * FROM ingest_jobs WHERE id = ?", (job_id,))
+        if not rows:
+            return None
+        row = rows[0]
+        live = self._live.get(job_id)
+        progress = live.as_dict() if live else json.loads(row["progress"] or "{}")
+        return {
+            "job_id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "document_id": row["document_id"],
+            "filename": row["filename"],
+            "attempts": row["attempts"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+            "queue_position": self._queue_position(job_id) if row["status"] == "queued" else None,
+            "progress": progress,
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+        }
+
+    def _queue_position(self, job_id: str) -> Optional[int]:
+        if self._queue is None:
+            return None
+        try:
+            return list(self._queue._queue).index(job_id)
+        except ValueError:
+            return None
+
+    def active_job_ids(self) -> set:
+        """Id các job chưa kết thúc (queued / running)."""
+        return {r["id"] for r in self._execute("SELECT id FROM ingest_jobs WHERE status IN ('queued', 'running')")}
+
+    def stats(self) -> Dict:
+        counts = {r["status"]: r["n"] for r in self._execute("SELECT status, COUNT(*) AS n FROM ingest_jobs GROUP BY status")}
+        return {"workers": self.workers, "queued": self._queue.qsize() if self._queue else 0, "by_status": counts}
+
+    # --- Worker ---
+    async def _worker(self, worker_id: int):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Worker ingest {worker_id} lỗi ngoài job {job_id}: {e}")
+
+    async def _run(self, job_id: str):
+        rows = self._execute("SELECT * FROM ingest_jobs WHERE id = ?", (job_id,))
+        if not rows or rows[0]["status"] != "queued":
+            return
+        job = dict(rows[0])
+        job["attempts"] += 1
+        progress = IngestProgress(job["document_id"], job["filename"])
+        progress.started_at = time.time()
+        self._live[job_id] = progress
+        self._update(job_id, status="running", attempts=job["attempts"], started_at=progress.started_at)
+        logger.info(f"Bắt đầu job ingest {job_id} ({job['filename']}, lần {job['attempts']})")
+
+        status, result, error = "failed", None, None
+        try:
+            result = await self._handlers[job["kind"]](job, progress)
+            status = "done"
+        except asyncio.CancelledError:
+            # Server đang tắt: giữ trạng thái running -> lần khởi động sau chạy lại
+            self._live.pop(job_id, None)
+            raise
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            logger.exception(f"Job ingest {job_id} lỗi")
+
+        progress.finished_at = time.time()
+        progress.stage = status
+        self._live.pop(job_id, None)
+        self._update(
+            job_id,
+            status=status,
+            finished_at=progress.finished_at,
+            progress=json.dumps(progress.as_dict(), ensure_ascii=False),
+            result=json.dumps(result, ensure_ascii=False) if result is not None else None,
+            error=error,
+        )
+        # Job lỗi cũng xóa spool (không có retry), tránh thư mục spool phình dần theo số job lỗi
+        _remove_file(job["spool_path"])
+        logger.info(f"Job ingest {job_id}: {status}")
+
+
+def _write_file(path: str, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def read_spool(job: Dict) -> bytes:
+    with open(job["spool_path"], "rb") as f:
+        return f.read()
+
+
+def _remove_file(path: Optional[str]):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+ingest_jobs = IngestJobQueue(
+    db_path=settings.ingest_job_db,
+    spool_dir=settings.ingest_job_spool_dir,
+    workers=settings.ingest_job_workers,
+    max_attempts=settings.ingest_max_attempts,
+)
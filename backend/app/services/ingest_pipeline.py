@@ -0,0 +1,309 @@
+# app/services/ingest_pipeline.py
+"""
+Ingest PDF theo luồng, các stage chạy chồng lên nhau:
+
+    extract (process pool) -> chunk (thread) -> embed (inference executor) -> insert (index executor)
+
+Giữa các stage là hàng đợi có giới hạn: stage trước chạy nhanh hơn sẽ phải chờ (backpressure),
+nên bộ nhớ chỉ giữ vài batch chứ không giữ cả tài liệu ở mỗi stage.
+Embedding theo batch cố định (ingest_embed_batch_size chunk), batch nào xong thì insert ngay.
+
+Bulk ingest (stream_ingest_many): nhiều tài liệu đi chung 1 pipeline, batch embed / insert
+gộp chunk của nhiều tài liệu nên không tốn chi phí cố định cho từng file.
+"""
+import asyncio
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+from app.core.executors import run_index, run_inference
+from app.core.settings import settings
+from app.services.chucking.hierarchical_chunker import iter_hierarchical
+from app.services.embedding import LocalEmbedder
+from app.services.milvus_store import delete_document, get_writer
+from app.services.pdf_ingest import iter_pages, page_count
+
+_DONE = object()
+
+
+class IngestProgress:
+    """Tiến độ ingest 1 tài liệu hoặc 1 lô nhiều tài liệu (đọc được trong lúc đang chạy)."""
+
+    def __init__(self, document_id: Optional[str], filename: Optional[str] = None):
+        self.document_id = document_id
+        self.filename = filename
+        self.stage = "queued"
+        self.files_total = 1
+        self.files_done = 0
+        self.files_failed = 0
+        self.total_pages = 0
+        self.pages_extracted = 0
+        self.chunks = 0
+        self.embedded = 0
+        self.inserted = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.stage_seconds: Dict[str, float] = {"extract_chunk": 0.0, "embed": 0.0, "insert": 0.0}
+
+    def as_dict(self) -> dict:
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        if self.files_total > 1:
+            # Bulk: tổng số trang chỉ biết dần khi mở từng file -> tính theo số file
+            progress = self.files_done / self.files_total
+        else:
+            progress = self.pages_extracted / self.total_pages if self.total_pages else 0.0
+        return {
+            "document_id": self.document_id,
+            "filename": self.filename,
+            "stage": self.stage,
+            "files_total": self.files_total,
+            "files_done": self.files_done,
+            "files_failed": self.files_failed,
+            "total_pages": self.total_pages,
+            "pages_extracted": self.pages_extracted,
+            "chunks": self.chunks,
+            "embedded": self.embedded,
+            "inserted": self.inserted,
+            "progress": round(progress, 4),
+            "elapsed_seconds": round(elapsed, 3),
+            "pages_per_sec": round(self.pages_extracted / elapsed, 2) if elapsed else 0.0,
+            "chunks_per_sec": round(self.inserted / elapsed, 2) if elapsed else 0.0,
+            "stage_seconds": {k: round(v, 3) for k, v in self.stage_seconds.items()},
+        }
+
+
+class IngestSource:
+    """
+    1 tài liệu đưa vào pipeline. read() chỉ được gọi khi tới lượt tài liệu này
+    (trong thread chunking), nên bulk ingest không phải giữ mọi PDF trong RAM.
+    Sau khi chạy xong, các trường kết quả (pages, chunks, inserted, error) được điền.
+    """
+
+    def __init__(self, document_id: str, filename: Optional[str], read: Callable[[], bytes]):
+        self.document_id = document_id
+        self.filename = filename
+        self.read = read
+        self.total_pages = 0
+        self.chunks = 0
+        self.inserted = 0
+        self.error: Optional[Exception] = None
+
+    def result(self) -> Dict:
+        return {
+            "document_id": self.document_id,
+            "filename": self.filename,
+            "status": "failed" if self.error else "done",
+            "pages": self.total_pages,
+            "chunks_inserted": 0 if self.error else self.inserted,
+            "error": f"{type(self.error).__name__}: {self.error}" if self.error else None,
+        }
+
+
+def _make_row(c: Dict, vec, document_id: str, filename: Optional[str], total_pages: int) -> Dict:
+    return {
+        "document_id": document_id,
+        "chunk_id": c["chunk_id"],
+        "page_start": c["page_start"],
+        "page_end": c["page_end"],
+        "text": c["text"],
+        "embedding": vec,
+        "level": c.get("level", "standard"),
+        "parent_id": c.get("parent_id") or "",
+        # Metadata để Frontend hiển thị tên file + trang
+        "metadata": {
+            "source": filename,
+            "page": c["page_start"],
+            "total_pages": total_pages,
+        },
+    }
+
+
+async def stream_ingest(
+    pdf_bytes: bytes,
+    document_id: str,
+    filename: Optional[str],
+    embedder: LocalEmbedder,
+    collection,
+    progress: Optional[IngestProgress] = None,
+    bm25=None,
+) -> int:
+    """
+    Chạy extract -> chunk -> embed -> insert theo luồng cho 1 PDF.
+    Trả về số chunk đã insert; bm25 (BM25Accumulator): nhận chunk đã insert để cập nhật BM25.
+    """
+    progress = progress or IngestProgress(document_id, filename)
+    source = IngestSource(document_id, filename, lambda: pdf_bytes)
+    await stream_ingest_many([source], embedder, collection, progress, bm25=bm25)
+    if source.error is not None:
+        raise source.error
+    return source.inserted
+
+
+async def stream_ingest_many(
+    sources: Sequence[IngestSource],
+    embedder: LocalEmbedder,
+    collection,
+    progress: Optional[IngestProgress] = None,
+    insert_batch_size: Optional[int] = None,
+    barrier: bool = False,
+    bm25=None,
+) -> Sequence[IngestSource]:
+    """
+    Chạy extract -> chunk -> embed -> insert cho nhiều tài liệu trên cùng 1 pipeline.
+    - Tài liệu được extract / chunk lần lượt, nhưng batch embed (ingest_embed_batch_size)
+      và batch insert (insert_batch_size dòng) gộp chunk của nhiều tài liệu liên tiếp.
+    - Không flush sau mỗi batch (MilvusWriter flush theo timer); barrier=True: flush khi xong cả lô.
+    - Tài liệu lỗi không dừng cả lô: ghi vào source.error, chunk đã insert của nó bị xóa.
+    - bm25 (BM25Accumulator, tùy chọn): mỗi batch vừa insert được tokenize ngay vào đó
+      (bỏ embedding, không giữ dòng đến hết lô); tài liệu lỗi bị bỏ khỏi accumulator.
+    Kết quả từng tài liệu nằm trên chính các IngestSource truyền vào.
+    """
+    progress = progress or IngestProgress(None)
+    progress.started_at = progress.started_at or time.time()
+    progress.files_total = len(sources)
+    progress.stage = "running"
+    insert_batch_size = insert_batch_size or settings.ingest_embed_batch_size
+    writer = get_writer(collection)
+    loop = asyncio.get_running_loop()
+
+    chunk_q: asyncio.Queue = asyncio.Queue(maxsize=settings.ingest_chunk_queue_size)
+    row_q: asyncio.Queue = asyncio.Queue(maxsize=settings.ingest_insert_queue_size)
+    stop = threading.Event()
+
+    # --- Stage 1+2: extract + chunk (generator, chạy trong thread) ---
+    def pages(pdf_bytes: bytes):
+        for p in iter_pages(pdf_bytes):
+            progress.pages_extracted += 1
+            yield p
+
+    def put(item):
+        asyncio.run_coroutine_threadsafe(chunk_q.put(item), loop).result()
+
+    def produce_one(src: IngestSource):
+        pdf_bytes = src.read()
+        src.total_pages = page_count(pdf_bytes)
+        progress.total_pages += src.total_pages
+        for parent, children in iter_hierarchical(
+            pages(pdf_bytes),
+            tokenizer_model=settings.embed_model,
+            coarse_target_tokens=settings.ingest_coarse_target_tokens,
+            coarse_overlap_tokens=settings.ingest_coarse_overlap_tokens,
+            chunk_size=settings.ingest_chunk_size,
+            overlap_sentences=settings.ingest_overlap_sentences,
+        ):
+            for c in (parent, *children):
+                if stop.is_set():
+                    return
+                src.chunks += 1
+                progress.chunks += 1
+                put((src, c))
+
+    def produce():
+        started = time.perf_counter()
+        try:
+            for src in sources:
+                if stop.is_set():
+                    return
+                try:
+                    produce_one(src)
+                except Exception as e:
+                    src.error = e
+                    progress.files_failed += 1
+                    print(f"❌ Ingest '{src.filename}' lỗi: {e}")
+                progress.files_done += 1
+        finally:
+            progress.stage_seconds["extract_chunk"] += time.perf_counter() - started
+            if not stop.is_set():
+                put(_DONE)
+
+    # --- Stage 3: embed theo batch cố định (có thể gồm chunk của nhiều tài liệu) ---
+    async def embed():
+        batch: List[tuple] = []
+        while True:
+            item = await chunk_q.get()
+            if item is not _DONE:
+                batch.append(item)
+            if batch and (item is _DONE or len(batch) >= settings.ingest_embed_batch_size):
+                started = time.perf_counter()
+                vecs = await run_inference(embedder.encode_documents, [c["text"] for _, c in batch])
+                progress.stage_seconds["embed"] += time.perf_counter() - started
+                progress.embedded += len(batch)
+                await row_q.put([
+                    (src, _make_row(c, v, src.document_id, src.filename, src.total_pages))
+                    for (src, c), v in zip(batch, vecs)
+                ])
+                batch = []
+            if item is _DONE:
+                await row_q.put(_DONE)
+                return
+
+    # --- Stage 4: gom đủ insert_batch_size dòng rồi insert ---
+    async def insert():
+        pending: List[tuple] = []
+        while True:
+            rows = await row_q.get()
+            if rows is not _DONE:
+                pending.extend(rows)
+            if pending and (rows is _DONE or len(pending) >= insert_batch_size):
+                started = time.perf_counter()
+                await run_index(writer.write, [r for _, r in pending])
+                progress.stage_seconds["insert"] += time.perf_counter() - started
+                progress.inserted += len(pending)
+                for src, _ in pending:
+                    src.inserted += 1
+                if bm25 is not None:
+                    await run_index(_feed_bm25, bm25, pending)
+                pending = []
+            if rows is _DONE:
+                break
+        if barrier:
+            await run_index(writer.barrier)
+
+    # Thread riêng (executor mặc định): chunking chạy suốt cả lô, không chiếm worker của index
+    producer = loop.run_in_executor(None, produce)
+    stages = [asyncio.ensure_future(embed()), asyncio.ensure_future(insert())]
+    try:
+        try:
+            await asyncio.gather(*stages)
+            await producer
+        finally:
+            for t in stages:
+                t.cancel()
+            # Dừng producer: báo stop rồi rút hàng đợi để lệnh put đang chờ (nếu có) thoát ra
+            stop.set()
+            while not producer.done():
+                while not chunk_q.empty():
+                    chunk_q.get_nowait()
+                await asyncio.sleep(0.01)
+    except Exception:
+        # Stage embed / insert lỗi -> cả lô dừng giữa chừng: xóa mọi tài liệu đã insert dở rồi báo lỗi
+        await _discard_inserted(collection, sources, bm25)
+        raise
+
+    # Tài liệu lỗi giữa chừng: bỏ phần chunk đã insert để không còn tài liệu dở dang
+    await _discard_inserted(collection, [src for src in sources if src.error is not None], bm25)
+
+    progress.stage = "inserted"
+    return sources
+
+
+def _feed_bm25(bm25, pending: List[tuple]):
+    """Đưa 1 batch vừa insert vào accumulator BM25, gom theo tài liệu."""
+    by_doc: Dict[str, List[Dict]] = {}
+    for src, r in pending:
+        by_doc.setdefault(src.document_id, []).append(r)
+    for document_id, rows in by_doc.items():
+        bm25.add(document_id, rows)
+
+
+async def _discard_inserted(collection, sources: Sequence[IngestSource], bm25=None):
+    """Xóa chunk đã insert của các tài liệu (lỗi xóa 1 tài liệu không chặn các tài liệu còn lại)."""
+    for src in sources:
+        if bm25 is not None:
+            bm25.discard(src.document_id)
+        if src.inserted:
+            try:
+                await run_index(delete_document, collection, src.document_id)
+            except Exception as e:
+                print(f"❌ Không xóa được chunk dở của '{src.filename}': {e}")
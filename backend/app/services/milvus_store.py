@@ -1,4 +1,8 @@
 # app/services/milvus_store.py
+import json
+import threading
+import time
+from typing import Iterator, Optional
 from pymilvus import connections, FieldSchema, CollectionSchema, DataType, Collection, utility
 from app.core.settings import settings
 
@@ -63,21 +67,17 @@ def ensure_collection(dim: int) -> Collection:
     col.load()
     return col
 
-def insert_chunks(col: Collection, rows: list[dict]):
+def _entities(rows: list[dict]) -> list[list]:
     """
-    Chèn dữ liệu vào Milvus.
+    Chuẩn bị dữ liệu theo cột (Columnar format).
     Phải đảm bảo thứ tự các cột khớp 100% với Schema ở trên.
     """
-    if not rows:
-        return
-
-    # Chuẩn bị dữ liệu theo cột (Columnar format)
-    entities = [
+    return [
         [r["document_id"] for r in rows],
         [r["chunk_id"] for r in rows],
-        
+
         # Hierarchical fields
-        [r.get("level", "standard") for r in rows], 
+        [r.get("level", "standard") for r in rows],
         [r.get("parent_id") or "" for r in rows],
 
         # Content fields
@@ -90,42 +90,230 @@ def insert_chunks(col: Collection, rows: list[dict]):
         # Nếu không có metadata, gán dict rỗng {}
         [r.get("metadata", {}) for r in rows]
     ]
-    
-    col.insert(entities)
-    col.flush()
+
+def _row_bytes(r: dict) -> int:
+    """Ước lượng kích thước 1 dòng trong message insert (vector float32 + text + metadata + các cột nhỏ)."""
+    return 4 * len(r["embedding"]) + len(r["text"].encode("utf-8")) + len(json.dumps(r.get("metadata") or {})) + 256
+
+def split_batches(rows: list[dict], max_rows: int, max_bytes: int) -> Iterator[tuple[list[dict], int]]:
+    """Chia rows thành các batch <= max_rows dòng và <= max_bytes (ước lượng). Yield (batch, bytes)."""
+    batch, size = [], 0
+    for r in rows:
+        n = _row_bytes(r)
+        if batch and (len(batch) >= max_rows or size + n > max_bytes):
+            yield batch, size
+            batch, size = [], 0
+        batch.append(r)
+        size += n
+    if batch:
+        yield batch, size
+
+def insert_chunks(col: Collection, rows: list[dict], flush: bool = True):
+    """
+    Chèn dữ liệu vào Milvus theo batch giới hạn dung lượng (không vượt giới hạn message gRPC).
+    flush=False: không seal segment (ingest dùng MilvusWriter, flush theo barrier / timer).
+    """
+    if not rows:
+        return
+
+    for batch, _ in split_batches(rows, settings.milvus_insert_max_rows, int(settings.milvus_insert_max_mb * 1024 * 1024)):
+        col.insert(_entities(batch))
+    if flush:
+        col.flush()
     print(f"✅ Đã insert {len(rows)} chunks vào Milvus.")
 
-def search(col: Collection, query_vec: list[float], topk: int = 30) -> list[dict]:
+
+class MilvusWriter:
     """
-    Tìm kiếm Vector.
-    Phải lấy trường 'metadata' ra để Frontend biết tên file.
+    Ghi chunk vào 1 collection cho ingest:
+    - write(rows): insert ngay theo batch giới hạn số dòng + dung lượng, KHÔNG flush.
+      Dữ liệu vẫn search được (growing segment), Milvus tự seal khi segment đủ lớn.
+    - Flush chỉ khi gọi barrier() (vd: cuối bulk ingest, tắt server) hoặc timer nền thấy
+      có dữ liệu chưa flush lâu hơn milvus_flush_interval_s -> không còn 1 segment nhỏ / tài liệu.
     """
+
+    def __init__(self, col: Collection, max_rows: int, max_mb: float, flush_interval_s: float):
+        self.col = col
+        self.max_rows = max(1, max_rows)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.flush_interval_s = flush_interval_s
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._timer: Optional[threading.Thread] = None
+        self._unflushed = 0
+        self._unflushed_since: Optional[float] = None
+        self.rows_inserted = 0
+        self.batches = 0
+        self.bytes_sent = 0
+        self.insert_seconds = 0.0
+        self.flushes = {"barrier": 0, "timer": 0}
+        self.flush_seconds = 0.0
+        self.last_flush_at: Optional[float] = None
+
+    def write(self, rows: list[dict]) -> int:
+        self._ensure_timer()
+        for batch, size in split_batches(rows, self.max_rows, self.max_bytes):
+            started = time.perf_counter()
+            self.col.insert(_entities(batch))
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.rows_inserted += len(batch)
+                self.batches += 1
+                self.bytes_sent += size
+                self.insert_seconds += elapsed
+                self._unflushed += len(batch)
+                self._unflushed_since = self._unflushed_since or time.time()
+        return len(rows)
+
+    def barrier(self):
+        """Flush ngay mọi dữ liệu đã insert (dữ liệu durable + segment được seal)."""
+        self._flush("barrier")
+
+    def _flush(self, reason: str):
+        with self._flush_lock:
+            with self._lock:
+                pending = self._unflushed
+            if not pending:
+                return
+            started = time.perf_counter()
+            self.col.flush()
+            with self._lock:
+                self._unflushed -= pending
+                if not self._unflushed:
+                    self._unflushed_since = None
+                self.flushes[reason] += 1
+                self.flush_seconds += time.perf_counter() - started
+                self.last_flush_at = time.time()
+            print(f"💾 Milvus flush ({reason}): {pending} chunks.")
+
+    def _ensure_timer(self):
+        if self._timer is not None or self.flush_interval_s <= 0:
+            return
+        with self._lock:
+            if self._timer is None:
+                self._timer = threading.Thread(target=self._run_timer, name="milvus-flush", daemon=True)
+                self._timer.start()
+
+    def _run_timer(self):
+        while not self._stop.wait(min(self.flush_interval_s, 5.0)):
+            since = self._unflushed_since
+            if since is not None and time.time() - since >= self.flush_interval_s:
+                try:
+                    self._flush("timer")
+                except Exception as e:
+                    print(f"❌ Lỗi flush Milvus: {e}")
+
+    def close(self):
+        """Dừng timer và flush phần còn lại (gọi khi tắt server)."""
+        self._stop.set()
+        self.barrier()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rows_inserted": self.rows_inserted,
+                "batches": self.batches,
+                "avg_batch_rows": round(self.rows_inserted / self.batches, 1) if self.batches else 0.0,
+                "mb_sent": round(self.bytes_sent / 1e6, 2),
+                "insert_seconds": round(self.insert_seconds, 3),
+                "rows_per_sec": round(self.rows_inserted / self.insert_seconds, 1) if self.insert_seconds else 0.0,
+                "mb_per_sec": round(self.bytes_sent / 1e6 / self.insert_seconds, 2) if self.insert_seconds else 0.0,
+                "unflushed_rows": self._unflushed,
+                "flushes": dict(self.flushes),
+                "flush_seconds": round(self.flush_seconds, 3),
+                "last_flush_at": self.last_flush_at,
+            }
+
+# 1 writer / collection (timer + thống kê dùng chung giữa các job ingest)
+_writers: dict[str, MilvusWriter] = {}
+_writers_lock = threading.Lock()
+
+def get_writer(col: Collection) -> MilvusWriter:
+    with _writers_lock:
+        writer = _writers.get(col.name)
+        if writer is None:
+            writer = MilvusWriter(
+                col,
+                max_rows=settings.milvus_insert_max_rows,
+                max_mb=settings.milvus_insert_max_mb,
+                flush_interval_s=settings.milvus_flush_interval_s,
+            )
+            _writers[col.name] = writer
+        return writer
+
+def close_writers():
+    with _writers_lock:
+        writers = list(_writers.values())
+    for w in writers:
+        w.close()
+
+def segment_stats(col: Collection) -> dict:
+    """Số segment (theo trạng thái) và số dòng / segment của collection đang load."""
+    segments = utility.get_query_segment_info(col.name)
+    by_state: dict[str, int] = {}
+    rows = []
+    for seg in segments:
+        state = _segment_state_name(seg.state)
+        by_state[state] = by_state.get(state, 0) + 1
+        rows.append(seg.num_rows)
+    return {
+        "segments": len(segments),
+        "by_state": by_state,
+        "rows": sum(rows),
+        "min_rows_per_segment": min(rows) if rows else 0,
+        "avg_rows_per_segment": round(sum(rows) / len(rows), 1) if rows else 0.0,
+    }
+
+def _segment_state_name(state) -> str:
+    try:
+        from pymilvus.grpc_gen.common_pb2 import SegmentState
+        return SegmentState.Name(state)
+    except Exception:
+        return str(state)
+
+_SEARCH_FIELDS = ["document_id", "chunk_id", "level", "parent_id", "page_start", "page_end", "text", "metadata"]
+
+def _to_hit(h) -> dict:
+    entity = h.entity
+    return {
+        "score": float(h.score),
+        "document_id": entity.get("document_id"),
+        "chunk_id": entity.get("chunk_id"),
+        "level": entity.get("level"),
+        "parent_id": entity.get("parent_id"),
+        "page_start": int(entity.get("page_start")),
+        "page_end": int(entity.get("page_end")),
+        "text": entity.get("text"),
+        
+        # --- TRẢ VỀ METADATA ---
+        "metadata": entity.get("metadata", {})
+    }
+
+def search_many(col: Collection, query_vecs: list[list[float]], topk: int = 30) -> list[list[dict]]:
+    """
+    Tìm kiếm nhiều vector trong 1 lần gọi col.search (1 round trip thay vì N).
+    Trả về list hit riêng cho từng vector, đúng thứ tự đầu vào.
+    """
+    if not query_vecs:
+        return []
+
     res = col.search(
-        data=[query_vec],
+        data=list(query_vecs),
         anns_field="embedding",
         param={"metric_type": "IP", "params": {"ef": 64}},
         limit=topk,
         # --- LẤY CÁC TRƯỜNG CẦN THIẾT (BAO GỒM METADATA) ---
-        output_fields=["document_id", "chunk_id", "level", "parent_id", "page_start", "page_end", "text", "metadata"],
+        output_fields=_SEARCH_FIELDS,
     )
+    return [[_to_hit(h) for h in hits] for hits in res]
 
-    hits = []
-    for h in res[0]:
-        entity = h.entity
-        hits.append({
-            "score": float(h.score),
-            "document_id": entity.get("document_id"),
-            "chunk_id": entity.get("chunk_id"),
-            "level": entity.get("level"),
-            "parent_id": entity.get("parent_id"),
-            "page_start": int(entity.get("page_start")),
-            "page_end": int(entity.get("page_end")),
-            "text": entity.get("text"),
-            
-            # --- TRẢ VỀ METADATA ---
-            "metadata": entity.get("metadata", {})
-        })
-    return hits
+def search(col: Collection, query_vec: list[float], topk: int = 30) -> list[dict]:
+    """
+    Tìm kiếm Vector.
+    Phải lấy trường 'metadata' ra để Frontend biết tên file.
+    """
+    return search_many(col, [query_vec], topk=topk)[0]
 
 def get_chunk_by_id(col: Collection, chunk_id: str):
     """
@@ -144,22 +332,79 @@ def get_chunk_by_id(col: Collection, chunk_id: str):
         return res[0]
     return None
 
+def delete_document(col: Collection, document_id: str):
+    """Xóa mọi chunk của 1 tài liệu (vd: dọn phần đã insert dở trước khi ingest lại)."""
+    col.delete(expr=f'document_id == "{document_id}"')
+    print(f"🗑️ Đã xóa chunks của tài liệu {document_id} khỏi Milvus.")
+
+_CORPUS_FIELDS = ["chunk_id", "text", "document_id", "level", "parent_id", "page_start", "page_end", "metadata"]
+
+def _iter_query_pages(col: Collection, expr: str, output_fields: list[str], batch_size: int) -> Iterator[list[dict]]:
+    """
+    Duyệt toàn bộ kết quả query theo từng trang.
+    Ưu tiên query_iterator (pymilvus >= 2.3); nếu server/SDK không hỗ trợ
+    thì tự phân trang theo khóa chính: id > last_id (Milvus trả kết quả theo thứ tự PK).
+    """
+    try:
+        it = col.query_iterator(batch_size=batch_size, expr=expr, output_fields=output_fields)
+    except Exception as e:
+        print(f"⚠️ query_iterator không khả dụng ({e}), chuyển sang phân trang theo id.")
+        it = None
+
+    if it is not None:
+        try:
+            while True:
+                page = it.next()
+                if not page:
+                    break
+                yield list(page)
+        finally:
+            it.close()
+        return
+
+    last_id = None
+    fields = output_fields if "id" in output_fields else output_fields + ["id"]
+    while True:
+        page_expr = expr if last_id is None else f"({expr}) and id > {last_id}"
+        page = col.query(expr=page_expr, output_fields=fields, limit=batch_size)
+        if not page:
+            break
+        yield page
+        last_id = max(r["id"] for r in page)
+        if len(page) < batch_size:
+            break
+
+def iter_documents(col: Collection, batch_size: int = 2000, log_every: int = 10) -> Iterator[list[dict]]:
+    """
+    Stream toàn bộ chunk trong collection theo batch cố định (không giới hạn 16,384 dòng).
+    Người gọi xử lý từng batch rồi bỏ đi -> bộ nhớ đỉnh chỉ cỡ 1 batch kết quả Milvus.
+    """
+    col.load()
+    t0 = time.perf_counter()
+    total = 0
+    n_batches = 0
+    for page in _iter_query_pages(col, "chunk_id != ''", _CORPUS_FIELDS, batch_size):
+        total += len(page)
+        n_batches += 1
+        if log_every and n_batches % log_every == 0:
+            elapsed = time.perf_counter() - t0
+            print(f"📚 Đang load corpus: {total:,} chunks ({total / max(elapsed, 1e-9):,.0f} chunks/s)")
+        yield page
+
+    elapsed = time.perf_counter() - t0
+    print(f"📚 Đã load {total:,} chunks trong {elapsed:.1f}s ({total / max(elapsed, 1e-9):,.0f} chunks/s).")
+
 def get_all_documents(col: Collection):
     """
     Lấy toàn bộ dữ liệu để cập nhật BM25.
+    (Gom hết vào 1 list -> chỉ dùng cho collection nhỏ / debug; khởi động dùng iter_documents.)
     """
     try:
-        col.load()
-        # Query toàn bộ (Giới hạn 16k dòng, nếu nhiều hơn cần phân trang)
-        results = col.query(
-            expr="chunk_id != ''", 
-            output_fields=["chunk_id", "text", "document_id", "level", "parent_id", "page_start", "page_end", "metadata"],
-            limit=16384 
-        )
-        
-        print(f"📚 Đã load {len(results)} documents cho BM25.")
+        results = []
+        for page in iter_documents(col):
+            results.extend(page)
         return results
 
     except Exception as e:
         print(f"⚠️ Lỗi khi load documents cho BM25: {e}")
-        return []
\ No newline at end of file
+        return []
@@ -1,17 +1,176 @@
 import fitz  # PyMuPDF
 import hashlib
+import multiprocessing
+import os
 import re
+import tempfile
+import threading
+import zipfile
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Dict, Iterator, Optional
+
+from app.core.settings import settings
 
 def sha256_bytes(b: bytes) -> str:
     return hashlib.sha256(b).hexdigest()
 
-def extract_pages(pdf_bytes: bytes) -> list[dict]:
+def sha256_zip_member(zf: zipfile.ZipFile, info: zipfile.ZipInfo) -> str:
+    """Hash 1 file trong zip theo từng khối (không giải nén cả file vào RAM)."""
+    h = hashlib.sha256()
+    with zf.open(info) as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def archive_pdf_members(zf: zipfile.ZipFile) -> list[zipfile.ZipInfo]:
+    """Các file .pdf trong zip (bỏ thư mục, file ẩn và __MACOSX)."""
+    out = []
+    for info in zf.infolist():
+        name = info.filename
+        base = os.path.basename(name)
+        if info.is_dir() or name.startswith("__MACOSX/") or base.startswith("."):
+            continue
+        if base.lower().endswith(".pdf"):
+            out.append(info)
+    return out
+
+def _extract_range(source, start: int, end: int) -> list[dict]:
+    """Đọc text các trang [start, end). source: bytes hoặc đường dẫn file PDF."""
+    if isinstance(source, (bytes, bytearray)):
+        doc = fitz.open(stream=source, filetype="pdf")
+    else:
+        doc = fitz.open(source)
+    try:
+        return [{"page": i + 1, "text": doc[i].get_text("text") or ""} for i in range(start, end)]
+    finally:
+        doc.close()
+
+def page_count(pdf_bytes: bytes) -> int:
     doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    pages = []
-    for i in range(len(doc)):
-        text = doc[i].get_text("text") or ""
-        pages.append({"page": i + 1, "text": text})
-    return pages
+    try:
+        return len(doc)
+    finally:
+        doc.close()
+
+# Process pool dùng chung (PyMuPDF giữ GIL nên thread không song song được).
+# Dùng "spawn" chứ không fork: fork sau khi đã load torch / mở thread (executor, Milvus client)
+# có thể copy lock đang bị giữ -> worker treo. Tạo lúc khởi động (start_extract_pool) để
+# request ingest đầu tiên không phải chờ spawn + import PyMuPDF trong từng worker.
+# Đổi số worker (vd: benchmark truyền workers khác) -> tạo pool mới; pool cũ chỉ bị shutdown
+# khi lượt dùng cuối của nó (_lease_pool) kết thúc, không cắt ngang luồng khác đang submit.
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_users: Dict[ProcessPoolExecutor, int] = {}
+_pool_lock = threading.Lock()
+
+def extract_workers() -> int:
+    return settings.pdf_extract_workers or os.cpu_count() or 1
+
+def _warmup() -> int:
+    return os.getpid()
+
+@contextmanager
+def _lease_pool(workers: int) -> Iterator[ProcessPoolExecutor]:
+    """Mượn pool có đúng `workers` worker trong suốt khối with (tạo / thay pool nếu cần)."""
+    global _pool, _pool_workers
+    retired = None
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            old = _pool
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+            # Pool cũ không còn ai dùng -> shutdown ngay; còn người dùng -> người trả cuối cùng shutdown
+            if old is not None and not _pool_users.get(old):
+                _pool_users.pop(old, None)
+                retired = old
+        pool = _pool
+        _pool_users[pool] = _pool_users.get(pool, 0) + 1
+    if retired is not None:
+        retired.shutdown(wait=True)
+    try:
+        yield pool
+    finally:
+        with _pool_lock:
+            _pool_users[pool] -= 1
+            retired = pool if pool is not _pool and not _pool_users[pool] else None
+            if retired is not None:
+                del _pool_users[pool]
+        if retired is not None:
+            retired.shutdown(wait=True)
+
+def start_extract_pool() -> int:
+    """Tạo pool + khởi động sẵn mọi worker (gọi lúc startup). Trả số worker, 0 nếu không dùng pool."""
+    workers = extract_workers()
+    if workers <= 1:
+        return 0
+    with _lease_pool(workers) as pool:
+        # spawn tạo worker theo nhu cầu: gửi đủ việc để mọi worker được khởi động + import xong
+        for f in [pool.submit(_warmup) for _ in range(workers)]:
+            f.result()
+    print(f"🧵 PDF extract pool: {workers} worker (spawn)")
+    return workers
+
+def shutdown_extract_pool():
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+        _pool_workers = 0
+        _pool_users.clear()
+
+def iter_pages(pdf_bytes: bytes, workers: Optional[int] = None) -> Iterator[dict]:
+    """
+    Trích text từng trang, yield theo đúng thứ tự trang (dùng cho ingest dạng luồng).
+    PDF đủ lớn (>= pdf_parallel_min_pages trang) và workers > 1:
+    chia dải trang cho process pool, mỗi worker tự mở PDF từ 1 file tạm dùng chung
+    (không pickle toàn bộ bytes cho từng shard). Chỉ tối đa 2 shard / worker đang chạy
+    cùng lúc -> bộ nhớ không phụ thuộc số trang.
+    """
+    workers = extract_workers() if workers is None else workers
+    n_pages = page_count(pdf_bytes)
+    if workers <= 1 or n_pages < settings.pdf_parallel_min_pages:
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        try:
+            for i in range(n_pages):
+                yield {"page": i + 1, "text": doc[i].get_text("text") or ""}
+        finally:
+            doc.close()
+        return
+
+    # Shard cỡ cố định; nhiều shard hơn số worker để cân tải (trang dài / ngắn không đều)
+    size = max(1, settings.pdf_pages_per_shard)
+    ranges = [(s, min(s + size, n_pages)) for s in range(0, n_pages, size)]
+
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    pending: deque = deque()
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(pdf_bytes)
+        with _lease_pool(workers) as pool:
+            try:
+                todo = iter(ranges)
+                for s, e in islice(todo, workers * 2):
+                    pending.append(pool.submit(_extract_range, path, s, e))
+                while pending:
+                    pages = pending.popleft().result()
+                    nxt = next(todo, None)
+                    if nxt is not None:
+                        pending.append(pool.submit(_extract_range, path, *nxt))
+                    yield from pages
+            finally:
+                # Hủy shard chưa chạy trước khi trả pool (shutdown pool cũ không phải chờ chúng)
+                for fut in pending:
+                    fut.cancel()
+    finally:
+        os.unlink(path)
+
+def extract_pages(pdf_bytes: bytes, workers: Optional[int] = None) -> list[dict]:
+    """Trích text toàn bộ trang (xem iter_pages)."""
+    return list(iter_pages(pdf_bytes, workers))
 
 def normalize_text(s: str) -> str:
     s = s.replace("\x00", " ")
@@ -1,134 +1,233 @@
 import asyncio
-from typing import List, Dict
-from rank_bm25 import BM25Okapi
+from typing import List, Dict, Iterable, Optional
+from app.services.bm25_index import BM25Accumulator, IncrementalBM25
 from app.services.embedding import LocalEmbedder
-from app.services.milvus_store import search
+from app.services.embedding_batcher import EmbeddingBatcher
+from app.services.milvus_store import search_many
 from app.services.rerank import LocalReranker
+from app.services.rerank_scheduler import RerankScheduler
 from app.services.llm_client import openai_client # Giả sử bạn đã export client từ đây
 from app.core.settings import settings
+from app.core.executors import run_inference, run_index
+from app.utils.cache import AsyncSingleFlightCache, normalize_query
+
+
+_RRF_K = 60
+
 
 class RAGPipeline:
-    def __init__(self, collection, embedder: LocalEmbedder, reranker: LocalReranker, all_docs_for_bm25: List[Dict] = None):
+    def __init__(self, collection, embedder: LocalEmbedder, reranker: LocalReranker, all_docs_for_bm25: List[Dict] = None,
+                 embedding_batcher: Optional[EmbeddingBatcher] = None,
+                 rerank_scheduler: Optional[RerankScheduler] = None):
         self.collection = collection
         self.embedder = embedder
         self.reranker = reranker
+        # Gom encode câu hỏi của nhiều request đồng thời (None -> encode riêng từng request)
+        self.embedding_batcher = embedding_batcher
+        # Chấm rerank chung batch với request khác (None -> mỗi request 1 lần compute_score)
+        self.rerank_scheduler = rerank_scheduler
+
+        # Cache Query Expansion (LLM) theo câu hỏi, có TTL + giới hạn kích thước
+        self.expansion_cache = AsyncSingleFlightCache(
+            maxsize=settings.expansion_cache_size, ttl=settings.expansion_cache_ttl
+        )
         
         # --- Setup BM25 (Keyword Search) ---
-        if all_docs_for_bm25:
-            self.bm25_corpus = [doc["text"] for doc in all_docs_for_bm25]
-            self.doc_map = all_docs_for_bm25
-            tokenized_corpus = [doc.lower().split(" ") for doc in self.bm25_corpus]
-            self.bm25 = BM25Okapi(tokenized_corpus)
-        else:
-            self.bm25 = None
+        # Index tăng dần: ingest chỉ cập nhật tài liệu mới, không build lại toàn bộ
+        self.bm25_index = IncrementalBM25(all_docs_for_bm25 or [])
+        if all_docs_for_bm25 is not None and not len(self.bm25_index):
             print("⚠️ Cảnh báo: Không có dữ liệu cho Keyword Search (BM25). Chỉ chạy Vector Search.")
 
     # --- 1. QUERY PROCESSING (Sinh câu hỏi phụ) ---
+    async def _expand_with_llm(self, question: str) -> List[str]:
+        # Nếu câu hỏi quá ngắn hoặc quá đơn giản, có thể bỏ qua bước này để tiết kiệm
+        system_prompt = "Bạn là trợ lý tìm kiếm. Hãy viết lại câu hỏi sau thành 3 phiên bản khác nhau để tìm kiếm tài liệu tốt hơn. Chỉ trả về các câu hỏi, mỗi câu 1 dòng."
+        response = await openai_client.chat.completions.create(
+            model=settings.llm_model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": question}
+            ],
+            temperature=0.5,
+            max_tokens=150
+        )
+        content = response.choices[0].message.content.strip()
+        return [line.strip("- ").strip() for line in content.split("\n") if line.strip()]
+
     async def _query_processing(self, question: str) -> List[str]:
-        """Dùng LLM để tạo ra các biến thể của câu hỏi (Query Expansion)"""
+        """
+        Dùng LLM để tạo ra các biến thể của câu hỏi (Query Expansion).
+        Kết quả được cache theo câu hỏi đã chuẩn hóa; request trùng đang chờ dùng chung 1 lần gọi LLM.
+        """
         try:
-            # Nếu câu hỏi quá ngắn hoặc quá đơn giản, có thể bỏ qua bước này để tiết kiệm
-            system_prompt = "Bạn là trợ lý tìm kiếm. Hãy viết lại câu hỏi sau thành 3 phiên bản khác nhau để tìm kiếm tài liệu tốt hơn. Chỉ trả về các câu hỏi, mỗi câu 1 dòng."
-            response = await openai_client.chat.completions.create(
-                model=settings.llm_model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": question}
-                ],
-                temperature=0.5,
-                max_tokens=150
+            sub_queries = await self.expansion_cache.get_or_compute(
+                normalize_query(question), lambda: self._expand_with_llm(question)
             )
-            content = response.choices[0].message.content.strip()
-            sub_queries = [line.strip("- ").strip() for line in content.split("\n") if line.strip()]
             return [question] + sub_queries # Luôn giữ câu gốc
         except Exception as e:
             print(f"Lỗi Query Processing: {e}")
             return [question]
 
     # --- 2. HYBRID SEARCH (Vector + Keyword) ---
-    def _hybrid_search_single_query(self, query: str, topk: int) -> List[Dict]:
-        """Chạy cả Vector và Keyword cho 1 câu hỏi"""
+    def _merge_hits(self, vector_hits: List[Dict], keyword_hits: List[tuple]) -> List[Dict]:
+        """Gộp kết quả Vector và Keyword của 1 câu hỏi"""
         hits_map = {}
 
+        # prescore: Reciprocal Rank Fusion theo thứ hạng -> điểm rẻ để lọc candidate trước rerank
         # A. Semantic Search (Vector)
-        qvec = self.embedder.encode([query])[0]
-        vector_hits = search(self.collection, qvec, topk=topk)
-        for h in vector_hits:
+        for rank, h in enumerate(vector_hits):
             if "metadata" not in h or h["metadata"] is None:
                 h["metadata"] = {}
             h["metadata"]["source_method"] = "vector"
+            h["prescore"] = 1.0 / (_RRF_K + rank + 1)
             hits_map[h["chunk_id"]] = h
 
         # B. Keyword Search (BM25)
-        if self.bm25:
-            tokenized_query = query.lower().split(" ")
-            scores = self.bm25.get_scores(tokenized_query)
-            top_n = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:topk]
-            for i in top_n:
-                if scores[i] > 0:
-                    doc = self.doc_map[i]
-                    if doc["chunk_id"] not in hits_map:
-                        hits_map[doc["chunk_id"]] = {
-                            "chunk_id": doc["chunk_id"],
-                            "text": doc["text"],
-                            "metadata": {"source_method": "keyword", **doc.get("metadata", {})}
-                        }
-                    else:
-                        # Nếu cả 2 đều tìm thấy -> Tăng độ ưu tiên (tạm thời chưa xử lý ở đây)
-                        hits_map[doc["chunk_id"]]["metadata"]["source_method"] = "hybrid"
+        for rank, (doc, _score) in enumerate(keyword_hits):
+            if doc["chunk_id"] not in hits_map:
+                hits_map[doc["chunk_id"]] = {
+                    "chunk_id": doc["chunk_id"],
+                    "document_id": doc["document_id"],
+                    "text": doc["text"],
+                    "metadata": {"source_method": "keyword", **doc["metadata"]},
+                    "prescore": 1.0 / (_RRF_K + rank + 1),
+                }
+            else:
+                # Cả 2 đều tìm thấy -> cộng điểm RRF
+                hits_map[doc["chunk_id"]]["metadata"]["source_method"] = "hybrid"
+                hits_map[doc["chunk_id"]]["prescore"] += 1.0 / (_RRF_K + rank + 1)
         
         return list(hits_map.values())
 
-    # --- MAIN FLOW: RUN PIPELINE ---
-    async def run(self, original_question: str, topk: int = 5, rerank_topn: int = 3):
-        # Bước 1: Query Processing
-        # Tạo ra nhiều câu hỏi để "vét" thông tin kỹ hơn
-        all_queries = await self._query_processing(original_question)
+    def _keyword_search_many(self, queries: List[str], topk: int) -> List[List[tuple]]:
+        return [self.bm25_index.search(q, topk) for q in queries]
+
+    async def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """Encode câu hỏi: qua micro-batcher nếu có, không thì chạy thẳng trên executor."""
+        if self.embedding_batcher is not None:
+            return await self.embedding_batcher.encode_queries(queries)
+        return await run_inference(self.embedder.encode_queries, queries)
+
+    async def _hybrid_search(self, queries: List[str], topk: int) -> List[List[Dict]]:
+        """
+        Chạy Vector + Keyword cho NHIỀU câu hỏi:
+        - 1 lần encode cho tất cả câu hỏi (gộp chung batch với request khác nếu bật micro-batching)
+        - 1 lần col.search với N vector (1 round trip Milvus), song song với BM25
+        Mọi bước nặng đều chạy trên executor, event loop vẫn rảnh để stream token.
+        Trả về list hit cho từng câu hỏi.
+        """
+        qvecs = await self.embed_queries(queries)
+        vector_hits, keyword_hits = await asyncio.gather(
+            run_index(search_many, self.collection, qvecs, topk=topk),
+            run_index(self._keyword_search_many, queries, topk),
+        )
+        return [
+            self._merge_hits(v_hits, k_hits)
+            for v_hits, k_hits in zip(vector_hits, keyword_hits)
+        ]
+
+    # --- 3. RETRIEVAL (Expansion + Hybrid Search) ---
+    async def retrieve(self, original_question: str, topk: int = 5) -> tuple:
+        """
+        Trả về (all_queries, raw_candidates) - chưa rerank.
+        Câu hỏi gốc được tìm kiếm NGAY (speculative) trong lúc chờ LLM sinh câu hỏi phụ,
+        sau đó chỉ các câu hỏi phụ mới phải search thêm.
+        """
+        expansion_task = asyncio.create_task(self._query_processing(original_question))
+        try:
+            original_hits = await self._hybrid_search([original_question], topk=topk)
+            all_queries = await expansion_task
+        except BaseException:
+            expansion_task.cancel()
+            raise
         print(f"🔍 Queries: {all_queries}")
 
-        # Bước 2: Multi-Query Hybrid Search
-        # Tìm kiếm với TẤT CẢ các câu hỏi (Parallel hoặc Loop)
+        sub_queries = [q for q in all_queries if q != original_question]
+        sub_hits = await self._hybrid_search(sub_queries, topk=topk) if sub_queries else []
+
+        # Gộp kết quả của tất cả câu hỏi, khử trùng lặp theo chunk_id (prescore cộng dồn qua các câu hỏi)
         raw_candidates = []
-        seen_ids = set()
-        
-        for q in all_queries:
-            # Với mỗi câu hỏi phụ, tìm kiếm bằng cả Vector và Keyword
-            hits = self._hybrid_search_single_query(q, topk=topk)
+        seen = {}
+        for hits in original_hits + sub_hits:
             for h in hits:
-                if h["chunk_id"] not in seen_ids:
+                if h["chunk_id"] not in seen:
                     raw_candidates.append(h)
-                    seen_ids.add(h["chunk_id"])
+                    seen[h["chunk_id"]] = h
+                else:
+                    seen[h["chunk_id"]]["prescore"] += h["prescore"]
+        return all_queries, raw_candidates
 
-        if not raw_candidates:
+    # --- 4. RERANK ---
+    async def rerank(self, original_question: str, candidates: List[Dict], rerank_topn: int = 3) -> List[Dict]:
+        if not candidates:
             return []
 
-        # Bước 3: Reranking (Chốt hạ)
+        # Chế độ budget: chỉ giữ rerank_max_candidates chunk có prescore (RRF) cao nhất
+        # và cắt passage theo token budget (xem LocalReranker.truncate)
+        budget_mode = settings.rerank_mode == "budget"
+        if budget_mode and len(candidates) > settings.rerank_max_candidates:
+            candidates = sorted(candidates, key=lambda h: h.get("prescore", 0.0), reverse=True)
+            candidates = candidates[:settings.rerank_max_candidates]
+
         # Dùng câu hỏi GỐC để chấm điểm lại toàn bộ kết quả tìm được
-        print(f"📊 Reranking {len(raw_candidates)} documents...")
-        passages = [h["text"] for h in raw_candidates]
-        rr_scores = self.reranker.rerank(original_question, passages)
+        print(f"📊 Reranking {len(candidates)} documents...")
+        passages = [h["text"] for h in candidates]
+        if budget_mode:
+            passages = await run_inference(self.reranker.truncate, passages)
+        if self.rerank_scheduler is not None:
+            rr_scores = await self.rerank_scheduler.rerank(original_question, passages)
+        else:
+            rr_scores = await run_inference(self.reranker.rerank, original_question, passages)
 
-        for h, s in zip(raw_candidates, rr_scores):
+        for h, s in zip(candidates, rr_scores):
             h["rerank_score"] = float(s)
 
-        final_hits = sorted(raw_candidates, key=lambda x: x["rerank_score"], reverse=True)
+        final_hits = sorted(candidates, key=lambda x: x["rerank_score"], reverse=True)
         return final_hits[:rerank_topn]
+
+    # --- MAIN FLOW: RUN PIPELINE ---
+    async def run(self, original_question: str, topk: int = 5, rerank_topn: int = 3):
+        # Bước 1 + 2: Query Processing & Multi-Query Hybrid Search (chạy chồng lên nhau)
+        _, raw_candidates = await self.retrieve(original_question, topk=topk)
+
+        # Bước 3: Reranking (Chốt hạ)
+        return await self.rerank(original_question, raw_candidates, rerank_topn=rerank_topn)
     
     def reload_bm25(self, all_docs: list[dict]):
         """
         Hàm này giúp BM25 học lại từ đầu dựa trên danh sách docs mới nhất.
+        (Chỉ nên dùng lúc khởi động; ingest dùng update_bm25_document.)
         """
         if not all_docs:
             print("⚠️ Dữ liệu rỗng, tắt BM25.")
-            self.bm25 = None
-            self.doc_map = []
-            return
+        else:
+            print(f"🔄 Đang cập nhật BM25 với {len(all_docs)} tài liệu mới...")
+        self.bm25_index.rebuild(all_docs or [])
+        print("✅ BM25 cập nhật thành công!")
 
-        print(f"🔄 Đang cập nhật BM25 với {len(all_docs)} tài liệu mới...")
-        self.bm25_corpus = [doc["text"] for doc in all_docs]
-        self.doc_map = all_docs # Lưu lại để map ID sau này
-        
-        # Tokenize và tạo Index mới
-        tokenized_corpus = [doc.lower().split(" ") for doc in self.bm25_corpus]
-        self.bm25 = BM25Okapi(tokenized_corpus)
-        print("✅ BM25 cập nhật thành công!")
\ No newline at end of file
+    def load_bm25_batches(self, batches: Iterable[List[Dict]]):
+        """Build BM25 từ luồng batch (khởi động với collection lớn, bộ nhớ đỉnh có giới hạn)."""
+        n = self.bm25_index.rebuild_from_batches(batches)
+        if n:
+            print(f"✅ BM25 đã index {n:,} chunks.")
+        else:
+            print("⚠️ Cảnh báo: Không có dữ liệu cho Keyword Search (BM25). Chỉ chạy Vector Search.")
+
+    def update_bm25_document(self, document_id: str, docs: list[dict]):
+        """Cập nhật tăng dần: thay chunk của 1 tài liệu (thêm mới hoặc re-ingest)."""
+        self.bm25_index.replace_document(document_id, docs)
+        print(f"✅ BM25: cập nhật {len(docs)} chunks của '{document_id}' (tổng {len(self.bm25_index)}).")
+
+    def update_bm25_documents(self, docs_by_id: Dict[str, List[Dict]]):
+        """Cập nhật nhiều tài liệu trong 1 lần ghi (bulk ingest)."""
+        self.bm25_index.replace_documents(docs_by_id)
+        n = sum(len(d) for d in docs_by_id.values())
+        print(f"✅ BM25: cập nhật {n} chunks của {len(docs_by_id)} tài liệu (tổng {len(self.bm25_index)}).")
+
+    def commit_bm25(self, batch: BM25Accumulator):
+        """Cập nhật BM25 từ chunk đã tokenize sẵn trong lúc ingest (1 snapshot cho cả lần ingest)."""
+        self.bm25_index.commit(batch)
+        print(f"✅ BM25: cập nhật {len(batch)} chunks của {len(batch.document_ids())} tài liệu (tổng {len(self.bm25_index)}).")
+
+    def remove_bm25_document(self, document_id: str):
+        self.bm25_index.remove_document(document_id)
@@ -1,12 +1,110 @@
+import hashlib
+from typing import Optional
 from FlagEmbedding import FlagReranker
+from app.utils.cache import TTLCache, normalize_query
+
+def _digest(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
 
 class LocalReranker:
-    def __init__(self, model_name: str):
+    def __init__(
+        self,
+        model_name: str,
+        score_cache_size: int = 50000,
+        max_passage_tokens: Optional[int] = None,
+        bucket_size: Optional[int] = None,
+        max_length: int = 512,
+    ):
+        """
+        max_passage_tokens: cắt passage còn tối đa N token trước khi chấm (None = không cắt).
+        bucket_size: chia cặp đã sắp theo độ dài thành các batch N cặp, mỗi batch chỉ pad
+        tới cặp dài nhất của nó (None = 1 lần compute_score cho tất cả).
+        """
+        self.model_name = model_name
         self.reranker = FlagReranker(model_name, use_fp16=True)
+        self.max_passage_tokens = max_passage_tokens
+        self.bucket_size = bucket_size
+        self.max_length = max_length
 
-    def rerank(self, query: str, passages: list[str]) -> list[float]:
-        pairs = [[query, p] for p in passages]
-        scores = self.reranker.compute_score(pairs)
+        # Cache điểm cross-encoder: key = (hash câu hỏi đã chuẩn hóa, hash nội dung chunk).
+        # Key theo nội dung nên re-ingest không làm điểm cũ sai (chunk đổi text -> key khác),
+        # không cần xóa theo tài liệu; entry không dùng nữa tự hết hạn / bị đẩy ra (LRU).
+        self.score_cache = TTLCache(maxsize=score_cache_size)
+
+    def _compute_score(self, pairs: list[list[str]], **kwargs) -> list[float]:
+        scores = self.reranker.compute_score(pairs, **kwargs)
         if isinstance(scores, float):
             return [float(scores)]
         return [float(x) for x in scores]
+
+    def compute(self, pairs: list[list[str]]) -> list[float]:
+        """Gọi model trực tiếp (không cache)."""
+        if not pairs:
+            return []
+        if not self.bucket_size:
+            return self._compute_score(pairs)
+
+        # Sắp theo số token rồi chia bucket: cặp 128 token không phải pad lên 512 cùng parent chunk
+        encoded = self.reranker.tokenizer(
+            [q for q, _ in pairs], [p for _, p in pairs],
+            truncation=True, max_length=self.max_length,
+        )
+        lengths = [len(ids) for ids in encoded["input_ids"]]
+        order = sorted(range(len(pairs)), key=lengths.__getitem__)
+
+        scores: list[float] = [0.0] * len(pairs)
+        for start in range(0, len(order), self.bucket_size):
+            bucket = order[start:start + self.bucket_size]
+            bucket_scores = self._compute_score(
+                [pairs[i] for i in bucket],
+                batch_size=len(bucket),
+                max_length=min(self.max_length, max(lengths[i] for i in bucket)),
+            )
+            for i, sc in zip(bucket, bucket_scores):
+                scores[i] = sc
+        return scores
+
+    def truncate(self, passages: list[str]) -> list[str]:
+        """Cắt mỗi passage còn tối đa max_passage_tokens token (cắt theo offset, giữ nguyên text gốc)."""
+        budget = self.max_passage_tokens
+        if not budget or not passages:
+            return passages
+        encoded = self.reranker.tokenizer(
+            passages, add_special_tokens=False, truncation=True, max_length=budget,
+            return_offsets_mapping=True,
+        )
+        out = []
+        for text, ids, offsets in zip(passages, encoded["input_ids"], encoded["offset_mapping"]):
+            out.append(text[:offsets[-1][1]] if len(ids) >= budget and offsets else text)
+        return out
+
+    def lookup(self, query: str, passages: list[str]) -> tuple[list, list]:
+        """Trả về (keys, cached): cached[i] là điểm đã cache hoặc None nếu chưa có."""
+        q_hash = _digest(normalize_query(query))
+        keys = [(q_hash, _digest(p)) for p in passages]
+        cached = []
+        for k in keys:
+            cached.append(self.score_cache.get(k))
+        return keys, cached
+
+    def store(self, key: tuple, score: float):
+        self.score_cache.set(key, score)
+
+    def rerank(self, query: str, passages: list[str]) -> list[float]:
+        """Chấm điểm (query, passage). Chỉ cặp chưa có trong cache mới được đưa vào model."""
+        keys, cached = self.lookup(query, passages)
+
+        missing: dict = {}
+        for i, (k, c) in enumerate(zip(keys, cached)):
+            if c is None and k not in missing:
+                missing[k] = i
+
+        fresh: dict = {}
+        if missing:
+            scores = self.compute([[query, passages[i]] for i in missing.values()])
+            for (k, i), s in zip(missing.items(), scores):
+                self.store(k, s)
+                fresh[k] = s
+
+        return [c if c is not None else fresh[k] for k, c in zip(keys, cached)]
+
@@ -0,0 +1,180 @@
+# app/services/rerank_scheduler.py
+"""
+Scheduler dùng chung cho reranker (cross-encoder) giữa các request đồng thời:
+- Mỗi request gửi các cặp (query, passage) chưa có trong cache thành 1 job.
+- Worker gom cặp từ nhiều job thành batch (tối đa max_batch cặp), sắp theo độ dài
+  để giảm padding, chạy 1 lần compute_score rồi trả điểm về đúng job.
+- Công bằng: mỗi vòng lấy tối đa `quantum` cặp từ mỗi job (round-robin), job đã chờ quá
+  max_queue_delay được ưu tiên -> 1 request có hàng trăm candidate không bỏ đói request khác.
+"""
+import asyncio
+import time
+from collections import deque
+from typing import List, Optional
+
+from app.core.executors import run_inference
+from app.services.rerank import LocalReranker
+from app.utils.metrics import Histogram
+
+
+class _Job:
+    __slots__ = ("pairs", "keys", "scores", "next", "remaining", "future", "enqueued_at", "overdue")
+
+    def __init__(self, pairs: List[list], keys: list, future: asyncio.Future):
+        self.pairs = pairs
+        self.keys = keys
+        self.scores: List[Optional[float]] = [None] * len(pairs)
+        self.next = 0              # cặp tiếp theo chưa được đưa vào batch
+        self.remaining = len(pairs)
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+        self.overdue = False
+
+
+class RerankScheduler:
+    def __init__(
+        self,
+        reranker: LocalReranker,
+        max_batch: int = 64,
+        max_wait_ms: float = 5.0,
+        quantum: int = 16,
+        max_queue_delay_ms: float = 200.0,
+    ):
+        self.reranker = reranker
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.quantum = max(1, quantum)
+        self.max_queue_delay = max_queue_delay_ms / 1000
+        self._jobs: deque = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+
+        self.batch_sizes = Histogram([1, 4, 8, 16, 32, 64, 128, 256])
+        self.jobs_per_batch = Histogram([1, 2, 3, 4, 6, 8, 16])
+        self.queue_wait_ms = Histogram([1, 5, 10, 20, 50, 100, 200, 500, 1000])
+        self.overdue_jobs = 0
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+
+    async def rerank(self, query: str, passages: List[str]) -> List[float]:
+        """Giống LocalReranker.rerank nhưng cặp chưa cache được chấm chung batch với request khác."""
+        keys, cached = self.reranker.lookup(query, passages)
+
+        # Gộp passage trùng trong cùng request
+        missing: dict = {}
+        for i, (k, c) in enumerate(zip(keys, cached)):
+            if c is None and k not in missing:
+                missing[k] = i
+        if not missing:
+            return cached
+
+        self._ensure_worker()
+        job = _Job(
+            pairs=[[query, passages[i]] for i in missing.values()],
+            keys=list(missing.keys()),
+            future=asyncio.get_running_loop().create_future(),
+        )
+        self._jobs.append(job)
+        self._wakeup.set()
+        await job.future
+
+        fresh = dict(zip(job.keys, job.scores))
+        return [c if c is not None else fresh[k] for k, c in zip(keys, cached)]
+
+    async def _wait_for_batch(self):
+        """Chờ có job; nếu chưa đủ 1 batch thì chờ thêm tối đa max_wait để gom request khác."""
+        while not self._jobs:
+            self._wakeup.clear()
+            await self._wakeup.wait()
+
+        deadline = time.perf_counter() + self.max_wait
+        while sum(len(j.pairs) - j.next for j in self._jobs) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                break
+
+    def _take_batch(self) -> List[tuple]:
+        """Round-robin lấy tối đa quantum cặp / job; job chờ quá max_queue_delay được xếp lên đầu."""
+        # Bỏ job đã bị hủy (client ngắt kết nối)
+        for j in [j for j in self._jobs if j.future.done()]:
+            self._jobs.remove(j)
+
+        now = time.perf_counter()
+        overdue = [j for j in self._jobs if now - j.enqueued_at > self.max_queue_delay]
+        for j in overdue:
+            if not j.overdue:
+                j.overdue = True
+                self.overdue_jobs += 1
+        order = overdue + [j for j in self._jobs if j not in overdue]
+
+        batch: List[tuple] = []
+        while len(batch) < self.max_batch:
+            progressed = False
+            for job in order:
+                take = min(self.quantum, len(job.pairs) - job.next, self.max_batch - len(batch))
+                if take <= 0:
+                    continue
+                if job.next == 0:
+                    self.queue_wait_ms.observe((now - job.enqueued_at) * 1000)
+                batch.extend((job, i) for i in range(job.next, job.next + take))
+                job.next += take
+                progressed = True
+                if len(batch) >= self.max_batch:
+                    break
+            if not progressed:
+                break
+
+        # Job đã lấy hết cặp thì ra khỏi hàng đợi (vẫn chờ điểm của batch này)
+        for j in [j for j in self._jobs if j.next >= len(j.pairs)]:
+            self._jobs.remove(j)
+        return batch
+
+    async def _run(self):
+        while True:
+            await self._wait_for_batch()
+            batch = self._take_batch()
+            if not batch:
+                continue
+
+            # Sắp theo độ dài để các cặp dài/ngắn nằm chung batch con của FlagReranker
+            batch.sort(key=lambda item: len(item[0].pairs[item[1]][0]) + len(item[0].pairs[item[1]][1]))
+            self.batch_sizes.observe(len(batch))
+            self.jobs_per_batch.observe(len({id(job) for job, _ in batch}))
+
+            try:
+                scores = await run_inference(self.reranker.compute, [job.pairs[i] for job, i in batch])
+            except Exception as e:
+                for job in {id(job): job for job, _ in batch}.values():
+                    if job in self._jobs:
+                        self._jobs.remove(job)
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                continue
+
+            for (job, i), score in zip(batch, scores):
+                job.scores[i] = score
+                job.remaining -= 1
+                self.reranker.store(job.keys[i], score)
+                if job.remaining == 0 and not job.future.done():
+                    job.future.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "quantum": self.quantum,
+            "max_queue_delay_ms": self.max_queue_delay * 1000,
+            "queued_jobs": len(self._jobs),
+            "overdue_jobs": self.overdue_jobs,
+            "batch_size": self.batch_sizes.snapshot(),
+            "jobs_per_batch": self.jobs_per_batch.snapshot(),
+            "queue_wait_ms": self.queue_wait_ms.snapshot(),
+        }
@@ -0,0 +1,77 @@
+# app/services/response_cache.py
+"""
+Cache toàn bộ câu trả lời của /ask (dành cho traffic dạng FAQ).
+- Key: câu hỏi đã chuẩn hóa + vài tin nhắn gần nhất của lịch sử (ngữ cảnh hội thoại).
+- Value: các event NDJSON đã stream (meta_info, context, answer) để phát lại.
+- Mỗi entry gắn corpus_version; ingest tăng version -> mọi entry cũ tự mất hiệu lực.
+"""
+import hashlib
+import json
+import threading
+from typing import Dict, List, Optional
+
+from app.core.settings import settings
+from app.utils.cache import TTLCache, normalize_query
+
+
+class ResponseCache:
+    def __init__(self, maxsize: int, ttl: float, history_turns: int = 2):
+        self.history_turns = history_turns
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.corpus_version = 0
+        self.stale = 0
+        self.saved_seconds = 0.0
+
+    def bump_corpus_version(self) -> int:
+        """Gọi sau mỗi lần ingest: câu trả lời cũ có thể không còn đúng với corpus mới."""
+        with self._lock:
+            self.corpus_version += 1
+            return self.corpus_version
+
+    def make_key(self, question: str, history: List[Dict]) -> str:
+        recent = history[-self.history_turns:] if self.history_turns > 0 else []
+        payload = json.dumps(
+            [normalize_query(question), [[m.get("role"), normalize_query(m.get("content", ""))] for m in recent]],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        if entry["corpus_version"] != self.corpus_version:
+            # Corpus đã đổi sau khi cache -> bỏ
+            self._cache.pop(key)
+            self.stale += 1
+            return None
+        return entry
+
+    def put(self, key: str, events: List[Dict], latency: float, corpus_version: int):
+        """corpus_version: version lúc BẮT ĐẦU xử lý request (ingest xen giữa -> entry tự lỗi thời)."""
+        self._cache.set(key, {
+            "events": events,
+            "latency": latency,
+            "corpus_version": corpus_version,
+        })
+
+    def record_replay(self, entry: Dict, replay_seconds: float):
+        with self._lock:
+            self.saved_seconds += max(entry["latency"] - replay_seconds, 0.0)
+
+    def stats(self) -> dict:
+        return {
+            **self._cache.stats(),
+            "enabled": settings.response_cache_enabled,
+            "corpus_version": self.corpus_version,
+            "stale": self.stale,
+            "saved_seconds": round(self.saved_seconds, 3),
+        }
+
+
+response_cache = ResponseCache(
+    maxsize=settings.response_cache_size,
+    ttl=settings.response_cache_ttl,
+    history_turns=settings.response_cache_history_turns,
+)
@@ -1,9 +1,10 @@
 import time
 from typing import List, Dict
-from rank_bm25 import BM25Okapi
+from app.services.bm25_sparse import SparseBM25
 from app.services.embedding import LocalEmbedder
 from app.services.milvus_store import search
 from app.services.rerank import LocalReranker
+from app.core.executors import run_inference, run_index
 
 # --- 1. SIMILARITY SEARCH (Vector Search Thuần) ---
 class VectorRetriever:
@@ -13,7 +14,7 @@ class VectorRetriever:
 
     def search(self, query: str, topk: int = 10) -> List[Dict]:
         """Chỉ tìm kiếm dựa trên vector (Nhanh nhất)"""
-        qvec = self.embedder.encode([query])[0]
+        qvec = self.embedder.encode_queries([query])[0]
         hits = search(self.collection, qvec, topk=topk)
         return hits
 
@@ -25,22 +26,23 @@ class KeywordRetriever:
         Nếu dữ liệu lớn, cần dùng ElasticSearch hoặc Milvus Sparse Vector.
         """
         tokenized_corpus = [doc.split(" ") for doc in all_documents]
-        self.bm25 = BM25Okapi(tokenized_corpus)
+        # Ma trận thưa trọng số BM25 tính sẵn -> chấm điểm bằng 1 phép nhân ma trận
+        self.bm25 = SparseBM25.from_corpus(tokenized_corpus)
         self.documents = all_documents
 
     def search(self, query: str, topk: int = 10) -> List[Dict]:
         tokenized_query = query.split(" ")
-        # Lấy top k văn bản khớp từ khóa nhất
-        scores = self.bm25.get_scores(tokenized_query)
-        top_n_indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:topk]
+        # Lấy top k văn bản khớp từ khóa nhất (argpartition, không sort toàn bộ).
+        # Giữ cả doc điểm 0 như bản rank_bm25 cũ: luôn trả đủ topk kết quả cho RRF
+        top_n_indices, scores = self.bm25.get_top_k(tokenized_query, topk, positive_only=False)
         
         results = []
-        for i in top_n_indices:
+        for i, score in zip(top_n_indices, scores):
             # Lưu ý: Ở đây ta giả lập cấu trúc trả về giống Milvus để dễ gộp
             results.append({
                 "chunk_id": f"bm25_{i}", # Cần mapping ID thực tế nếu có
                 "text": self.documents[i],
-                "score": scores[i],
+                "score": float(score),
                 "metadata": {"source": "keyword_search"}
             })
         return results
@@ -67,7 +69,7 @@ class HybridRetriever:
 
     async def search(self, query: str, topk: int = 10, rerank_topn: int = 5):
         # 1. Vector Search (Semantic)
-        vector_hits = self.vector_retriever.search(query, topk=topk * 2)
+        vector_hits = await run_index(self.vector_retriever.search, query, topk=topk * 2)
         
         # 2. Keyword Search (Optional - Ở đây ta giả lập hoặc bỏ qua nếu chưa có full text)
         # Nếu muốn làm chuẩn, bạn cần fetch toàn bộ text từ Milvus ra để build BM25 (tốn RAM),
@@ -94,7 +96,7 @@ class HybridRetriever:
 
         # Chấm điểm lại bằng Cross-Encoder (Đây là bước quan trọng nhất của Hybrid)
         passages = [h["text"] for h in unique_candidates]
-        rr_scores = self.reranker.rerank(query, passages)
+        rr_scores = await run_inference(self.reranker.rerank, query, passages)
         
         for h, s in zip(unique_candidates, rr_scores):
             h["rerank_score"] = float(s)
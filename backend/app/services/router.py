@@ -1,6 +1,13 @@
 # app/services/router.py
+import asyncio
+import re
+import threading
+import time
+from typing import Awaitable, Callable, List, Optional
+import numpy as np
 from openai import AsyncOpenAI
 from app.core.settings import settings
+from app.utils.cache import normalize_query
 import logging
 
 # Dùng chung client hoặc tạo mới tùy bạn
@@ -11,7 +18,135 @@ router_client = AsyncOpenAI(
 
 logger = logging.getLogger(__name__)
 
-async def route_query(question: str) -> str:
+# ============================================================
+# TẦNG 1: LUẬT (regex) - xử lý trong vài micro-giây
+# ============================================================
+_PUNCT = re.compile(r"[^\w\s+]", flags=re.UNICODE)
+_SMALL_TALK = re.compile(
+    r"^(xin chào|chào|chào bạn|chào buổi (sáng|trưa|chiều|tối)|hello|hi|hey|alo|"
+    r"cảm ơn|cám ơn|thank you|thanks|tạm biệt|bye|goodbye|ok|oke|okay)"
+    r"( (bạn|nhé|nha|ạ|nhiều|you|there|bot|ad|admin|so much))*$"
+)
+# Chỉ code fence: từ như "file", "hàm", "chương trình", "viết" đều nhập nhằng
+# ("Viết code đọc file CSV" vs "chương trình nghị sự") -> để tầng embedding / LLM quyết định
+_CODE_FENCE = re.compile(r"```")
+
+def _rule_route(question: str) -> Optional[str]:
+    """Chỉ trả lời các trường hợp chắc chắn, còn lại trả None để tầng sau xử lý."""
+    q = normalize_query(question)
+    bare = _PUNCT.sub(" ", q).split()
+    bare_text = " ".join(bare)
+    if not bare_text:
+        return "GENERAL"
+    if _SMALL_TALK.match(bare_text):
+        return "GENERAL"
+    if _CODE_FENCE.search(q):
+        return "GENERAL"
+    return None
+
+# ============================================================
+# TẦNG 2: EMBEDDING (dùng lại bge-m3 đã load) + tập câu mẫu có nhãn
+# ============================================================
+_PROTOTYPES = {
+    "GENERAL": [
+        "Xin chào", "Chào bạn, bạn khỏe không?", "Hello", "Cảm ơn bạn nhiều", "Tạm biệt nhé",
+        "Bạn là ai?", "Viết code Python đọc file CSV", "Viết hàm Java sắp xếp mảng",
+        "Sửa lỗi đoạn code này giúp tôi", "Làm một bài thơ tình", "Kể chuyện cười đi",
+        "1 + 1 bằng mấy?", "Dịch câu này sang tiếng Anh",
+    ],
+    "RAG": [
+        "Tóm tắt tài liệu giúp tôi", "Nicolas Maduro là ai?", "Chiến tranh ở Thái Lan?",
+        "Nội dung chính của file là gì?", "Ông ấy có vợ không?", "Sự kiện này xảy ra khi nào?",
+        "Nguyên nhân của cuộc chiến là gì?", "Luật quy định thế nào về vấn đề này?",
+        "Công ty X được thành lập năm nào?", "Tại sao xung đột lại leo thang?",
+        "Sửa đổi luật đất đai năm 2024 có gì mới?", "Chương trình nghị sự của kỳ họp gồm những gì?",
+    ],
+}
+
+class _PrototypeClassifier:
+    def __init__(self):
+        self._labels: list[str] = []
+        self._matrix: Optional[np.ndarray] = None
+        self._lock = asyncio.Lock()
+
+    async def _ensure(self, embed_queries):
+        if self._matrix is not None:
+            return
+        async with self._lock:
+            if self._matrix is not None:
+                return
+            texts, labels = [], []
+            for label, examples in _PROTOTYPES.items():
+                texts.extend(examples)
+                labels.extend([label] * len(examples))
+            vecs = await embed_queries(texts)
+            self._labels = labels
+            self._matrix = np.asarray(vecs, dtype=np.float32)
+
+    async def classify(self, embed_queries, question: str) -> Optional[str]:
+        """Cosine similarity tới câu mẫu gần nhất của mỗi nhãn; chỉ kết luận khi đủ tự tin."""
+        await self._ensure(embed_queries)
+        qvec = np.asarray((await embed_queries([question]))[0], dtype=np.float32)
+        sims = self._matrix @ qvec  # vector đã normalize L2 -> IP = cosine
+        best = {}
+        for label, sim in zip(self._labels, sims):
+            best[label] = max(best.get(label, -1.0), float(sim))
+        ranked = sorted(best.items(), key=lambda kv: kv[1], reverse=True)
+        (top_label, top_sim), (_, second_sim) = ranked[0], ranked[1]
+        if top_sim >= settings.router_embed_threshold and top_sim - second_sim >= settings.router_embed_margin:
+            return top_label
+        return None
+
+_classifier = _PrototypeClassifier()
+
+# Thống kê theo tầng: số request + tổng thời gian
+_stats_lock = threading.Lock()
+_tier_stats = {tier: {"count": 0, "total_ms": 0.0} for tier in ("rules", "embedding", "llm")}
+
+def _record(tier: str, started: float):
+    with _stats_lock:
+        _tier_stats[tier]["count"] += 1
+        _tier_stats[tier]["total_ms"] += (time.perf_counter() - started) * 1000
+
+def router_stats() -> dict:
+    with _stats_lock:
+        return {
+            tier: {**v, "avg_ms": round(v["total_ms"] / v["count"], 3) if v["count"] else 0.0}
+            for tier, v in _tier_stats.items()
+        }
+
+async def route_query(question: str, embed_queries: Optional[Callable[[List[str]], Awaitable[list]]] = None) -> str:
+    """
+    Phân loại câu hỏi theo 3 tầng, tầng sau chỉ chạy khi tầng trước không chắc chắn:
+    1. Luật (regex): chỉ các trường hợp không nhập nhằng (chào hỏi / cảm ơn / code fence).
+    2. Embedding: so với tập câu mẫu có nhãn (cần truyền hàm async embed_queries).
+    3. LLM (SambaNova) cho các câu mơ hồ.
+    """
+    if settings.router_local_enabled:
+        started = time.perf_counter()
+        decision = _rule_route(question)
+        if decision:
+            _record("rules", started)
+            return decision
+
+        if embed_queries is not None:
+            started = time.perf_counter()
+            try:
+                decision = await _classifier.classify(embed_queries, question)
+            except Exception as e:
+                logger.error(f"Router embedding tier error: {e}")
+                decision = None
+            _record("embedding", started)
+            if decision:
+                return decision
+
+    started = time.perf_counter()
+    try:
+        return await _route_with_llm(question)
+    finally:
+        _record("llm", started)
+
+async def _route_with_llm(question: str) -> str:
     """
     Phân loại câu hỏi:
     - Trả về 'RAG': Nếu cần tra cứu tài liệu, thông tin cụ thể, hoặc ngữ cảnh đã có hoặc đã upload trước đó.
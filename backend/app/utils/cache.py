@@ -0,0 +1,164 @@
+import asyncio
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+_WS = re.compile(r"\s+")
+
+def normalize_query(text: str) -> str:
+    """Chuẩn hóa câu hỏi để làm cache key: NFC, bỏ khoảng trắng thừa, không phân biệt hoa thường."""
+    text = unicodedata.normalize("NFC", text or "")
+    return _WS.sub(" ", text).strip().casefold()
+
+
+class TTLCache:
+    """
+    Cache LRU có giới hạn số phần tử + thời gian sống (TTL), an toàn đa luồng.
+    ttl=None hoặc <= 0: không hết hạn.
+    Đếm hits / misses / evictions (bị đẩy ra vì đầy) / expirations (hết hạn).
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl if ttl and ttl > 0 else None
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.peek(key) is not None
+
+    def _expired(self, stored_at: float, now: float) -> bool:
+        return self.ttl is not None and now - stored_at > self.ttl
+
+    def peek(self, key: Hashable) -> Any:
+        """Đọc không tính vào thống kê và không đổi thứ tự LRU."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or self._expired(item[0], time.monotonic()):
+                return None
+            return item[1]
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            if self._expired(item[0], time.monotonic()):
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: Hashable, value: Any):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.pop(key, None)
+            return default if item is None else item[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class _Flight:
+    """1 lần gọi đang bay + số request đang chờ nó."""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncSingleFlightCache:
+    """
+    TTLCache cho kết quả của coroutine + gộp request trùng đang bay (single-flight):
+    nhiều request cùng key chỉ tạo 1 lần gọi; các request sau await chung kết quả.
+    Lần gọi chạy trong Task riêng nên 1 request bị hủy không làm hỏng các request khác;
+    request cuối cùng đang chờ bị hủy thì lần gọi cũng bị hủy (không tốn LLM call vô ích).
+    Lỗi không được cache.
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._inflight: "dict[Hashable, _Flight]" = {}
+        self.shared = 0     # số request được dùng chung lần gọi đang bay
+        self.cancelled = 0  # số lần gọi bị hủy vì không còn ai chờ
+
+    async def get_or_compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        value = self.cache.get(key)
+        if value is not None:
+            return value
+
+        flight = self._inflight.get(key)
+        if flight is not None:
+            self.shared += 1
+        else:
+            flight = _Flight(asyncio.ensure_future(compute()))
+            self._inflight[key] = flight
+
+            def _done(t: asyncio.Task, key=key, flight=flight):
+                # Chỉ gỡ đúng lần gọi này (key có thể đã có lần gọi mới sau khi lần này bị hủy)
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+                if not t.cancelled() and t.exception() is None:
+                    self.cache.set(key, t.result())
+
+            flight.task.add_done_callback(_done)
+
+        flight.waiters += 1
+        try:
+            # shield: 1 request bị hủy không hủy lần gọi mà request khác còn đang chờ
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Không còn ai chờ (vd: /ask hủy retrieval suy đoán vì câu hỏi GENERAL)
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+                flight.task.cancel()
+                self.cancelled += 1
+
+    def stats(self) -> dict:
+        return {
+            **self.cache.stats(),
+            "inflight": len(self._inflight),
+            "shared_inflight": self.shared,
+            "cancelled_inflight": self.cancelled,
+        }
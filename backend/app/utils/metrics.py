@@ -0,0 +1,32 @@
+import bisect
+import threading
+from typing import Sequence
+
+
+class Histogram:
+    """
+    Histogram đơn giản theo bucket cận trên (giống Prometheus, không cộng dồn).
+    bucket cuối cùng là +inf.
+    """
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0.0
+        self.n = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.bounds, value)] += 1
+            self.total += value
+            self.n += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            labels = [f"<={b:g}" for b in self.bounds] + ["+inf"]
+            return {
+                "count": self.n,
+                "mean": round(self.total / self.n, 3) if self.n else 0.0,
+                "buckets": dict(zip(labels, self.counts)),
+            }
@@ -0,0 +1,120 @@
+# benchmarks/bench_bm25.py
+"""
+So sánh rank_bm25 (get_scores + sorted) với SparseBM25 (ma trận thưa + argpartition).
+
+Chạy từ thư mục backend:
+    python -m benchmarks.bench_bm25 --sizes 10000 100000 1000000
+
+Corpus tổng hợp theo phân phối Zipf (giống văn bản thật: vài từ rất phổ biến,
+đuôi dài từ hiếm). rank_bm25 ở 1M chunks build rất lâu -> dùng --max-rank-bm25 để bỏ qua.
+
+Dòng "incr" đo IncrementalBM25: "build" = thời gian trung bình 1 lần ingest tài liệu
+--doc-chunks chunk vào index đã có n chunks (không được tăng theo n), "query" đo sau các lần ingest đó.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.services.bm25_index import IncrementalBM25
+from app.services.bm25_sparse import SparseBM25
+
+
+def make_corpus(n_docs: int, vocab_size: int, avg_len: int, seed: int = 0) -> list[list[str]]:
+    rng = np.random.default_rng(seed)
+    lengths = rng.poisson(avg_len, size=n_docs).clip(min=5)
+    ids = rng.zipf(1.3, size=int(lengths.sum())) % vocab_size
+    words = np.array([f"w{i}" for i in range(vocab_size)], dtype=object)
+    tokens = words[ids]
+    out, pos = [], 0
+    for ln in lengths:
+        out.append(list(tokens[pos:pos + ln]))
+        pos += ln
+    return out
+
+
+def make_queries(n: int, vocab_size: int, seed: int = 1) -> list[list[str]]:
+    rng = np.random.default_rng(seed)
+    return [[f"w{i}" for i in rng.zipf(1.3, size=rng.integers(3, 9)) % vocab_size] for _ in range(n)]
+
+
+def bench_rank_bm25(corpus, queries, topk):
+    from rank_bm25 import BM25Okapi
+
+    t0 = time.perf_counter()
+    bm25 = BM25Okapi(corpus)
+    build = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for q in queries:
+        scores = bm25.get_scores(q)
+        sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:topk]
+    per_query = (time.perf_counter() - t0) / len(queries)
+    return build, per_query
+
+
+def bench_sparse(corpus, queries, topk):
+    t0 = time.perf_counter()
+    bm25 = SparseBM25.from_corpus(corpus)
+    build = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for q in queries:
+        bm25.get_top_k(q, topk)
+    per_query = (time.perf_counter() - t0) / len(queries)
+    return build, per_query
+
+
+def bench_incremental(corpus, queries, topk, doc_chunks, ingests):
+    rows = [
+        {"chunk_id": f"c{i}", "document_id": f"doc{i // doc_chunks}", "text": " ".join(tokens)}
+        for i, tokens in enumerate(corpus)
+    ]
+    index = IncrementalBM25()
+    index.rebuild_from_batches([rows])
+
+    # Ingest lại các tài liệu đầu corpus (tài liệu mới cùng cỡ, corpus giữ nguyên số chunk)
+    t0 = time.perf_counter()
+    for k in range(ingests):
+        document_id = f"doc{k}"
+        index.replace_document(document_id, [dict(r, chunk_id=f"{r['chunk_id']}-v2") for r in rows[k * doc_chunks:(k + 1) * doc_chunks]])
+    per_ingest = (time.perf_counter() - t0) / ingests
+
+    t0 = time.perf_counter()
+    for q in queries:
+        index.search(" ".join(q), topk)
+    per_query = (time.perf_counter() - t0) / len(queries)
+    return per_ingest, per_query
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--vocab", type=int, default=50_000)
+    parser.add_argument("--avg-len", type=int, default=80)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--topk", type=int, default=30)
+    parser.add_argument("--max-rank-bm25", type=int, default=100_000,
+                        help="Bỏ qua rank_bm25 với corpus lớn hơn ngưỡng này")
+    parser.add_argument("--doc-chunks", type=int, default=50, help="Số chunk / tài liệu khi đo ingest tăng dần")
+    parser.add_argument("--ingests", type=int, default=20)
+    args = parser.parse_args()
+
+    queries = make_queries(args.queries, args.vocab)
+    print(f"{'chunks':>10} | {'engine':>10} | {'build (s)':>10} | {'query (ms)':>10}")
+    print("-" * 50)
+    for n in args.sizes:
+        corpus = make_corpus(n, args.vocab, args.avg_len)
+        build, q = bench_sparse(corpus, queries, args.topk)
+        print(f"{n:>10} | {'sparse':>10} | {build:>10.2f} | {q * 1000:>10.2f}")
+        ingest, q = bench_incremental(corpus, queries, args.topk, args.doc_chunks, args.ingests)
+        print(f"{n:>10} | {'incr':>10} | {ingest:>10.4f} | {q * 1000:>10.2f}")
+        if n <= args.max_rank_bm25:
+            build, q = bench_rank_bm25(corpus, queries, args.topk)
+            print(f"{n:>10} | {'rank_bm25':>10} | {build:>10.2f} | {q * 1000:>10.2f}")
+        else:
+            print(f"{n:>10} | {'rank_bm25':>10} | {'skipped':>10} | {'skipped':>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# benchmarks/bench_ingest.py
+"""
+Đo thời gian chunking khi ingest (không cần Milvus / model embedding).
+
+Chạy từ thư mục backend:
+    python -m benchmarks.bench_ingest --pages 300
+    python -m benchmarks.bench_ingest --pages 300 --reload-tokenizer
+
+--reload-tokenizer: microbenchmark chi phí load lại tokenizer, KHÔNG phải đo code cũ.
+Chạy chính các chunker hiện tại nhưng mỗi lần lấy tokenizer lại xóa registry rồi
+AutoTokenizer.from_pretrained lại (như code cũ load ở mỗi lần gọi chunker; chunk_hierarchical
+gọi chunk_by_sentences cho từng parent -> hàng trăm lần). Phần chunking vẫn là code mới,
+nên hiệu số 2 chế độ chỉ là chi phí load tokenizer, không gồm các thay đổi khác.
+"""
+import argparse
+import time
+from unittest import mock
+
+import numpy as np
+
+from app.core.settings import settings
+from app.services.chucking import hierarchical_chunker, sentence_chunker, token_chunker, tokenizers
+from app.services import chunking_service
+
+_WORDS = (
+    "chính phủ báo cáo kinh tế tăng trưởng năm quý doanh nghiệp thị trường đầu tư "
+    "xuất khẩu ngân hàng lãi suất chính sách người dân phát triển bền vững hạ tầng "
+    "the report growth market policy investment sector region annual revenue"
+).split()
+
+
+def make_pages(n_pages: int, paras_per_page: int = 6, seed: int = 0) -> list[dict]:
+    """Trang giả lập: vài đoạn văn, mỗi đoạn vài câu, có ngắt dòng kiểu PDF."""
+    rng = np.random.default_rng(seed)
+    pages = []
+    for i in range(n_pages):
+        paras = []
+        for _ in range(paras_per_page):
+            sents = []
+            for _ in range(rng.integers(2, 7)):
+                words = rng.choice(_WORDS, size=rng.integers(8, 30))
+                sents.append(" ".join(words).capitalize() + ".")
+            paras.append("\n".join(sents))
+        pages.append({"page": i + 1, "text": "\n\n".join(paras)})
+    return pages
+
+
+def _strategies(model: str):
+    return {
+        "token": lambda pages: token_chunker.chunk_by_tokens_per_page(pages, model),
+        "sentence": lambda pages: sentence_chunker.chunk_by_sentences(pages, model),
+        "service": lambda pages: chunking_service.chunk_by_tokens(pages, model),
+        "hierarchical": lambda pages: hierarchical_chunker.chunk_hierarchical(pages, model, return_level="both"),
+    }
+
+
+def run(pages, model: str, reload_tokenizer: bool) -> list[tuple]:
+    results = []
+    loads = {"n": 0}
+
+    def reloading_get(tokenizer_model: str):
+        # Load lại tokenizer ở mỗi lần gọi (như code cũ)
+        loads["n"] += 1
+        tokenizers.clear_tokenizers()
+        return tokenizers.get_tokenizer(tokenizer_model)
+
+    patches = [
+        mock.patch.object(m, "get_tokenizer", reloading_get)
+        for m in (hierarchical_chunker, sentence_chunker, token_chunker, chunking_service)
+    ] if reload_tokenizer else []
+
+    for name, fn in _strategies(model).items():
+        loads["n"] = 0
+        for p in patches:
+            p.start()
+        try:
+            t0 = time.perf_counter()
+            chunks = fn(pages)
+            elapsed = time.perf_counter() - t0
+        finally:
+            for p in patches:
+                p.stop()
+        results.append((name, len(chunks), elapsed, loads["n"]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, nargs="+", default=[50, 300])
+    parser.add_argument("--model", default=settings.embed_model)
+    parser.add_argument("--reload-tokenizer", action="store_true",
+                        help="Chunker hiện tại + load lại tokenizer mỗi lần gọi (đo chi phí reload, không phải code cũ)")
+    args = parser.parse_args()
+
+    # Load trước 1 lần để chế độ registry đo đúng phần chunking
+    t0 = time.perf_counter()
+    tokenizers.get_tokenizer(args.model)
+    print(f"tokenizer load: {time.perf_counter() - t0:.2f}s ({args.model})")
+    mode = "reload-cost microbenchmark (chunker hiện tại, load lại tokenizer mỗi lần gọi)" if args.reload_tokenizer else "tokenizer registry"
+    print(f"mode: {mode}")
+
+    print(f"{'pages':>6} | {'strategy':>12} | {'chunks':>7} | {'time (s)':>9} | {'pages/s':>8} | {'loads':>5}")
+    print("-" * 62)
+    for n in args.pages:
+        pages = make_pages(n)
+        for name, n_chunks, elapsed, loads in run(pages, args.model, args.reload_tokenizer):
+            print(f"{n:>6} | {name:>12} | {n_chunks:>7} | {elapsed:>9.2f} | {n / elapsed:>8.1f} | {loads:>5}")
+
+
+if __name__ == "__main__":
+    main()
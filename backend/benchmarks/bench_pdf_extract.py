@@ -0,0 +1,60 @@
+# benchmarks/bench_pdf_extract.py
+"""
+So sánh trích text PDF tuần tự với process pool theo số trang.
+
+Chạy từ thư mục backend:
+    python -m benchmarks.bench_pdf_extract --pages 50 200 500 1000 --workers 1 2 4 8
+
+PDF được sinh bằng PyMuPDF (mỗi trang vài chục dòng text).
+"""
+import argparse
+import time
+
+import fitz
+
+from app.services import pdf_ingest
+
+_LINE = "Báo cáo tăng trưởng kinh tế quý {q}: doanh nghiệp, đầu tư, xuất khẩu và thị trường lao động. "
+
+
+def make_pdf(n_pages: int, lines_per_page: int = 45) -> bytes:
+    doc = fitz.open()
+    for i in range(n_pages):
+        page = doc.new_page()
+        y = 40
+        for j in range(lines_per_page):
+            page.insert_text((40, y), _LINE.format(q=(i + j) % 4 + 1), fontsize=9)
+            y += 16
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, nargs="+", default=[50, 200, 500, 1000])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    # Bỏ ngưỡng số trang tối thiểu để đo cả PDF nhỏ
+    pdf_ingest.settings.pdf_parallel_min_pages = 0
+
+    print(f"{'pages':>6} | {'workers':>7} | {'time (s)':>9} | {'pages/s':>8} | {'speedup':>7}")
+    print("-" * 50)
+    for n in args.pages:
+        pdf = make_pdf(n)
+        baseline = None
+        for w in args.workers:
+            pdf_ingest.extract_pages(pdf, workers=w)  # warm-up (khởi tạo process pool)
+            t0 = time.perf_counter()
+            for _ in range(args.repeat):
+                pages = pdf_ingest.extract_pages(pdf, workers=w)
+            elapsed = (time.perf_counter() - t0) / args.repeat
+            assert [p["page"] for p in pages] == list(range(1, n + 1))
+            baseline = baseline or elapsed
+            print(f"{n:>6} | {w:>7} | {elapsed:>9.3f} | {n / elapsed:>8.0f} | {baseline / elapsed:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -20,6 +20,24 @@ export function viewDocument(filename) {
     document.getElementById('preview-modal').classList.add('show');
 }
 
+// Hỏi trạng thái job ingest định kỳ, hiển thị tiến độ lên nút
+async function waitForIngestJob(jobId, btn, intervalMs = 1000) {
+    while (true) {
+        const res = await fetch(`/documents/jobs/${jobId}`);
+        const job = await res.json();
+        if (!res.ok) throw new Error(JSON.stringify(job));
+        if (job.status === "done" || job.status === "failed") return job;
+
+        if (btn) {
+            const p = job.progress || {};
+            btn.innerText = job.status === "queued"
+                ? "Đang chờ..."
+                : `Processing... ${Math.round((p.progress || 0) * 100)}%`;
+        }
+        await new Promise(r => setTimeout(r, intervalMs));
+    }
+}
+
 // Quản lý Upload
 export async function uploadPDF(selectedFile, callbackSuccess) {
     if (!selectedFile) return alert("Vui lòng chọn file PDF!");
@@ -39,14 +57,27 @@ export async function uploadPDF(selectedFile, callbackSuccess) {
         const res = await fetch("/documents/ingest", { method: "POST", body: formData });
         const data = await res.json();
 
-        if (res.ok) {
-            alert(`✅ Thành công! Đã thêm ${data.chunks_inserted} đoạn văn.`);
+        if (!res.ok) {
+            alert(`❌ Lỗi server: ${JSON.stringify(data)}`);
+            return;
+        }
+
+        // Nội dung đã có trong index -> không tạo job
+        if (data.status === "duplicate") {
+            alert(`ℹ️ Tài liệu đã có sẵn (${data.duplicate_of || data.document_id}), không cần xử lý lại.`);
+            return;
+        }
+
+        // Ingest chạy nền -> hỏi trạng thái job cho tới khi xong
+        const job = await waitForIngestJob(data.job_id, btn);
+        if (job.status === "done") {
+            alert(`✅ Thành công! Đã thêm ${job.result.chunks_inserted} đoạn văn.`);
             document.getElementById('preview-modal').classList.remove('show');
             document.getElementById('pdf-preview').src = '';
             
             if (callbackSuccess) callbackSuccess(); // Gọi hàm reset chat
         } else {
-            alert(`❌ Lỗi server: ${JSON.stringify(data)}`);
+            alert(`❌ Lỗi xử lý tài liệu: ${job.error}`);
         }
     } catch (err) {
         console.error(err);
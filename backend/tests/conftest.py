@@ -0,0 +1,6 @@
+# tests/conftest.py
+import os
+
+# Settings bắt buộc có API key; test không gọi LLM nên giá trị giả là đủ
+os.environ.setdefault("GROQ_API_KEY", "test")
+os.environ.setdefault("AGENT_API_KEY", "test")
@@ -0,0 +1,79 @@
+# tests/test_bm25_sparse.py
+"""SparseBM25 phải cho cùng điểm với rank_bm25.BM25Okapi (sai số float32)."""
+import numpy as np
+import pytest
+from rank_bm25 import BM25Okapi
+
+from app.services.bm25_sparse import SparseBM25, build_term_matrix
+
+
+def _corpus(n_docs: int, vocab_size: int, seed: int = 0) -> list:
+    rng = np.random.default_rng(seed)
+    words = [f"w{i}" for i in range(vocab_size)]
+    return [
+        [words[i] for i in rng.zipf(1.5, size=int(rng.integers(3, 30))) % vocab_size]
+        for _ in range(n_docs)
+    ]
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_scores_match_rank_bm25(seed):
+    corpus = _corpus(300, 200, seed)
+    ref = BM25Okapi(corpus)
+    bm25 = SparseBM25.from_corpus(corpus)
+
+    rng = np.random.default_rng(seed + 100)
+    for _ in range(20):
+        query = [f"w{i}" for i in rng.integers(0, 220, size=4)]  # gồm cả term không có trong corpus
+        np.testing.assert_allclose(bm25.get_scores(query), ref.get_scores(query), rtol=2e-6, atol=2e-6)
+
+
+def test_negative_idf_uses_epsilon_floor():
+    # "common" có mặt ở hơn nửa số doc -> idf âm -> thay bằng epsilon * avg idf như rank_bm25
+    corpus = [["common", "a"], ["common", "b"], ["common", "c"], ["d"]]
+    ref = BM25Okapi(corpus)
+    bm25 = SparseBM25.from_corpus(corpus)
+    for query in (["common"], ["common", "a"], ["d", "d"]):
+        np.testing.assert_allclose(bm25.get_scores(query), ref.get_scores(query), rtol=2e-6, atol=2e-6)
+
+
+def test_top_k_sorted_and_positive():
+    corpus = _corpus(500, 100)
+    ref = BM25Okapi(corpus)
+    bm25 = SparseBM25.from_corpus(corpus)
+    query = ["w3", "w17"]
+
+    idx, scores = bm25.get_top_k(query, 10)
+    expected = np.asarray(ref.get_scores(query))
+    assert len(idx) <= 10
+    assert np.all(np.diff(scores) <= 0)
+    assert np.all(scores > 0)
+    np.testing.assert_allclose(scores, np.sort(expected)[::-1][: len(idx)], rtol=2e-6, atol=2e-6)
+
+
+def test_top_k_keeps_zero_scores_like_rank_bm25():
+    corpus = _corpus(200, 100)
+    ref = BM25Okapi(corpus)
+    bm25 = SparseBM25.from_corpus(corpus)
+    for query, k in ((["w3", "w17"], 150), (["khong-co"], 5), (["w90"], 30)):
+        # Cách KeywordRetriever cũ lấy top-k: sort toàn bộ, không lọc điểm 0
+        expected = np.asarray(ref.get_scores(query))
+        want = sorted(range(len(expected)), key=lambda i: expected[i], reverse=True)[:k]
+        idx, scores = bm25.get_top_k(query, k, positive_only=False)
+        assert idx.tolist() == want
+        np.testing.assert_allclose(scores, expected[want], rtol=2e-6, atol=2e-6)
+
+
+def test_empty_and_unknown_query():
+    bm25 = SparseBM25.from_corpus(_corpus(10, 20))
+    idx, scores = bm25.get_top_k(["khong-co"], 5)
+    assert idx.size == 0 and scores.size == 0
+    assert not bm25.get_scores([]).any()
+
+
+def test_vocab_longer_than_matrix_is_ignored():
+    vocab: dict = {}
+    tf = build_term_matrix([["a", "b"], ["b", "c"]], vocab)
+    vocab["moi"] = len(vocab)  # term thêm sau khi build
+    bm25 = SparseBM25(tf, vocab)
+    assert not bm25.get_scores(["moi"]).any()
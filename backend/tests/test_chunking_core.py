@@ -0,0 +1,102 @@
+# tests/test_chunking_core.py
+"""Span / đếm token / gom câu của chucking.core (tokenizer giả tách theo khoảng trắng)."""
+import re
+
+import pytest
+
+from app.services.chucking.core import (
+    TokenizedText,
+    pack_sentences,
+    split_spans,
+    strip_span,
+    tokenize_texts,
+)
+
+
+class _WhitespaceTokenizer:
+    """Mỗi cụm không phải khoảng trắng là 1 token, offset_mapping như fast tokenizer."""
+
+    def __call__(self, texts, add_special_tokens=False, return_offsets_mapping=True):
+        return {"offset_mapping": [[(m.start(), m.end()) for m in re.finditer(r"\S+", t)] for t in texts]}
+
+
+def _tok(text: str) -> TokenizedText:
+    return tokenize_texts(_WhitespaceTokenizer(), [text])[0]
+
+
+def test_count_and_char_span():
+    text = "Điều 1. Phạm vi  điều chỉnh của luật"
+    t = _tok(text)
+    assert len(t) == 8
+    assert t.count(0, len(text)) == 8
+    # "Phạm vi" bắt đầu ở ký tự 8
+    start = text.index("Phạm")
+    assert t.count(start, text.index("điều")) == 2
+    s, e = t.char_span(2, 4)
+    assert text[s:e] == "Phạm vi"
+
+
+def test_char_end_after_cuts_by_token_budget():
+    text = "một hai ba bốn năm"
+    t = _tok(text)
+    assert text[: t.char_end_after(0, 3)] == "một hai ba"
+    start = text.index("ba")
+    assert text[start: t.char_end_after(start, 10)] == "ba bốn năm"
+    assert t.char_end_after(len(text), 3) == len(text)
+
+
+@pytest.mark.parametrize("n, size, overlap", [(10, 4, 1), (10, 4, 0), (3, 5, 2), (7, 3, 2)])
+def test_windows_cover_all_tokens(n, size, overlap):
+    t = _tok(" ".join(f"w{i}" for i in range(n)))
+    windows = t.windows(size, overlap)
+    assert windows[0][0] == 0 and windows[-1][1] == n
+    for (s1, e1), (s2, _) in zip(windows, windows[1:]):
+        assert e1 - s1 <= size
+        # Cửa sổ sau lùi lại đúng overlap token (luôn tiến ít nhất 1)
+        assert s2 == max(s1 + 1, e1 - overlap)
+
+
+def test_split_spans_matches_split_strip():
+    sep = re.compile(r"(?<=[.!?])\s+")
+    text = "  Câu một. Câu hai!   Câu ba?  Câu bốn  "
+    expected = [s.strip() for s in sep.split(text) if s.strip()]
+    assert [text[a:b] for a, b in split_spans(text, sep)] == expected
+
+    # Chỉ tách trong [start, end), span vẫn theo vị trí trong text gốc
+    start, end = text.index("Câu hai"), text.index("Câu bốn")
+    assert [text[a:b] for a, b in split_spans(text, sep, start, end)] == ["Câu hai!", "Câu ba?"]
+
+
+def test_strip_span():
+    text = "  abc \n"
+    assert strip_span(text, 0, len(text)) == (2, 5)
+    assert strip_span("   ", 0, 3) == (3, 3)
+
+
+def _sentences(lens, page=1):
+    return [(f"s{i}", n, page + i // 2) for i, n in enumerate(lens)]
+
+
+def test_pack_sentences_respects_budget():
+    chunks = list(pack_sentences(_sentences([3, 3, 3, 3, 3]), chunk_size=7, overlap_sentences=0))
+    assert [c["text"] for c in chunks] == ["s0 s1", "s2 s3", "s4"]
+    assert [c["token_len"] for c in chunks] == [6, 6, 3]
+    assert all(c["token_len"] <= 7 for c in chunks)
+    assert (chunks[0]["page_start"], chunks[0]["page_end"]) == (1, 1)
+    assert (chunks[1]["page_start"], chunks[1]["page_end"]) == (2, 2)
+
+
+def test_pack_sentences_overlap():
+    chunks = list(pack_sentences(_sentences([2, 2, 2, 2, 2]), chunk_size=6, overlap_sentences=1))
+    assert [c["text"] for c in chunks] == ["s0 s1 s2", "s2 s3 s4"]
+    assert [c["sentence_count"] for c in chunks] == [3, 3]
+
+
+def test_pack_sentences_oversized_sentence_is_own_chunk():
+    chunks = list(pack_sentences(_sentences([2, 10, 2]), chunk_size=5, overlap_sentences=0))
+    assert [c["text"] for c in chunks] == ["s0", "s1", "s2"]
+    assert chunks[1]["token_len"] == 10
+
+
+def test_pack_sentences_empty():
+    assert list(pack_sentences([], chunk_size=5, overlap_sentences=1)) == []
@@ -0,0 +1,82 @@
+# tests/test_document_registry.py
+"""DocumentRegistry: giữ chỗ ingest theo document_id, tiếp quản bản ghi lỗi, đối chiếu với index lúc khởi động."""
+import pytest
+
+from app.services.document_registry import DocumentRegistry
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return DocumentRegistry(str(tmp_path / "documents.sqlite3"))
+
+
+def test_first_claim_wins_and_duplicates_get_existing_record(registry):
+    assert registry.claim("doc1", "sha", "a.pdf", "job1") is None
+    assert not registry.reclaimed("doc1")
+
+    # Job khác, cùng nội dung, tên mới -> trả bản ghi đang indexing, chỉ ghi thêm tên file
+    existing = registry.claim("doc1", "sha", "b.pdf", "job2")
+    assert existing["status"] == "indexing" and existing["job_id"] == "job1"
+    assert existing["filenames"] == ["a.pdf", "b.pdf"]
+
+    registry.mark_indexed("doc1", pages=3, chunks=10)
+    existing = registry.claim("doc1", "sha", "a.pdf", "job3")
+    assert existing["status"] == "indexed" and existing["filenames"] == ["a.pdf", "b.pdf"]
+    assert registry.get("doc1")["chunks"] == 10
+
+
+def test_failed_document_is_reclaimed(registry):
+    registry.claim("doc1", "sha", "a.pdf", "job1")
+    registry.mark_failed("doc1")
+
+    assert registry.claim("doc1", "sha", "a.pdf", "job2") is None
+    doc = registry.get("doc1")
+    assert doc["status"] == "indexing" and doc["job_id"] == "job2"
+    # Lần trước lỗi -> Milvus có thể còn chunk dở, phải xóa trước khi ingest
+    assert registry.reclaimed("doc1")
+
+
+def test_same_job_can_claim_again_after_restart(registry):
+    registry.claim("doc1", "sha", "a.pdf", "job1")
+    assert registry.claim("doc1", "sha", "a.pdf", "job1") is None
+    assert registry.reclaimed("doc1")
+
+
+def test_release_job_frees_only_its_indexing_documents(registry):
+    registry.claim("doc1", "sha1", "a.pdf", "job1")
+    registry.claim("doc2", "sha2", "b.pdf", "job1")
+    registry.mark_indexed("doc2", pages=1, chunks=1)
+    registry.claim("doc3", "sha3", "c.pdf", "job2")
+
+    assert registry.release_job("job1") == 1
+    assert registry.stats() == {"failed": 1, "indexed": 1, "indexing": 1}
+    assert registry.claim("doc1", "sha1", "a.pdf", "job4") is None
+
+
+def test_backfill_does_not_overwrite_existing(registry):
+    registry.claim("doc1", "sha", "a.pdf", "job1")
+    added = registry.backfill({"doc1": {"filename": "x.pdf", "chunks": 5}, "doc2": {"filename": "y.pdf", "chunks": 7}})
+    assert added == 1
+    assert registry.get("doc1")["status"] == "indexing"
+    doc2 = registry.get("doc2")
+    assert doc2["status"] == "indexed" and doc2["filenames"] == ["y.pdf"] and doc2["chunks"] == 7
+
+
+def test_reconcile_fails_missing_and_orphaned(registry):
+    registry.backfill({"kept": {"filename": "a.pdf"}, "gone": {"filename": "b.pdf"}})
+    registry.claim("running", "sha1", "c.pdf", "job1")
+    registry.claim("orphan", "sha2", "d.pdf", "job2")
+
+    assert registry.reconcile(indexed_ids=["kept"], active_job_ids=["job1"]) == {"missing": 1, "orphaned": 1}
+    assert registry.get("kept")["status"] == "indexed"
+    assert registry.get("running")["status"] == "indexing"
+    assert registry.get("gone")["status"] == "failed"
+    assert registry.get("orphan")["status"] == "failed"
+    # Sau reconcile upload lại được
+    assert registry.claim("gone", "sha3", "b.pdf", "job3") is None
+
+
+def test_survives_reopen(tmp_path):
+    path = str(tmp_path / "documents.sqlite3")
+    DocumentRegistry(path).claim("doc1", "sha", "a.pdf", "job1")
+    assert DocumentRegistry(path).get("doc1")["job_id"] == "job1"
@@ -0,0 +1,97 @@
+# tests/test_embedding_batcher.py
+"""EmbeddingBatcher: gom câu hỏi của các request đồng thời thành 1 lần encode, trả đúng phần từng request."""
+import asyncio
+
+import pytest
+
+# embedding_batcher import LocalEmbedder (FlagEmbedding) để khai báo kiểu
+pytest.importorskip("FlagEmbedding")
+
+from app.services.embedding_batcher import EmbeddingBatcher
+from app.utils.cache import TTLCache
+
+
+class _FakeEmbedder:
+    """encode_queries giả: vector = [độ dài text], có query_cache như LocalEmbedder."""
+
+    def __init__(self, fail: bool = False):
+        self.query_cache = TTLCache(maxsize=100)
+        self.batches = []
+        self.fail = fail
+
+    def _query_key(self, text: str) -> tuple:
+        return ("fake", text)
+
+    def encode_queries(self, texts):
+        self.batches.append(list(texts))
+        if self.fail:
+            raise RuntimeError("OOM")
+        out = []
+        for t in texts:
+            v = [float(len(t))]
+            self.query_cache.set(self._query_key(t), v)
+            out.append(v)
+        return out
+
+
+def test_concurrent_requests_share_one_encode():
+    async def main():
+        embedder = _FakeEmbedder()
+        batcher = EmbeddingBatcher(embedder, max_batch=32, max_wait_ms=20)
+        results = await asyncio.gather(
+            batcher.encode_queries(["a"]),
+            batcher.encode_queries(["bb", "ccc"]),
+            batcher.encode_queries(["dddd"]),
+        )
+        assert results == [[[1.0]], [[2.0], [3.0]], [[4.0]]]
+        assert embedder.batches == [["a", "bb", "ccc", "dddd"]]
+        assert batcher.stats()["batch_size"]["count"] == 1
+
+    asyncio.run(main())
+
+
+def test_batch_closes_at_max_batch():
+    async def main():
+        embedder = _FakeEmbedder()
+        batcher = EmbeddingBatcher(embedder, max_batch=2, max_wait_ms=50)
+        results = await asyncio.gather(*(batcher.encode_queries([c * 3]) for c in "xyz"))
+        assert results == [[[3.0]]] * 3
+        assert [len(b) for b in embedder.batches] == [2, 1]
+
+    asyncio.run(main())
+
+
+def test_cached_queries_skip_the_queue():
+    async def main():
+        embedder = _FakeEmbedder()
+        batcher = EmbeddingBatcher(embedder, max_batch=32, max_wait_ms=5)
+        await batcher.encode_queries(["đã có"])
+        assert await batcher.encode_queries(["đã có"]) == [[5.0]]
+        assert batcher.cache_fast_path == 1
+
+    asyncio.run(main())
+
+
+def test_cancelled_request_is_dropped_from_batch():
+    async def main():
+        embedder = _FakeEmbedder()
+        batcher = EmbeddingBatcher(embedder, max_batch=32, max_wait_ms=20)
+        cancelled = asyncio.create_task(batcher.encode_queries(["bị hủy"]))
+        kept = asyncio.create_task(batcher.encode_queries(["giữ"]))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        assert await kept == [[3.0]]
+        assert embedder.batches == [["giữ"]]
+
+    asyncio.run(main())
+
+
+def test_encode_error_reaches_every_request():
+    async def main():
+        batcher = EmbeddingBatcher(_FakeEmbedder(fail=True), max_batch=32, max_wait_ms=10)
+        results = await asyncio.gather(
+            batcher.encode_queries(["a"]), batcher.encode_queries(["b"]), return_exceptions=True
+        )
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+    asyncio.run(main())
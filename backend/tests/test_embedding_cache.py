@@ -0,0 +1,118 @@
+# tests/test_embedding_cache.py
+"""EmbeddingDiskCache: hit / miss, đuổi slot cũ khi đầy, mở lại từ đĩa, khóa thư mục."""
+import numpy as np
+import pytest
+
+from app.services.embedding_cache import CacheLockedError, EmbeddingDiskCache, chunk_key, normalize_chunk
+
+_DIM = 8
+_SLOT_BYTES = _DIM * 2 + 16 + 8
+
+
+def _cache(path, slots: int, evict_fraction: float = 0.25) -> EmbeddingDiskCache:
+    return EmbeddingDiskCache(str(path), dim=_DIM, max_mb=slots * _SLOT_BYTES / (1024 * 1024), evict_fraction=evict_fraction)
+
+
+def _vecs(n: int, seed: int = 0) -> np.ndarray:
+    v = np.random.default_rng(seed).normal(size=(n, _DIM)).astype(np.float32)
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+def _keys(n: int, prefix: str = "chunk") -> list:
+    return [chunk_key("model", f"{prefix} {i}") for i in range(n)]
+
+
+def test_chunk_key_normalizes_whitespace_only():
+    assert normalize_chunk("  Điều  1.\n\tPhạm vi ") == "Điều 1. Phạm vi"
+    assert chunk_key("m", "a  b") == chunk_key("m", "a b")
+    assert chunk_key("m", "A b") != chunk_key("m", "a b")
+    assert chunk_key("m1", "a b") != chunk_key("m2", "a b")
+
+
+def test_hit_and_miss(tmp_path):
+    cache = _cache(tmp_path, slots=10)
+    keys, vecs = _keys(3), _vecs(3)
+    cache.put_many(keys, vecs)
+
+    out = cache.get_many(keys + [chunk_key("model", "khác")])
+    assert out[-1] is None
+    np.testing.assert_allclose(np.stack(out[:3]), vecs, atol=1e-3)  # lưu fp16
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = _cache(tmp_path, slots=8, evict_fraction=0.25)
+    assert cache.capacity == 8
+    keys, vecs = _keys(8), _vecs(8)
+    cache.put_many(keys, vecs)
+    # Dùng lại 6 key sau -> key 0, 1 là cũ nhất
+    cache.get_many(keys[2:])
+
+    cache.put_many(_keys(1, "mới"), _vecs(1, seed=1))
+    # Đuổi 1 lượt evict_fraction * capacity = 2 slot cũ nhất
+    assert cache.evictions == 2
+    assert len(cache) == 7
+    out = cache.get_many(keys)
+    assert out[0] is None and out[1] is None
+    assert all(v is not None for v in out[2:])
+
+
+def test_batch_larger_than_capacity_keeps_tail(tmp_path):
+    cache = _cache(tmp_path, slots=4)
+    keys, vecs = _keys(6), _vecs(6)
+    cache.put_many(keys, vecs)
+    assert len(cache) == 4
+    out = cache.get_many(keys)
+    assert out[:2] == [None, None]
+    np.testing.assert_allclose(np.stack(out[2:]), vecs[2:], atol=1e-3)
+
+
+def test_reopen_keeps_entries_and_recency(tmp_path):
+    cache = _cache(tmp_path, slots=8)
+    keys, vecs = _keys(8), _vecs(8)
+    cache.put_many(keys, vecs)
+    cache.get_many(keys[2:])
+    del cache
+
+    reopened = _cache(tmp_path, slots=8)
+    assert len(reopened) == 8
+    out = reopened.get_many(keys)
+    np.testing.assert_allclose(np.stack(out), vecs, atol=1e-3)
+
+    # Thứ tự dùng gần nhất được giữ qua lần mở lại (ticks.npy)
+    reopened.get_many(keys[2:])
+    reopened.put_many(_keys(1, "mới"), _vecs(1, seed=1))
+    out = reopened.get_many(keys)
+    assert out[0] is None and out[1] is None
+
+
+def test_reopen_with_other_size_starts_empty(tmp_path):
+    cache = _cache(tmp_path, slots=8)
+    cache.put_many(_keys(3), _vecs(3))
+    del cache
+
+    resized = _cache(tmp_path, slots=16)
+    assert resized.capacity == 16
+    assert len(resized) == 0
+    assert resized.get_many(_keys(3)) == [None, None, None]
+
+
+def test_directory_is_locked_while_open(tmp_path):
+    cache = _cache(tmp_path, slots=8)
+    cache.put_many(_keys(3), _vecs(3))
+    # flock theo file mở -> instance thứ 2 (như 1 worker khác) không được mở cùng thư mục
+    with pytest.raises(CacheLockedError):
+        _cache(tmp_path, slots=8)
+
+    cache.close()
+    reopened = _cache(tmp_path, slots=8)
+    assert len(reopened) == 3
+
+
+def test_flushes_on_interval_not_every_put(tmp_path):
+    cache = EmbeddingDiskCache(str(tmp_path), dim=_DIM, max_mb=8 * _SLOT_BYTES / (1024 * 1024), flush_interval_s=3600)
+    cache.put_many(_keys(2), _vecs(2))
+    cache.put_many(_keys(2, "khác"), _vecs(2, seed=1))
+    assert cache.flushes == 0 and cache.stats()["unflushed"]
+    cache.close()
+    assert cache.flushes == 1 and not cache.stats()["unflushed"]
@@ -0,0 +1,76 @@
+# tests/test_hierarchical_chunker.py
+"""iter_hierarchical: page_start / page_end của parent và child là trang thật của đoạn / câu bên trong."""
+import re
+
+import pytest
+
+# hierarchical_chunker import registry tokenizer (transformers)
+pytest.importorskip("transformers")
+
+from app.services.chucking import hierarchical_chunker
+
+_PAGES = [
+    {"page": 1, "text": "Điều một quy định. Điều hai quy định.\n\nĐoạn hai trang một."},
+    {"page": 2, "text": "   "},
+    {"page": 3, "text": "Điều ba trang ba. Điều bốn trang ba."},
+]
+
+
+class _WhitespaceTokenizer:
+    """Mỗi cụm không phải khoảng trắng là 1 token, offset_mapping như fast tokenizer."""
+
+    def __call__(self, texts, add_special_tokens=False, return_offsets_mapping=True):
+        return {"offset_mapping": [[(m.start(), m.end()) for m in re.finditer(r"\S+", t)] for t in texts]}
+
+
+@pytest.fixture(autouse=True)
+def tokenizer(monkeypatch):
+    monkeypatch.setattr(hierarchical_chunker, "get_tokenizer", lambda model: _WhitespaceTokenizer())
+
+
+def _run(pages, **kwargs):
+    params = dict(coarse_target_tokens=100, coarse_overlap_tokens=3, chunk_size=8, overlap_sentences=1)
+    params.update(kwargs)
+    return list(hierarchical_chunker.iter_hierarchical(pages, "fake-model", **params))
+
+
+def test_children_carry_pages_of_their_sentences():
+    [(parent, children)] = _run(_PAGES)
+    assert (parent["page_start"], parent["page_end"]) == (1, 3)
+    assert [(c["page_start"], c["page_end"]) for c in children] == [(1, 1), (1, 1), (1, 3), (3, 3)]
+    # Child vắt qua trang trống: bắt đầu ở câu cuối trang 1, kết thúc ở câu đầu trang 3
+    assert children[2]["text"] == "Đoạn hai trang một. Điều ba trang ba."
+    assert all(c["parent_id"] == parent["chunk_id"] for c in children)
+
+
+def test_parents_split_on_paragraphs_keep_their_pages():
+    results = _run(_PAGES, coarse_target_tokens=10)
+    assert [(p["page_start"], p["page_end"]) for p, _ in results] == [(1, 1), (1, 1), (3, 3)]
+    for parent, children in results:
+        for c in children:
+            assert parent["page_start"] <= c["page_start"] <= c["page_end"] <= parent["page_end"]
+
+
+def test_pages_are_consumed_lazily():
+    read = []
+
+    def pages():
+        for p in _PAGES:
+            read.append(p["page"])
+            yield p
+
+    it = hierarchical_chunker.iter_hierarchical(
+        pages(), "fake-model", coarse_target_tokens=10, coarse_overlap_tokens=3, chunk_size=8
+    )
+    assert read == []
+    next(it)
+    assert read == [1, 2, 3]
+    assert len(list(it)) == 2
+
+
+def test_nested_matches_both():
+    kwargs = dict(coarse_target_tokens=10, coarse_overlap_tokens=3, chunk_size=8, overlap_sentences=1)
+    nested = hierarchical_chunker.chunk_hierarchical(_PAGES, "fake-model", return_level="nested", **kwargs)
+    both = hierarchical_chunker.chunk_hierarchical(_PAGES, "fake-model", return_level="both", **kwargs)
+    children = [c for p in nested for c in p.pop("child_chunks")]
+    assert nested + children == both
@@ -0,0 +1,119 @@
+# tests/test_incremental_bm25.py
+"""IncrementalBM25 sau add / remove / replace phải giống hệt index build lại từ đầu."""
+import random
+
+import numpy as np
+import pytest
+
+from app.services.bm25_index import BM25Accumulator, IncrementalBM25
+
+_WORDS = "luật đất đai năm 2024 sửa đổi chính phủ báo cáo kinh tế thị trường ngân hàng lãi suất".split()
+_QUERIES = ["luật đất đai", "năm 2024", "ngân hàng lãi suất", "kinh tế thị trường chính phủ", "không có"]
+
+
+def _chunks(document_id: str, n: int, rng: random.Random, prefix: str = "c") -> list:
+    return [
+        {
+            "chunk_id": f"{document_id}-{prefix}{i}",
+            "document_id": document_id,
+            "text": " ".join(rng.choices(_WORDS, k=rng.randint(3, 12))),
+            "metadata": {"source": f"{document_id}.pdf", "page": i + 1},
+        }
+        for i in range(n)
+    ]
+
+
+def _results(index: IncrementalBM25, query: str) -> dict:
+    return {doc["chunk_id"]: score for doc, score in index.search(query, topk=1000)}
+
+
+def _assert_same(index: IncrementalBM25, docs_by_id: dict):
+    expected = IncrementalBM25([d for docs in docs_by_id.values() for d in docs])
+    assert len(index) == len(expected)
+    assert index.documents() == expected.documents()
+    for q in _QUERIES:
+        got, want = _results(index, q), _results(expected, q)
+        assert got.keys() == want.keys()
+        np.testing.assert_allclose([got[k] for k in want], list(want.values()), rtol=1e-5)
+
+
+@pytest.fixture
+def corpus():
+    rng = random.Random(0)
+    return rng, {f"d{i}": _chunks(f"d{i}", rng.randint(2, 8), rng) for i in range(6)}
+
+
+def test_add_documents(corpus):
+    rng, docs = corpus
+    index = IncrementalBM25()
+    for document_id, chunks in docs.items():
+        index.add_documents(document_id, chunks)
+    _assert_same(index, docs)
+
+
+def test_remove_document(corpus):
+    _, docs = corpus
+    index = IncrementalBM25([d for chunks in docs.values() for d in chunks])
+    index.remove_document("d2")
+    index.remove_document("khong-co")
+    del docs["d2"]
+    _assert_same(index, docs)
+
+
+def test_replace_document(corpus):
+    rng, docs = corpus
+    index = IncrementalBM25([d for chunks in docs.values() for d in chunks])
+    docs["d1"] = _chunks("d1", 3, rng, prefix="v2-")
+    index.replace_document("d1", docs["d1"])
+    _assert_same(index, docs)
+
+
+def test_replace_documents_and_accumulator(corpus):
+    rng, docs = corpus
+    index = IncrementalBM25([d for chunks in docs.values() for d in chunks])
+    batch = BM25Accumulator()
+    new = {"d0": _chunks("d0", 4, rng, prefix="v2-"), "moi": _chunks("moi", 5, rng)}
+    # Nạp theo từng batch insert xen kẽ tài liệu, như trong lúc ingest
+    batch.add("d0", new["d0"][:2])
+    batch.add("moi", new["moi"][:3])
+    batch.add("d0", new["d0"][2:])
+    batch.add("moi", new["moi"][3:])
+    batch.add("loi", _chunks("loi", 3, rng))
+    batch.discard("loi")
+    assert len(batch) == 9
+    index.commit(batch)
+    docs.update(new)
+    _assert_same(index, docs)
+
+
+def test_add_overwrites_same_chunk_id(corpus):
+    rng, docs = corpus
+    index = IncrementalBM25([d for chunks in docs.values() for d in chunks])
+    updated = dict(docs["d3"][0], text="luật đất đai sửa đổi")
+    index.add_documents("d3", [updated])
+    docs["d3"] = [updated] + docs["d3"][1:]
+    _assert_same(index, docs)
+
+
+def test_rebuild_from_batches_matches_rebuild(corpus):
+    _, docs = corpus
+    rows = [d for chunks in docs.values() for d in chunks]
+    index = IncrementalBM25()
+    assert index.rebuild_from_batches([rows[:5], rows[5:11], rows[11:]]) == len(rows)
+    _assert_same(index, docs)
+
+
+def test_many_ingests_merge_segments(corpus):
+    rng, docs = corpus
+    index = IncrementalBM25([d for chunks in docs.values() for d in chunks])
+    # Chuỗi thêm / sửa / xóa dài -> segment được gộp và nén, kết quả vẫn phải như build lại
+    for step in range(60):
+        document_id = f"d{rng.randrange(12)}"
+        if document_id in docs and rng.random() < 0.3:
+            index.remove_document(document_id)
+            del docs[document_id]
+        else:
+            docs[document_id] = _chunks(document_id, rng.randint(1, 6), rng, prefix=f"s{step}-")
+            index.replace_document(document_id, docs[document_id])
+    _assert_same(index, docs)
+    assert len(index._snapshot.segments) <= 8
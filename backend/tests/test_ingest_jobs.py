@@ -0,0 +1,138 @@
+# tests/test_ingest_jobs.py
+"""IngestJobQueue: job sống sót qua restart, giới hạn số lần chạy lại, file spool luôn được dọn."""
+import asyncio
+import os
+
+import pytest
+
+# ingest_jobs import IngestProgress từ ingest_pipeline (embedding + Milvus + tokenizer)
+pytest.importorskip("FlagEmbedding")
+pytest.importorskip("pymilvus")
+pytest.importorskip("transformers")
+
+from app.services import ingest_jobs as ingest_jobs_module
+from app.services.document_registry import DocumentRegistry
+from app.services.ingest_jobs import IngestJobQueue
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    registry = DocumentRegistry(str(tmp_path / "documents.sqlite3"))
+    monkeypatch.setattr(ingest_jobs_module, "document_registry", registry)
+    return registry
+
+
+def _queue(tmp_path, **kwargs) -> IngestJobQueue:
+    return IngestJobQueue(str(tmp_path / "jobs.sqlite3"), str(tmp_path / "spool"), **kwargs)
+
+
+async def _wait_finished(queue: IngestJobQueue, job_id: str) -> dict:
+    for _ in range(200):
+        job = queue.get(job_id)
+        if job["status"] in ("done", "failed"):
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job {job_id} chưa xong: {job['status']}")
+
+
+async def _ok(job, progress):
+    with open(job["spool_path"], "rb") as f:
+        return {"size": len(f.read())}
+
+
+def test_job_runs_and_spool_is_removed(tmp_path, registry):
+    async def main():
+        queue = _queue(tmp_path)
+        queue.set_handler(_ok)
+        job = await queue.submit(b"%PDF-1.7", "a.pdf", "doc1")
+        spool = queue.spool_path(job["job_id"])
+        done = await _wait_finished(queue, job["job_id"])
+        await queue.stop()
+        assert done["result"] == {"size": 8} and done["attempts"] == 1
+        assert not os.path.exists(spool)
+        assert queue.active_job_ids() == set()
+
+    asyncio.run(main())
+
+
+def test_failed_job_records_error_and_removes_spool(tmp_path, registry):
+    async def boom(job, progress):
+        raise ValueError("PDF hỏng")
+
+    async def main():
+        queue = _queue(tmp_path)
+        queue.set_handler(boom)
+        job = await queue.submit(b"x", "a.pdf", "doc1")
+        failed = await _wait_finished(queue, job["job_id"])
+        await queue.stop()
+        assert failed["error"] == "ValueError: PDF hỏng"
+        assert not os.path.exists(queue.spool_path(job["job_id"]))
+
+    asyncio.run(main())
+
+
+def test_unknown_kind_is_rejected(tmp_path, registry):
+    queue = _queue(tmp_path)
+    queue.set_handler(_ok)
+    with pytest.raises(ValueError):
+        asyncio.run(queue.submit(b"x", "a.zip", None, kind="bulk"))
+
+
+async def _interrupt(tmp_path, max_attempts: int) -> str:
+    """Chạy 1 job rồi tắt queue giữa chừng như khi server bị tắt; trả job_id."""
+    started = asyncio.Event()
+
+    async def hang(job, progress):
+        started.set()
+        await asyncio.Event().wait()
+
+    queue = _queue(tmp_path, max_attempts=max_attempts)
+    queue.set_handler(hang)
+    job = await queue.submit(b"%PDF", "a.pdf", "doc1")
+    await started.wait()
+    await queue.stop()
+    assert queue.get(job["job_id"])["status"] == "running"
+    return job["job_id"]
+
+
+def test_interrupted_job_is_requeued_on_start(tmp_path, registry):
+    async def main():
+        job_id = await _interrupt(tmp_path, max_attempts=3)
+        assert os.path.exists(_queue(tmp_path).spool_path(job_id))
+
+        restarted = _queue(tmp_path, max_attempts=3)
+        restarted.set_handler(_ok)
+        restarted.start()
+        done = await _wait_finished(restarted, job_id)
+        await restarted.stop()
+        assert done["status"] == "done" and done["attempts"] == 2
+        assert not os.path.exists(restarted.spool_path(job_id))
+
+    asyncio.run(main())
+
+
+def test_job_over_max_attempts_is_failed_and_released(tmp_path, registry):
+    async def main():
+        job_id = await _interrupt(tmp_path, max_attempts=1)
+        registry.claim("doc1", "sha", "a.pdf", job_id)
+
+        restarted = _queue(tmp_path, max_attempts=1)
+        ran = []
+
+        async def handler(job, progress):
+            ran.append(job["id"])
+            return {}
+
+        restarted.set_handler(handler)
+        restarted.start()
+        await asyncio.sleep(0.05)
+        await restarted.stop()
+
+        job = restarted.get(job_id)
+        assert job["status"] == "failed" and "ingest_max_attempts" in job["error"]
+        assert ran == []
+        assert not os.path.exists(restarted.spool_path(job_id))
+        # Tài liệu job đang giữ chỗ được trả lại -> upload lại sẽ ingest lại
+        assert registry.get("doc1")["status"] == "failed"
+
+    asyncio.run(main())
@@ -0,0 +1,122 @@
+# tests/test_ingest_pipeline.py
+"""stream_ingest_many: tài liệu lỗi giữa chừng bị xóa khỏi Milvus và khỏi BM25, tài liệu khác giữ nguyên."""
+import asyncio
+import threading
+
+import pytest
+
+# ingest_pipeline import embedding (FlagEmbedding), milvus_store (pymilvus), tokenizer (transformers)
+pytest.importorskip("FlagEmbedding")
+pytest.importorskip("pymilvus")
+pytest.importorskip("transformers")
+
+from app.core.settings import settings
+from app.services import ingest_pipeline
+from app.services.bm25_index import BM25Accumulator
+from app.services.ingest_pipeline import IngestSource, stream_ingest, stream_ingest_many
+
+
+class _FakeCollection:
+    """Milvus giả: writer.write ghi dòng, delete_document xóa theo document_id."""
+
+    def __init__(self):
+        self.rows = []
+        self.deleted = []
+        self.written = {}   # document_id -> threading.Event, set khi có dòng đầu tiên
+
+    def write(self, rows):
+        self.rows.extend(rows)
+        for r in rows:
+            self.written.setdefault(r["document_id"], threading.Event()).set()
+
+    def delete(self, document_id):
+        self.deleted.append(document_id)
+        self.rows = [r for r in self.rows if r["document_id"] != document_id]
+
+    def document_ids(self):
+        return {r["document_id"] for r in self.rows}
+
+
+class _FakeEmbedder:
+    def __init__(self, fail_after: int = None):
+        self.calls = 0
+        self.fail_after = fail_after
+
+    def encode_documents(self, texts):
+        self.calls += 1
+        if self.fail_after is not None and self.calls > self.fail_after:
+            raise RuntimeError("CUDA OOM")
+        return [[float(len(t))] for t in texts]
+
+
+def _pdf(name: str, pages: int, fail: bool = False) -> bytes:
+    """PDF giả: 'tên:số trang[:boom]' -> lỗi sau khi đã đưa chunk đầu tiên vào pipeline."""
+    return f"{name}:{pages}{':boom' if fail else ''}".encode()
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    collection = _FakeCollection()
+
+    def page_count(pdf_bytes):
+        return int(pdf_bytes.decode().split(":")[1])
+
+    def iter_pages(pdf_bytes):
+        name, n, *fail = pdf_bytes.decode().split(":")
+        for page in range(1, int(n) + 1):
+            yield {"page": page, "text": f"{name} trang {page}", "fail": bool(fail)}
+
+    def iter_hierarchical(pages, **kwargs):
+        for p in pages:
+            yield {"chunk_id": f"parent_{p['page']}", "page_start": p["page"], "page_end": p["page"], "text": p["text"]}, []
+            if p["fail"]:
+                # Chờ chunk đầu của tài liệu này vào Milvus rồi mới lỗi -> có phần insert dở phải dọn
+                name = p["text"].split()[0]
+                collection.written.setdefault(name, threading.Event()).wait(5)
+                raise ValueError("PDF hỏng")
+
+    monkeypatch.setattr(ingest_pipeline, "page_count", page_count)
+    monkeypatch.setattr(ingest_pipeline, "iter_pages", iter_pages)
+    monkeypatch.setattr(ingest_pipeline, "iter_hierarchical", iter_hierarchical)
+    monkeypatch.setattr(ingest_pipeline, "get_writer", lambda c: c)
+    monkeypatch.setattr(ingest_pipeline, "delete_document", lambda c, document_id: c.delete(document_id))
+    monkeypatch.setattr(settings, "ingest_embed_batch_size", 1)
+    return collection
+
+
+def _source(name: str, pages: int, fail: bool = False) -> IngestSource:
+    data = _pdf(name, pages, fail)
+    return IngestSource(name, f"{name}.pdf", lambda: data)
+
+
+def test_failed_document_is_removed_and_others_kept(collection):
+    bm25 = BM25Accumulator()
+    sources = [_source("A", 2), _source("B", 3, fail=True), _source("C", 1)]
+    asyncio.run(stream_ingest_many(sources, _FakeEmbedder(), collection, insert_batch_size=1, bm25=bm25))
+
+    a, b, c = sources
+    assert a.error is None and c.error is None and isinstance(b.error, ValueError)
+    assert b.inserted > 0 and collection.deleted == ["B"]
+    assert collection.document_ids() == {"A", "C"}
+    assert sorted(bm25.document_ids()) == ["A", "C"] and len(bm25) == 3
+    assert b.result()["status"] == "failed" and b.result()["chunks_inserted"] == 0
+    assert a.result()["chunks_inserted"] == 2
+
+
+def test_stage_error_discards_whole_batch(collection):
+    bm25 = BM25Accumulator()
+    sources = [_source("A", 2), _source("B", 2)]
+    with pytest.raises(RuntimeError):
+        asyncio.run(stream_ingest_many(sources, _FakeEmbedder(fail_after=2), collection, insert_batch_size=1, bm25=bm25))
+
+    assert collection.rows == []
+    assert set(collection.deleted) == {s.document_id for s in sources if s.inserted}
+    assert len(bm25) == 0 and bm25.document_ids() == []
+
+
+def test_single_document_error_is_raised(collection):
+    bm25 = BM25Accumulator()
+    with pytest.raises(ValueError):
+        asyncio.run(stream_ingest(_pdf("A", 2, fail=True), "A", "A.pdf", _FakeEmbedder(), collection, bm25=bm25))
+    assert collection.rows == [] and collection.deleted == ["A"]
+    assert len(bm25) == 0
@@ -0,0 +1,91 @@
+# tests/test_rerank_scheduler.py
+"""RerankScheduler: gom cặp của nhiều request vào chung batch, chia lượt công bằng, trả điểm đúng job."""
+import asyncio
+
+import pytest
+
+# rerank_scheduler import LocalReranker (FlagEmbedding) để khai báo kiểu
+pytest.importorskip("FlagEmbedding")
+
+from app.services.rerank_scheduler import RerankScheduler
+
+
+class _FakeReranker:
+    """Điểm = độ dài passage; cache theo (query, passage) như LocalReranker.lookup / store."""
+
+    def __init__(self, fail: bool = False):
+        self.cache = {}
+        self.batches = []
+        self.fail = fail
+
+    def lookup(self, query, passages):
+        keys = [(query, p) for p in passages]
+        return keys, [self.cache.get(k) for k in keys]
+
+    def store(self, key, score):
+        self.cache[key] = score
+
+    def compute(self, pairs):
+        self.batches.append([tuple(p) for p in pairs])
+        if self.fail:
+            raise RuntimeError("CUDA OOM")
+        return [float(len(p)) for _, p in pairs]
+
+
+def _passages(prefix: str, n: int) -> list:
+    return [f"{prefix}{'x' * i}" for i in range(n)]
+
+
+def test_concurrent_requests_share_a_batch():
+    async def main():
+        reranker = _FakeReranker()
+        scheduler = RerankScheduler(reranker, max_batch=64, max_wait_ms=20, quantum=16)
+        a, b = _passages("a", 3), _passages("b", 2)
+        scores_a, scores_b = await asyncio.gather(scheduler.rerank("q1", a), scheduler.rerank("q2", b))
+        assert scores_a == [float(len(p)) for p in a]
+        assert scores_b == [float(len(p)) for p in b]
+        assert len(reranker.batches) == 1 and len(reranker.batches[0]) == 5
+
+    asyncio.run(main())
+
+
+def test_cached_and_duplicate_pairs_are_not_rescored():
+    async def main():
+        reranker = _FakeReranker()
+        scheduler = RerankScheduler(reranker, max_batch=64, max_wait_ms=1)
+        await scheduler.rerank("q", ["một", "hai"])
+        scores = await scheduler.rerank("q", ["một", "ba", "ba"])
+        assert scores == [3.0, 2.0, 2.0]
+        assert reranker.batches[-1] == [("q", "ba")]
+
+        reranker.batches.clear()
+        assert await scheduler.rerank("q", ["một", "hai"]) == [3.0, 3.0]
+        assert reranker.batches == []
+
+    asyncio.run(main())
+
+
+def test_large_request_does_not_starve_small_one():
+    async def main():
+        reranker = _FakeReranker()
+        scheduler = RerankScheduler(reranker, max_batch=4, max_wait_ms=20, quantum=2)
+        big, small = _passages("big", 12), _passages("small", 2)
+        await asyncio.gather(scheduler.rerank("q", big), scheduler.rerank("q", small))
+        # Round-robin 2 cặp / job: request nhỏ xong ngay ở batch đầu, không phải chờ 3 batch của request lớn
+        first = reranker.batches[0]
+        assert sum(p.startswith("small") for _, p in first) == 2
+        assert sum(p.startswith("big") for _, p in first) == 2
+        assert all(len(b) <= 4 for b in reranker.batches)
+
+    asyncio.run(main())
+
+
+def test_compute_error_reaches_every_job():
+    async def main():
+        scheduler = RerankScheduler(_FakeReranker(fail=True), max_batch=64, max_wait_ms=10)
+        results = await asyncio.gather(
+            scheduler.rerank("q1", ["a"]), scheduler.rerank("q2", ["b"]), return_exceptions=True
+        )
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+    asyncio.run(main())
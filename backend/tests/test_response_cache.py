@@ -0,0 +1,60 @@
+# tests/test_response_cache.py
+"""ResponseCache: key theo câu hỏi + lịch sử gần nhất, entry mất hiệu lực khi corpus đổi version."""
+from app.services.response_cache import ResponseCache
+
+_EVENTS = [{"type": "answer", "content": "Điều 1"}]
+
+
+def test_key_normalizes_question_and_uses_recent_history():
+    cache = ResponseCache(maxsize=10, ttl=60, history_turns=2)
+    history = [
+        {"role": "user", "content": "câu đầu"},
+        {"role": "assistant", "content": "trả lời đầu"},
+        {"role": "user", "content": "câu hai"},
+    ]
+    key = cache.make_key("Luật  đất đai?", history)
+    assert key == cache.make_key("luật đất đai?", history)
+    # Tin nhắn ngoài history_turns gần nhất không ảnh hưởng key
+    assert key == cache.make_key("luật đất đai?", [{"role": "user", "content": "khác"}] + history[1:])
+    assert key != cache.make_key("luật đất đai?", history[:2])
+
+
+def test_hit_within_same_corpus_version():
+    cache = ResponseCache(maxsize=10, ttl=60)
+    key = cache.make_key("q", [])
+    cache.put(key, _EVENTS, latency=1.5, corpus_version=cache.corpus_version)
+    entry = cache.get(key)
+    assert entry is not None and entry["events"] == _EVENTS
+
+
+def test_bump_invalidates_existing_entries():
+    cache = ResponseCache(maxsize=10, ttl=60)
+    key = cache.make_key("q", [])
+    cache.put(key, _EVENTS, latency=1.5, corpus_version=cache.corpus_version)
+
+    assert cache.bump_corpus_version() == 1
+    assert cache.get(key) is None
+    assert cache.stale == 1
+    # Entry lỗi thời bị xóa luôn, lần get sau là miss bình thường
+    assert cache.get(key) is None
+    assert cache.stale == 1
+
+
+def test_answer_started_before_ingest_is_stale():
+    cache = ResponseCache(maxsize=10, ttl=60)
+    key = cache.make_key("q", [])
+    # Request bắt đầu ở version 0, ingest xong (version 1) trước khi request ghi cache
+    started_at = cache.corpus_version
+    cache.bump_corpus_version()
+    cache.put(key, _EVENTS, latency=1.5, corpus_version=started_at)
+    assert cache.get(key) is None
+
+    cache.put(key, _EVENTS, latency=1.5, corpus_version=cache.corpus_version)
+    assert cache.get(key) is not None
+
+
+def test_record_replay_counts_saved_time():
+    cache = ResponseCache(maxsize=10, ttl=60)
+    cache.record_replay({"latency": 2.0}, replay_seconds=0.5)
+    cache.record_replay({"latency": 0.1}, replay_seconds=0.5)
+    assert cache.stats()["saved_seconds"] == 1.5
@@ -0,0 +1,95 @@
+# tests/test_router.py
+"""Router 3 tầng: luật -> embedding (câu mẫu) -> LLM; tầng sau chỉ chạy khi tầng trước không chắc."""
+import asyncio
+
+import numpy as np
+import pytest
+
+from app.core.settings import settings
+from app.services import router
+
+_GENERAL = set(router._PROTOTYPES["GENERAL"])
+_RAG = set(router._PROTOTYPES["RAG"])
+
+
+def _fake_embedder(question_vec):
+    """Câu mẫu GENERAL -> trục x, RAG -> trục y, câu hỏi -> question_vec (đã normalize)."""
+    calls = []
+
+    async def embed_queries(texts):
+        calls.append(list(texts))
+        out = []
+        for t in texts:
+            if t in _GENERAL:
+                out.append([1.0, 0.0])
+            elif t in _RAG:
+                out.append([0.0, 1.0])
+            else:
+                v = np.asarray(question_vec, dtype=np.float32)
+                out.append((v / np.linalg.norm(v)).tolist())
+        return out
+
+    embed_queries.calls = calls
+    return embed_queries
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    """Thay LLM router bằng hàm giả trả 'RAG', ghi lại câu hỏi được gửi lên."""
+    asked = []
+
+    async def fake_llm(question):
+        asked.append(question)
+        return "RAG"
+
+    monkeypatch.setattr(router, "_route_with_llm", fake_llm)
+    monkeypatch.setattr(router, "_classifier", router._PrototypeClassifier())
+    monkeypatch.setattr(settings, "router_local_enabled", True)
+    return asked
+
+
+@pytest.mark.parametrize("question", ["Xin chào!", "cảm ơn bạn nhiều", "   ", "sửa giúp ```print(1)```", "Hi there"])
+def test_rules_answer_general(question):
+    assert router._rule_route(question) == "GENERAL"
+
+
+@pytest.mark.parametrize("question", ["Chào mừng kỳ họp thứ 8 có gì?", "Viết code đọc file CSV", "Luật đất đai 2024"])
+def test_rules_leave_ambiguous_questions(question):
+    assert router._rule_route(question) is None
+
+
+def test_rule_tier_skips_embedding_and_llm(llm):
+    embed = _fake_embedder([0.0, 1.0])
+    assert asyncio.run(router.route_query("Xin chào", embed)) == "GENERAL"
+    assert embed.calls == [] and llm == []
+
+
+def test_embedding_tier_decides_when_confident(llm):
+    embed = _fake_embedder([1.0, 0.05])
+    assert asyncio.run(router.route_query("Viết hàm sắp xếp", embed)) == "GENERAL"
+    assert llm == []
+
+    embed = _fake_embedder([0.05, 1.0])
+    assert asyncio.run(router.route_query("Điều 5 quy định gì?", embed)) == "RAG"
+    assert llm == []
+
+
+def test_ambiguous_embedding_falls_back_to_llm(llm):
+    # Gần cả 2 nhãn như nhau -> chênh lệch < router_embed_margin -> hỏi LLM
+    embed = _fake_embedder([1.0, 1.0])
+    assert asyncio.run(router.route_query("Cái này là sao?", embed)) == "RAG"
+    assert llm == ["Cái này là sao?"]
+
+
+def test_embedding_error_falls_back_to_llm(llm):
+    async def broken(texts):
+        raise RuntimeError("model chưa load")
+
+    assert asyncio.run(router.route_query("Cái này là sao?", broken)) == "RAG"
+    assert llm == ["Cái này là sao?"]
+
+
+def test_local_tiers_disabled_goes_straight_to_llm(llm, monkeypatch):
+    monkeypatch.setattr(settings, "router_local_enabled", False)
+    assert asyncio.run(router.route_query("Xin chào", _fake_embedder([1.0, 0.0]))) == "RAG"
+    assert llm == ["Xin chào"]
@@ -0,0 +1,102 @@
+# tests/test_single_flight_cache.py
+"""AsyncSingleFlightCache: gộp lần gọi trùng key, hủy 1 request không hủy lần gọi chung."""
+import asyncio
+
+import pytest
+
+from app.utils.cache import AsyncSingleFlightCache
+
+
+class _Compute:
+    """Coroutine đếm số lần chạy, chờ gate rồi trả value."""
+
+    def __init__(self, value="kết quả"):
+        self.value = value
+        self.calls = 0
+        self.cancelled = 0
+        self.gate = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        try:
+            await self.gate.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return self.value
+
+
+def test_concurrent_requests_share_one_call():
+    async def main():
+        cache = AsyncSingleFlightCache(maxsize=10)
+        compute = _Compute()
+        tasks = [asyncio.create_task(cache.get_or_compute("k", compute)) for _ in range(3)]
+        await asyncio.sleep(0)
+        compute.gate.set()
+        assert await asyncio.gather(*tasks) == ["kết quả"] * 3
+        assert compute.calls == 1 and cache.shared == 2
+
+        # Đã cache -> không gọi lại
+        assert await cache.get_or_compute("k", compute) == "kết quả"
+        assert compute.calls == 1
+
+    asyncio.run(main())
+
+
+def test_cancelling_one_waiter_keeps_call_for_others():
+    async def main():
+        cache = AsyncSingleFlightCache(maxsize=10)
+        compute = _Compute()
+        first = asyncio.create_task(cache.get_or_compute("k", compute))
+        second = asyncio.create_task(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0)
+
+        first.cancel()
+        await asyncio.sleep(0)
+        assert compute.cancelled == 0
+
+        compute.gate.set()
+        assert await second == "kết quả"
+        assert first.cancelled()
+        assert cache.cancelled == 0 and compute.calls == 1
+
+    asyncio.run(main())
+
+
+def test_cancelling_last_waiter_cancels_call():
+    async def main():
+        cache = AsyncSingleFlightCache(maxsize=10)
+        compute = _Compute()
+        only = asyncio.create_task(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0)
+
+        only.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await only
+        await asyncio.sleep(0)
+        assert compute.cancelled == 1 and cache.cancelled == 1
+        assert cache.stats()["inflight"] == 0
+
+        # Lần gọi bị hủy không được cache; request sau gọi lại từ đầu
+        retry = _Compute("lần 2")
+        retry.gate.set()
+        assert await cache.get_or_compute("k", retry) == "lần 2"
+
+    asyncio.run(main())
+
+
+def test_errors_are_not_cached():
+    async def main():
+        cache = AsyncSingleFlightCache(maxsize=10)
+
+        async def boom():
+            raise RuntimeError("LLM lỗi")
+
+        with pytest.raises(RuntimeError):
+            await cache.get_or_compute("k", boom)
+
+        ok = _Compute()
+        ok.gate.set()
+        assert await cache.get_or_compute("k", ok) == "kết quả"
+
+    asyncio.run(main())